@@ -0,0 +1,204 @@
+"""
+Archival of aged visitor log partitions.
+
+The raw visitor log is split into monthly partitions (app/visitors.py). The
+live database keeps the current month and the VISITOR_LIVE_MONTHS - 1
+before it, which covers every admin filter except "all". Once a month falls
+out of that window the archiver, on one worker (the holder of the
+worker-0.lock slot in VISITOR_ARCHIVE_DIR):
+
+  1. exports its visits to VISITOR_ARCHIVE_DIR/visitors-YYYY-MM.ndjson.gz,
+     one JSON object per visit, oldest first
+  2. writes visitors-YYYY-MM.json next to it: visit count and per-path totals
+  3. drops the partition, with the month's hourly rollups and per-day IP and
+     path counters
+
+Daily rollups and per-IP totals (visitor_stats) stay live, so all-time visit
+counts, unique IPs and the most active IP need no archive reads. All-time top
+paths add the archived per-path totals (path_totals). The summary is written
+last and marks the month as archived. A crash before that redoes the export
+on the next run.
+"""
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .db import Database
+from .visitors import LEGACY_PARTITION, VISITOR_COLUMNS, list_partitions, rebuild_view
+
+VISITOR_LIVE_MONTHS = 3  # current month included; 3 is the least that covers the 30-day admin filter
+VISITOR_ARCHIVE_DIR = "visitor-archive"
+VISITOR_ARCHIVE_INTERVAL = 6 * 3600  # seconds between archive runs
+ARCHIVE_CHUNK = 10000  # rows per fetch while exporting
+
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12}-{mon % 12 + 1:02d}"
+
+
+def oldest_live_month(now: datetime, live_months: int = VISITOR_LIVE_MONTHS) -> str:
+    index = now.year * 12 + now.month - 1 - (live_months - 1)
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+
+def aged_months(conn: sqlite3.Connection, oldest_live: str) -> List[Tuple[str, List[str]]]:
+    """(month, tables holding its visits) for months older than oldest_live, oldest first."""
+    out: Dict[str, List[str]] = {}
+    for name in list_partitions(conn):
+        if name == LEGACY_PARTITION:
+            # the pre-partitioning table: archive it month by month
+            row = conn.execute(f"SELECT MIN(timestamp) FROM {name}").fetchone()
+            month = row[0][:7] if row[0] else None
+            while month is not None and month < oldest_live:
+                out.setdefault(month, []).append(name)
+                month = _next_month(month)
+        else:
+            month = name[len("visitors_"):].replace("_", "-")
+            if month < oldest_live:
+                out.setdefault(month, []).append(name)
+    return sorted(out.items())
+
+
+def export_month(conn: sqlite3.Connection, tables: List[str], month: str, path: str) -> Dict:
+    """Write the month's visits to path (gzipped NDJSON) and return the summary."""
+    start, end = f"{month}-01", f"{_next_month(month)}-01"
+    rows = 0
+    columns = ", ".join(VISITOR_COLUMNS)
+    with open(path, "wb") as raw:
+        with gzip.open(raw, "wt", encoding="utf-8") as out:
+            cur = conn.execute(
+                " UNION ALL ".join(
+                    f"SELECT {columns} FROM {t} WHERE timestamp >= :start AND timestamp < :end" for t in tables
+                ) + " ORDER BY timestamp, id",
+                {"start": start, "end": end},
+            )
+            while True:
+                chunk = cur.fetchmany(ARCHIVE_CHUNK)
+                if not chunk:
+                    break
+                for row in chunk:
+                    out.write(json.dumps(dict(zip(VISITOR_COLUMNS, row)), separators=(",", ":")) + "\n")
+                rows += len(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
+    # per-path totals from the same counters the live stats use
+    paths = conn.execute(
+        "SELECT path, SUM(visits) FROM visitor_path_daily WHERE day >= ? AND day < ? GROUP BY path",
+        (start, end),
+    ).fetchall()
+    return {"month": month, "visits": rows, "file": os.path.basename(path), "paths": dict(paths),
+            "archived": time.time()}
+
+
+def drop_month(conn: sqlite3.Connection, tables: List[str], month: str):
+    """Remove an archived month from the live database."""
+    start, end = f"{month}-01", f"{_next_month(month)}-01"
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in tables:
+            if table == LEGACY_PARTITION:
+                conn.execute(f"DELETE FROM {table} WHERE timestamp >= ? AND timestamp < ?", (start, end))
+                if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+                    conn.execute(f"DROP TABLE {table}")
+            else:
+                conn.execute(f"DROP TABLE {table}")
+        rebuild_view(conn)
+        conn.execute("DELETE FROM visitor_rollup_hourly WHERE hour >= ? AND hour < ?", (start, end))
+        conn.execute("DELETE FROM visitor_ip_daily WHERE day >= ? AND day < ?", (start, end))
+        conn.execute("DELETE FROM visitor_path_daily WHERE day >= ? AND day < ?", (start, end))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+class VisitorArchiver:
+    def __init__(self, db: Database, directory: str = VISITOR_ARCHIVE_DIR,
+                 live_months: int = VISITOR_LIVE_MONTHS, interval: float = VISITOR_ARCHIVE_INTERVAL):
+        self.db = db
+        self.directory = directory
+        self.live_months = max(3, live_months)
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._totals: Tuple[tuple, Counter] = ((), Counter())  # (summary files + mtimes, path totals)
+        self.stats = {"runs": 0, "months": 0, "rows": 0, "errors": 0}
+
+    def _paths(self, month: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, f"visitors-{month}")
+        return base + ".ndjson.gz", base + ".json"
+
+    async def run_once(self, now: Optional[datetime] = None) -> List[str]:
+        """Archive every month past the live window; returns the months archived."""
+        oldest = oldest_live_month(now or datetime.now(), self.live_months)
+        months = await self.db.read(aged_months, oldest)
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        done = []
+        for month, tables in months:
+            data_path, summary_path = self._paths(month)
+            summary = await self.db.read(export_month, tables, month, data_path + ".tmp", name="archive_export")
+            await asyncio.to_thread(_publish, data_path, summary_path, summary)
+            await self.db.write(drop_month, tables, month, name="archive_drop")
+            self.stats["months"] += 1
+            self.stats["rows"] += summary["visits"]
+            done.append(month)
+        self.stats["runs"] += 1
+        return done
+
+    async def _run(self):
+        while True:
+            try:
+                months = await self.run_once()
+                if months:
+                    print(f"Archived visitor months {', '.join(months)} to {self.directory}")
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error archiving visitor log: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def path_totals(self) -> Counter:
+        """Visits per path over all archived months (re-read only when the summaries change)."""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.startswith("visitors-") and n.endswith(".json"))
+            key = tuple((n, os.path.getmtime(os.path.join(self.directory, n))) for n in names)
+        except OSError:
+            return Counter()
+        if key != self._totals[0]:
+            totals: Counter = Counter()
+            for name in names:
+                with open(os.path.join(self.directory, name)) as f:
+                    totals.update(json.load(f)["paths"])
+            self._totals = (key, totals)
+        return self._totals[1]
+
+    def metrics(self) -> Dict:
+        return dict(self.stats)
+
+
+def _publish(data_path: str, summary_path: str, summary: Dict):
+    os.replace(data_path + ".tmp", data_path)
+    tmp = summary_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(summary, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, summary_path)
@@ -0,0 +1,133 @@
+"""
+Bulk status checks: many HTTP and TCP targets in one request.
+
+Targets are de-duplicated and grouped by host. Each host is resolved and
+vetted once, at most BULK_PER_HOST of its checks run at a time (so one slow
+site can't take every slot, and its checks share pooled connections), and
+at most BULK_CONCURRENCY checks run overall. Results are yielded in
+completion order.
+
+The check functions are injected by the app so bulk checks go through the
+same probes, result cache and history recording as the single endpoints.
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BULK_MAX_TARGETS = 500
+BULK_CONCURRENCY = 100
+BULK_PER_HOST = 6
+
+# check(target, vetted addresses) -> result dict with an "up" flag
+Check = Callable[["BulkTarget", List[str]], Awaitable[Dict]]
+
+
+class BulkTarget:
+    def __init__(self, kind: str, host: str, port: Optional[int] = None, url: Optional[str] = None):
+        self.kind = kind  # "http" or "tcp"
+        self.host = host
+        self.port = port
+        self.url = url
+        self.indexes: List[int] = []  # positions in the request, duplicates included
+
+    @property
+    def key(self) -> Tuple:
+        return ("http", self.url) if self.kind == "http" else ("tcp", self.host, self.port)
+
+    @property
+    def label(self) -> str:
+        if self.kind == "http":
+            return self.url
+        return f"[{self.host}]:{self.port}" if ":" in self.host else f"{self.host}:{self.port}"
+
+
+def _parse_target(item: Any) -> BulkTarget:
+    if isinstance(item, str):
+        if "://" in item:
+            item = {"url": item}
+        else:
+            host, sep, port = item.rpartition(":")
+            if not sep:
+                raise ValueError(f"{item!r}: expected a URL or host:port")
+            item = {"host": host.strip("[]"), "port": port}
+    if not isinstance(item, dict):
+        raise ValueError("targets must be URLs, host:port strings or objects")
+    if item.get("url"):
+        url = item["url"]
+        if not url.startswith(("http://", "https://")):
+            raise ValueError(f"{url!r}: url must start with http:// or https://")
+        try:
+            parsed = httpx.URL(url)
+        except Exception:
+            raise ValueError(f"{url!r}: invalid url")
+        if not parsed.host:
+            raise ValueError(f"{url!r}: url has no host")
+        return BulkTarget("http", parsed.host.lower(), url=str(parsed.copy_with(fragment=None)))
+    host = item.get("host")
+    if not host:
+        raise ValueError("each target needs a url or a host and port")
+    try:
+        port = int(item.get("port", 80))
+    except (TypeError, ValueError):
+        raise ValueError(f"{host}: port must be a number")
+    if not 1 <= port <= 65535:
+        raise ValueError(f"{host}: port must be between 1 and 65535")
+    return BulkTarget("tcp", host.lower(), port=port)
+
+
+def parse_targets(items: Any, limit: int = BULK_MAX_TARGETS) -> List[BulkTarget]:
+    """Validate and de-duplicate targets, keeping first-seen order. Raises ValueError."""
+    if not isinstance(items, list) or not items:
+        raise ValueError("targets must be a non-empty list")
+    if len(items) > limit:
+        raise ValueError(f"at most {limit} targets per request")
+    unique: Dict[Tuple, BulkTarget] = {}
+    for i, item in enumerate(items):
+        target = _parse_target(item)
+        target = unique.setdefault(target.key, target)
+        target.indexes.append(i)
+    return list(unique.values())
+
+
+async def run_bulk(targets: List[BulkTarget], vet: Callable[[str], Awaitable[List[str]]],
+                   checks: Dict[str, Check], concurrency: int = BULK_CONCURRENCY,
+                   per_host: int = BULK_PER_HOST) -> AsyncIterator[Dict]:
+    """
+    Run every check and yield one record per target as it finishes. Outstanding
+    checks are cancelled if the consumer stops iterating early.
+    """
+    global_sem = asyncio.Semaphore(max(1, min(concurrency, BULK_CONCURRENCY)))
+    host_sems: Dict[str, asyncio.Semaphore] = {}
+    resolved: Dict[str, asyncio.Future] = {}
+
+    async def run(target: BulkTarget) -> Dict:
+        record = {"index": target.indexes, "type": target.kind, "target": target.label}
+        start = time.perf_counter()
+        try:
+            addrs = await asyncio.shield(resolved[target.host])
+            async with host_sems[target.host], global_sem:
+                start = time.perf_counter()
+                record.update(await checks[target.kind](target, addrs))
+        except Exception as e:
+            record.update(up=False, error=str(getattr(e, "detail", None) or e) or type(e).__name__)
+        record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return record
+
+    for target in targets:
+        if target.host not in resolved:
+            resolved[target.host] = asyncio.ensure_future(vet(target.host))
+            host_sems[target.host] = asyncio.Semaphore(per_host)
+    tasks = [asyncio.ensure_future(run(t)) for t in targets]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks + list(resolved.values()):
+            if not t.done():
+                t.cancel()
+        # failed lookups whose targets were cancelled shouldn't log "exception never retrieved"
+        for f in resolved.values():
+            if f.done() and not f.cancelled():
+                f.exception()
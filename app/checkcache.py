@@ -0,0 +1,143 @@
+"""
+Short-lived cache for check results with single-flight request coalescing.
+
+When many users check the same target at once, only the first request
+probes it; concurrent identical checks wait for that probe, and later ones
+within CHECK_CACHE_TTL reuse its result. Entries are evicted LRU-first once
+their estimated size exceeds CHECK_CACHE_MAX_BYTES.
+
+With a shared state store (several uvicorn workers) results are also written
+there, and a local miss is looked up in the store before probing, so a
+target checked through one worker is served from cache by the others.
+Coalescing of in-flight probes stays per process.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException
+
+CHECK_CACHE_TTL = 10.0  # seconds
+CHECK_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+class CheckCache:
+    def __init__(self, ttl: float = CHECK_CACHE_TTL, max_bytes: int = CHECK_CACHE_MAX_BYTES, shared=None):
+        self.ttl = ttl
+        self.shared = shared  # shared state store (app/state.py) or None
+        self.max_bytes = max_bytes
+        # key -> (created_at, size, result or HTTPException)
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "shared_hits": 0}
+
+    def metrics(self) -> Dict:
+        data = dict(self.stats)
+        data["entries"] = len(self._entries)
+        data["bytes"] = self.size
+        data["inflight"] = len(self._inflight)
+        return data
+
+    def _lookup(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, size, value = entry
+        if time.monotonic() - created >= self.ttl:
+            del self._entries[key]
+            self.size -= size
+            return None
+        self._entries.move_to_end(key)
+        return created, value
+
+    def _store(self, key: Hashable, value: Any, age: float = 0.0):
+        if isinstance(value, HTTPException):
+            size = len(str(value.detail)) + 64
+        else:
+            size = len(json.dumps(value, default=str))
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._entries[key] = (time.monotonic() - age, size, value)
+        self.size += size
+        while self.size > self.max_bytes and self._entries:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.stats["evictions"] += 1
+
+    async def _shared_lookup(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        entry = await self.shared.get("check", json.dumps(key))
+        if entry is None:
+            return None
+        age = time.time() - entry["created"]
+        if "error" in entry:
+            status, detail = entry["error"]
+            return age, HTTPException(status, detail)
+        return age, entry["value"]
+
+    async def _shared_store(self, key: Hashable, value: Any):
+        entry = {"created": time.time()}
+        if isinstance(value, HTTPException):
+            entry["error"] = [value.status_code, value.detail]
+        else:
+            entry["value"] = value
+        await self.shared.set("check", json.dumps(key), entry, ttl=self.ttl)
+
+    async def _run(self, key: Hashable, probe: Callable[[], Awaitable[Any]]):
+        try:
+            value = await probe()
+        except HTTPException as e:
+            # failed checks ("it's down") are results too
+            self._store(key, e)
+            if self.shared is not None:
+                await self._shared_store(key, e)
+            raise
+        self._store(key, value)
+        if self.shared is not None:
+            await self._shared_store(key, value)
+        return value
+
+    async def get(self, key: Hashable, probe: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool, float]:
+        """
+        Return (result, cached, age_seconds) for key, running probe() only if
+        there is neither a fresh cached result nor an identical probe in flight.
+        """
+        found = self._lookup(key)
+        if found is not None:
+            self.stats["hits"] += 1
+            created, value = found
+            if isinstance(value, HTTPException):
+                raise value
+            return value, True, time.monotonic() - created
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task), True, 0.0
+
+        if self.shared is not None:
+            found = await self._shared_lookup(key)
+            if found is not None:
+                self.stats["shared_hits"] += 1
+                age, value = found
+                self._store(key, value, age)
+                if isinstance(value, HTTPException):
+                    raise value
+                return value, True, age
+            # an identical check may have started while the store was read
+            task = self._inflight.get(key)
+            if task is not None:
+                self.stats["coalesced"] += 1
+                return await asyncio.shield(task), True, 0.0
+
+        self.stats["misses"] += 1
+        task = asyncio.ensure_future(self._run(key, probe))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), False, 0.0
+
+
+check_cache = CheckCache()
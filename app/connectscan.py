@@ -0,0 +1,339 @@
+"""
+In-process TCP connect scan, equivalent to `nmap -sT --top-ports N --open`.
+
+Lets /api/nmap and /api/nmap/stream work without forking an nmap process per
+request. The port table follows nmap's frequency order for the top 100 ports;
+the remainder of the top 1000 set is probed in ascending order.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
+
+from .scanner import global_semaphore
+
+_TOP_100 = (
+    80, 23, 443, 21, 22, 25, 3389, 110, 445, 139, 143, 53, 135, 3306, 8080, 1723,
+    111, 995, 993, 5900, 1025, 587, 8888, 199, 1720, 465, 548, 113, 81, 6001, 10000,
+    514, 5060, 179, 1026, 2000, 8443, 8000, 32768, 554, 26, 1433, 49152, 2001, 515,
+    8008, 49154, 1027, 5666, 646, 5000, 5631, 631, 49153, 8081, 2049, 88, 79, 5800,
+    106, 2121, 1110, 49155, 6000, 513, 990, 5357, 427, 49156, 543, 544, 5101, 144,
+    7, 389, 8009, 3128, 444, 9999, 5009, 7070, 5190, 3000, 5432, 1900, 3986, 13,
+    1029, 9, 5051, 6646, 49157, 1028, 873, 1755, 2717, 4899, 9100, 119, 37,
+)
+
+# nmap's top 1000 TCP ports (same set as `nmap -sT --top-ports 1000`)
+_TOP_1000_RANGES = (
+    "1,3-4,6-7,9,13,17,19-26,30,32-33,37,42-43,49,53,70,79-85,88-90,99-100,106,"
+    "109-111,113,119,125,135,139,143-144,146,161,163,179,199,211-212,222,254-256,"
+    "259,264,280,301,306,311,340,366,389,406-407,416-417,425,427,443-445,458,"
+    "464-465,481,497,500,512-515,524,541,543-545,548,554-555,563,587,593,616-617,"
+    "625,631,636,646,648,666-668,683,687,691,700,705,711,714,720,722,726,749,765,"
+    "777,783,787,800-801,808,843,873,880,888,898,900-903,911-912,981,987,990,"
+    "992-993,995,999-1002,1007,1009-1011,1021-1100,1102,1104-1108,1110-1114,1117,"
+    "1119,1121-1124,1126,1130-1132,1137-1138,1141,1145,1147-1149,1151-1152,1154,"
+    "1163-1166,1169,1174-1175,1183,1185-1187,1192,1198-1199,1201,1213,1216-1218,"
+    "1233-1234,1236,1244,1247-1248,1259,1271-1272,1277,1287,1296,1300-1301,"
+    "1309-1311,1322,1328,1334,1352,1417,1433-1434,1443,1455,1461,1494,1500-1501,"
+    "1503,1521,1524,1533,1556,1580,1583,1594,1600,1641,1658,1666,1687-1688,1700,"
+    "1717-1721,1723,1755,1761,1782-1783,1801,1805,1812,1839-1840,1862-1864,1875,"
+    "1900,1914,1935,1947,1971-1972,1974,1984,1998-2010,2013,2020-2022,2030,"
+    "2033-2035,2038,2040-2043,2045-2049,2065,2068,2099-2100,2103,2105-2107,2111,"
+    "2119,2121,2126,2135,2144,2160-2161,2170,2179,2190-2191,2196,2200,2222,2251,"
+    "2260,2288,2301,2323,2366,2381-2383,2393-2394,2399,2401,2492,2500,2522,2525,"
+    "2557,2601-2602,2604-2605,2607-2608,2638,2701-2702,2710,2717-2718,2725,2800,"
+    "2809,2811,2869,2875,2909-2910,2920,2967-2968,2998,3000-3001,3003,3005-3007,"
+    "3011,3013,3017,3030-3031,3052,3071,3077,3128,3168,3211,3221,3260-3261,"
+    "3268-3269,3283,3300-3301,3306,3322-3325,3333,3351,3367,3369-3372,3389-3390,"
+    "3404,3476,3493,3517,3527,3546,3551,3580,3659,3689-3690,3703,3737,3766,3784,"
+    "3800-3801,3809,3814,3826-3828,3851,3869,3871,3878,3880,3889,3905,3914,3918,"
+    "3920,3945,3971,3986,3995,3998,4000-4006,4045,4111,4125-4126,4129,4224,4242,"
+    "4279,4321,4343,4443-4446,4449,4550,4567,4662,4848,4899-4900,4998,5000-5004,"
+    "5009,5030,5033,5050-5051,5054,5060-5061,5080,5087,5100-5102,5120,5190,5200,"
+    "5214,5221-5222,5225-5226,5269,5280,5298,5357,5405,5414,5431-5432,5440,5500,"
+    "5510,5544,5550,5555,5560,5566,5631,5633,5666,5678-5679,5718,5730,5800-5802,"
+    "5810-5811,5815,5822,5825,5850,5859,5862,5877,5900-5904,5906-5907,5910-5911,"
+    "5915,5922,5925,5950,5952,5959-5963,5987-5989,5998-6007,6009,6025,6059,"
+    "6100-6101,6106,6112,6123,6129,6156,6346,6389,6502,6510,6543,6547,6565-6567,"
+    "6580,6646,6666-6669,6689,6692,6699,6779,6788-6789,6792,6839,6881,6901,6969,"
+    "7000-7002,7004,7007,7019,7025,7070,7100,7103,7106,7200-7201,7402,7435,7443,"
+    "7496,7512,7625,7627,7676,7741,7777-7778,7800,7911,7920-7921,7937-7938,"
+    "7999-8002,8007-8011,8021-8022,8031,8042,8045,8080-8090,8093,8099-8100,"
+    "8180-8181,8192-8194,8200,8222,8254,8290-8292,8300,8333,8383,8400,8402,8443,"
+    "8500,8600,8649,8651-8652,8654,8701,8800,8873,8888,8899,8994,9000-9003,"
+    "9009-9011,9040,9050,9071,9080-9081,9090-9091,9099-9103,9110-9111,9200,9207,"
+    "9220,9290,9415,9418,9485,9500,9502-9503,9535,9575,9593-9595,9618,9666,"
+    "9876-9878,9898,9900,9917,9929,9943-9944,9968,9998-10004,10009-10010,10012,"
+    "10024-10025,10082,10180,10215,10243,10566,10616-10617,10621,10626,"
+    "10628-10629,10778,11110-11111,11967,12000,12174,12265,12345,13456,13722,"
+    "13782-13783,14000,14238,14441-14442,15000,15002-15004,15660,15742,"
+    "16000-16001,16012,16016,16018,16080,16113,16992-16993,17877,17988,18040,"
+    "18101,18988,19101,19283,19315,19350,19780,19801,19842,20000,20005,20031,"
+    "20221-20222,20828,21571,22939,23502,24444,24800,25734-25735,26214,27000,"
+    "27352-27353,27355-27356,27715,28201,30000,30718,30951,31038,31337,"
+    "32768-32785,33354,33899,34571-34573,35500,38292,40193,40911,41511,42510,"
+    "44176,44442-44443,44501,45100,48080,49152-49161,49163,49165,49167,"
+    "49175-49176,49400,49999-50003,50006,50300,50389,50500,50636,50800,51103,"
+    "51493,52673,52822,52848,52869,54045,54328,55055-55056,55555,55600,"
+    "56737-56738,57294,57797,58080,60020,60443,61532,61900,62078,63331,64623,"
+    "64680,65000,65129,65389"
+)
+
+
+def _expand(ranges: str) -> List[int]:
+    ports = []
+    for part in ranges.split(","):
+        start, _, end = part.partition("-")
+        ports.extend(range(int(start), int(end or start) + 1))
+    return ports
+
+
+_head = set(_TOP_100)
+TOP_TCP_PORTS: List[int] = list(_TOP_100) + [p for p in _expand(_TOP_1000_RANGES) if p not in _head]
+
+# Service names as printed by nmap for the most common ports
+SERVICES = {
+    7: "echo", 9: "discard", 13: "daytime", 21: "ftp", 22: "ssh", 23: "telnet",
+    25: "smtp", 26: "rsftp", 37: "time", 53: "domain", 79: "finger", 80: "http",
+    81: "hosts2-ns", 88: "kerberos-sec", 106: "pop3pw", 110: "pop3", 111: "rpcbind",
+    113: "ident", 119: "nntp", 135: "msrpc", 139: "netbios-ssn", 143: "imap",
+    144: "news", 179: "bgp", 199: "smux", 389: "ldap", 427: "svrloc", 443: "https",
+    444: "snpp", 445: "microsoft-ds", 465: "smtps", 513: "login", 514: "shell",
+    515: "printer", 543: "klogin", 544: "kshell", 548: "afp", 554: "rtsp",
+    587: "submission", 631: "ipp", 646: "ldp", 873: "rsync", 990: "ftps",
+    993: "imaps", 995: "pop3s", 1025: "NFS-or-IIS", 1026: "LSA-or-nterm",
+    1027: "IIS", 1028: "unknown", 1029: "ms-lsa", 1110: "nfsd-status",
+    1433: "ms-sql-s", 1720: "h323q931", 1723: "pptp", 1755: "wms", 1900: "upnp",
+    2000: "cisco-sccp", 2001: "dc", 2049: "nfs", 2121: "ccproxy-ftp",
+    2717: "pn-requester", 3000: "ppp", 3128: "squid-http", 3306: "mysql",
+    3389: "ms-wbt-server", 3986: "mapper-ws_ethd", 4899: "radmin", 5000: "upnp",
+    5009: "airport-admin", 5051: "ida-agent", 5060: "sip", 5101: "admdog",
+    5190: "aol", 5357: "wsdapi", 5432: "postgresql", 5631: "pcanywheredata",
+    5666: "nrpe", 5800: "vnc-http", 5900: "vnc", 6000: "X11", 6001: "X11:1",
+    6646: "unknown", 7070: "realserver", 8000: "http-alt", 8008: "http",
+    8009: "ajp13", 8080: "http-proxy", 8081: "blackice-icecap", 8443: "https-alt",
+    8888: "sun-answerbook", 9100: "jetdirect", 9999: "abyss", 10000: "snet-sensor-mgmt",
+    32768: "filenet-tms", 49152: "unknown", 49153: "unknown", 49154: "unknown",
+    49155: "unknown", 49156: "unknown", 49157: "unknown",
+}
+
+# Adaptive timeout bounds (seconds), similar to nmap's default timing template
+INITIAL_RTT_TIMEOUT = 1.0
+MIN_RTT_TIMEOUT = 0.1
+MAX_RTT_TIMEOUT = 3.0
+SCAN_CONCURRENCY = 200
+PROGRESS_STEP = 5.0  # percent of ports scanned between progress events
+
+
+def service_name(port: int) -> str:
+    return SERVICES.get(port, "unknown")
+
+
+def top_ports(n: int) -> List[int]:
+    return TOP_TCP_PORTS[:n]
+
+
+class AdaptiveTimeout:
+    """
+    Per-scan connect timeout derived from observed RTTs (RFC 6298 smoothing,
+    as nmap does). Both accepted and refused connects count as samples.
+    """
+
+    def __init__(self, initial=INITIAL_RTT_TIMEOUT, minimum=MIN_RTT_TIMEOUT, maximum=MAX_RTT_TIMEOUT):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self._value = initial
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self._value = self.srtt + 4 * self.rttvar
+
+    @property
+    def value(self) -> float:
+        return min(self.maximum, max(self.minimum, self._value))
+
+
+async def probe(addr: str, port: int, timeouts: AdaptiveTimeout) -> Dict:
+    """Connect to one port and classify it as open, closed or filtered."""
+    async with global_semaphore():
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(addr, port), timeout=timeouts.value
+            )
+        except asyncio.TimeoutError:
+            return {"port": port, "state": "filtered", "service": service_name(port)}
+        except ConnectionRefusedError:
+            rtt = time.perf_counter() - start
+            timeouts.sample(rtt)
+            return {"port": port, "state": "closed", "service": service_name(port), "rtt_ms": rtt * 1000.0}
+        except OSError:
+            return {"port": port, "state": "filtered", "service": service_name(port)}
+        rtt = time.perf_counter() - start
+        timeouts.sample(rtt)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+        return {"port": port, "state": "open", "service": service_name(port), "rtt_ms": rtt * 1000.0}
+
+
+async def connect_scan(addr: str, ports: List[int], concurrency: int = SCAN_CONCURRENCY) -> AsyncIterator[Dict]:
+    """Probe ports concurrently, yielding each result as it completes."""
+    timeouts = AdaptiveTimeout()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(port: int) -> Dict:
+        async with sem:
+            return await probe(addr, port, timeouts)
+
+    tasks = [asyncio.ensure_future(bounded(p)) for p in ports]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+class ScanReport:
+    """
+    Collects results of one scan and renders nmap-style text or JSON. Only
+    open ports are kept; closed and filtered ports are counted, so memory
+    doesn't grow with the number of ports scanned.
+    """
+
+    def __init__(self, host: str, addr: str, ports: List[int], banner: str = "Nmap-compatible connect scan"):
+        self.host = host
+        self.addr = addr
+        self.ports = ports
+        self.banner = banner
+        self.started = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.elapsed = 0.0
+        self.open: List[Dict] = []
+        self.counts = {"closed": 0, "filtered": 0}
+        self.scanned = 0
+        self.rtt_ms: Optional[float] = None  # lowest RTT seen, reported as the host latency
+        self.up: Optional[bool] = None  # set when the scanner reports host status itself (nmap)
+
+    def add(self, result: Dict):
+        self.scanned += 1
+        if result["state"] == "open":
+            self.open.append(result)
+        else:
+            self.counts[result["state"]] = self.counts.get(result["state"], 0) + 1
+        rtt = result.get("rtt_ms")
+        if rtt is not None and (self.rtt_ms is None or rtt < self.rtt_ms):
+            self.rtt_ms = rtt
+
+    def finish(self, elapsed: Optional[float] = None):
+        self.elapsed = elapsed if elapsed is not None else time.perf_counter() - self._t0
+
+    @property
+    def open_ports(self) -> List[Dict]:
+        return sorted(self.open, key=lambda r: r["port"])
+
+    @property
+    def host_up(self) -> bool:
+        if self.up is not None:
+            return self.up
+        return bool(self.open or self.counts["closed"])
+
+    def header_lines(self) -> List[str]:
+        name = self.host if self.host == self.addr else f"{self.host} ({self.addr})"
+        return [
+            f"Starting {self.banner} at {self.started:%Y-%m-%d %H:%M} UTC",
+            f"Nmap scan report for {name}",
+        ]
+
+    def summary_lines(self) -> List[str]:
+        lines = []
+        if not self.host_up:
+            lines.append("Note: Host seems down.")
+        else:
+            if self.rtt_ms is not None:
+                lines.append(f"Host is up ({self.rtt_ms / 1000.0:.3f}s latency).")
+            else:
+                lines.append("Host is up.")
+            hidden = []
+            if self.counts["closed"]:
+                hidden.append(f"{self.counts['closed']} closed tcp ports (conn-refused)")
+            if self.counts["filtered"]:
+                hidden.append(f"{self.counts['filtered']} filtered tcp ports (no-response)")
+            if hidden:
+                lines.append("Not shown: " + ", ".join(hidden))
+        return lines
+
+    def port_line(self, result: Dict) -> str:
+        return f"{str(result['port']) + '/tcp':<9} {result['state']:<5} {result['service']}"
+
+    def footer_lines(self) -> List[str]:
+        up = 1 if self.host_up else 0
+        return [
+            "",
+            f"Nmap done: 1 IP address ({up} host{'' if up == 1 else 's'} up) scanned in {self.elapsed:.2f} seconds",
+        ]
+
+    def text(self) -> str:
+        lines = self.header_lines() + self.summary_lines()
+        if self.open:
+            lines.append("PORT      STATE SERVICE")
+            lines.extend(self.port_line(r) for r in self.open_ports)
+        lines.extend(self.footer_lines())
+        return "\n".join(lines) + "\n"
+
+    def start_event(self) -> Dict:
+        return {"type": "start", "host": self.host, "address": self.addr, "ports": len(self.ports)}
+
+    def to_dict(self) -> Dict:
+        return {
+            "host": self.host,
+            "address": self.addr,
+            "host_up": self.host_up,
+            "ports_scanned": len(self.ports),
+            "open_ports": [
+                {"port": r["port"], "protocol": "tcp", "state": "open",
+                 "service": r["service"], "rtt_ms": r.get("rtt_ms")}
+                for r in self.open_ports
+            ],
+            "closed": self.counts["closed"],
+            "filtered": self.counts["filtered"],
+            "elapsed_s": self.elapsed,
+        }
+
+
+def port_event(result: Dict) -> Dict:
+    rtt = result.get("rtt_ms")
+    return {"type": "port_open", "port": result["port"], "proto": "tcp", "service": result["service"],
+            "rtt_ms": round(rtt, 2) if rtt is not None else None}
+
+
+async def scan_events(report: ScanReport) -> AsyncIterator[Dict]:
+    """
+    Scan report.ports and yield typed events as results come in: "start",
+    "port_open" for each open port as soon as it is found, and "progress"
+    every PROGRESS_STEP percent. The caller sends "done" from the finished
+    report.
+    """
+    yield report.start_event()
+    total = len(report.ports)
+    next_step = PROGRESS_STEP
+    async for result in connect_scan(report.addr, report.ports):
+        report.add(result)
+        if result["state"] == "open":
+            yield port_event(result)
+        percent = 100.0 * report.scanned / total
+        if percent >= next_step and report.scanned < total:
+            yield {"type": "progress", "percent": round(percent, 1), "scanned": report.scanned, "total": total}
+            next_step = (percent // PROGRESS_STEP + 1) * PROGRESS_STEP
+    report.finish()
@@ -0,0 +1,89 @@
+"""
+Consensus checks: several independent probes of one target, one verdict.
+
+A single probe that hits a transient error (a dropped SYN, a reset, one bad
+address behind a round-robin name) reports a false "down". A consensus
+check runs up to `probes` probes against different resolved addresses,
+alternating IPv4 and IPv6, with starts staggered by CONSENSUS_STAGGER
+seconds (a failure starts the next probe straight away, as in Happy
+Eyeballs). The first probe to come back up decides "up" and the rest are
+cancelled, so a healthy target costs about one probe; "down" is only
+reported once `quorum` probes have failed.
+"""
+import asyncio
+import ipaddress
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+CONSENSUS_PROBES = 3
+CONSENSUS_QUORUM = 2  # failed probes needed for a "down" verdict
+CONSENSUS_MAX_PROBES = 6
+CONSENSUS_STAGGER = 0.25  # seconds between probe starts
+
+# probe(addr) -> (up, details for the response)
+Probe = Callable[[str], Awaitable[Tuple[bool, Dict[str, Any]]]]
+
+
+def spread_addresses(addrs: List[str], n: int) -> List[str]:
+    """n probe addresses alternating between families, reusing addresses when there are fewer than n."""
+    v4 = [a for a in addrs if ipaddress.ip_address(a).version == 4]
+    v6 = [a for a in addrs if ipaddress.ip_address(a).version == 6]
+    order = []
+    for i in range(max(len(v4), len(v6))):
+        order.extend(fam[i] for fam in (v4, v6) if i < len(fam))
+    return [order[i % len(order)] for i in range(n)] if order else []
+
+
+async def consensus_check(addrs: List[str], probe: Probe, probes: int = CONSENSUS_PROBES,
+                          quorum: int = CONSENSUS_QUORUM, stagger: float = CONSENSUS_STAGGER) -> Dict:
+    """
+    Run staggered probes over addrs until one is up or `quorum` have failed.
+    Returns {"up", "verdict", "quorum", "probes": [per-probe details]}.
+    """
+    targets = spread_addresses(addrs, max(1, min(probes, CONSENSUS_MAX_PROBES)))
+    quorum = max(1, min(quorum, len(targets)))
+    start = time.perf_counter()
+    results: List[Dict] = []
+    pending: Dict[asyncio.Task, Dict] = {}
+    failed = 0
+    up = False
+    next_start = start
+    try:
+        while True:
+            if targets and time.perf_counter() >= next_start:
+                addr = targets.pop(0)
+                info = {"addr": addr, "family": f"ipv{ipaddress.ip_address(addr).version}",
+                        "started_ms": round((time.perf_counter() - start) * 1000, 2)}
+                pending[asyncio.ensure_future(probe(addr))] = info
+                next_start = time.perf_counter() + stagger
+            if not pending:
+                break
+            timeout = max(0.0, next_start - time.perf_counter()) if targets else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                info = pending.pop(task)
+                try:
+                    ok, details = task.result()
+                except Exception as e:
+                    ok, details = False, {"error": str(e) or type(e).__name__}
+                info.update(details, up=ok)
+                results.append(info)
+                if ok:
+                    up = True
+                else:
+                    failed += 1
+                    next_start = time.perf_counter()  # don't wait out the stagger after a failure
+            if up or failed >= quorum:
+                break
+    finally:
+        for task, info in pending.items():
+            task.cancel()
+            results.append(dict(info, cancelled=True))
+    return {
+        "up": up,
+        "verdict": "up" if up else "down",
+        "quorum": quorum,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        "probes": results,
+    }
@@ -0,0 +1,136 @@
+"""
+Async access to a sqlite database without blocking the event loop.
+
+Each Database keeps a pool of DB_READERS read-only connections and one
+writer connection, each held by its own thread (a sqlite connection stays
+on the thread that uses it). Reads run concurrently in WAL mode; writes
+from the request path and from background threads queue up on the single
+writer, so they never contend for the write lock among themselves.
+
+Work is passed as a function of the connection:
+
+    rows = await db.fetchall("SELECT ...", (arg,), name="recent_visits")
+    stats = await db.read(rollup_stats, cutoff, now)
+    db.write_sync(write_batch, batch)  # from a non-async thread
+
+Every connection gets the same PRAGMA tuning and a prepared statement
+cache. Query times go to isitdown_db_query_seconds, and queries slower
+than DB_SLOW_QUERY_MS are printed.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from . import metrics
+
+DB_READERS = 4
+DB_STATEMENT_CACHE = 256  # prepared statements kept per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the file read through mmap
+DB_CACHE_SIZE = 64 * 1024  # page cache per connection, KiB
+DB_BUSY_TIMEOUT = 5.0  # seconds to wait for a lock held by another process
+DB_SLOW_QUERY_MS = 250
+
+query_seconds = metrics.register(metrics.Histogram(
+    "isitdown_db_query_seconds", "sqlite query time on the database threads", ("db", "query")))
+
+
+class Database:
+    def __init__(self, path: str, readers: int = DB_READERS, name: str = "db"):
+        self.path = path
+        self.name = name
+        self.readers = readers
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self.stats = {"reads": 0, "writes": 0, "errors": 0, "slow": 0}
+
+    def _connect(self, kind: str):
+        # runs once on each pool thread
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT, cached_statements=DB_STATEMENT_CACHE,
+                               check_same_thread=False)
+        if kind == "write":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if kind == "read":
+            conn.execute("PRAGMA query_only=ON")
+        self._local.conn = conn
+        with self._lock:
+            self._conns.append(conn)
+
+    def _pool(self, kind: str) -> ThreadPoolExecutor:
+        with self._lock:
+            pool = self._pools.get(kind)
+            if pool is None:
+                pool = self._pools[kind] = ThreadPoolExecutor(
+                    max_workers=self.readers if kind == "read" else 1,
+                    thread_name_prefix=f"{self.name}-{kind}",
+                    initializer=self._connect,
+                    initargs=(kind,),
+                )
+            return pool
+
+    def _call(self, kind: str, name: str, fn: Callable, args: tuple) -> Any:
+        conn = self._local.conn
+        start = time.perf_counter()
+        try:
+            return fn(conn, *args)
+        except sqlite3.Error:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats["reads" if kind == "read" else "writes"] += 1
+            query_seconds.observe(elapsed, self.name, name)
+            if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+                self.stats["slow"] += 1
+                print(f"Slow {self.name} {kind} ({name}): {elapsed * 1000:.1f} ms")
+
+    async def read(self, fn: Callable[..., Any], *args, name: Optional[str] = None) -> Any:
+        """Run fn(conn, *args) on a read-only pooled connection."""
+        loop = asyncio.get_running_loop()
+        call = partial(self._call, "read", name or fn.__name__, fn, args)
+        return await loop.run_in_executor(self._pool("read"), call)
+
+    async def write(self, fn: Callable[..., Any], *args, name: Optional[str] = None) -> Any:
+        """Run fn(conn, *args) on the writer connection; fn owns its transaction."""
+        loop = asyncio.get_running_loop()
+        call = partial(self._call, "write", name or fn.__name__, fn, args)
+        return await loop.run_in_executor(self._pool("write"), call)
+
+    def write_sync(self, fn: Callable[..., Any], *args, name: Optional[str] = None) -> Any:
+        """write() for plain threads (and import-time setup): blocks until fn has run."""
+        return self._pool("write").submit(self._call, "write", name or fn.__name__, fn, args).result()
+
+    async def fetchall(self, sql: str, params: tuple = (), name: str = "query") -> List[tuple]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall(), name=name)
+
+    async def fetchone(self, sql: str, params: tuple = (), name: str = "query") -> Optional[tuple]:
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone(), name=name)
+
+    def close(self):
+        """Finish queued work, then close every connection (reopened lazily on next use)."""
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.shutdown(wait=True)
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+
+    def metrics(self) -> Dict:
+        data = dict(self.stats)
+        with self._lock:
+            pools = dict(self._pools)
+        data["connections"] = len(self._conns)
+        for kind, pool in pools.items():
+            data[f"{kind}_queued"] = pool._work_queue.qsize()
+        return data
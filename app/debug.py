@@ -0,0 +1,145 @@
+"""
+Debug tooling for finding event-loop stalls.
+
+LoopWatchdog: a task on the loop bumps a heartbeat every WATCHDOG_INTERVAL
+seconds, and a separate thread watches it. When the heartbeat is more than
+LOOP_BLOCK_THRESHOLD seconds late, the loop is stuck in synchronous code, so
+the thread grabs the loop thread's current stack (sys._current_frames) and
+records the stall with its final duration once the loop recovers.
+
+sample_profile: samples the stacks of running threads every few
+milliseconds for a fixed duration and returns them in the collapsed-stack
+format that flamegraph.pl / speedscope read ("frame;frame;frame count").
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+LOOP_BLOCK_THRESHOLD = 0.1  # seconds the loop may be busy before it counts as a stall
+WATCHDOG_INTERVAL = 0.02
+WATCHDOG_HISTORY = 100  # stalls kept for the admin endpoint
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MIN_INTERVAL = 0.001
+
+_PKG_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(_PKG_ROOT):
+        path = os.path.relpath(path, _PKG_ROOT)
+    else:
+        path = os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse(frame) -> str:
+    """Root-first ';'-joined frame labels for one stack."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.threshold = threshold
+        self.stalls: Deque[Dict] = deque(maxlen=WATCHDOG_HISTORY)
+        self.total = 0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+
+    def _watch(self):
+        stall = None
+        while not self._stop.wait(WATCHDOG_INTERVAL):
+            late = time.monotonic() - self._beat - WATCHDOG_INTERVAL
+            if late >= self.threshold and stall is None:
+                frame = sys._current_frames().get(self._loop_thread)
+                stall = {
+                    "started": time.time() - late,
+                    "blocked_s": None,  # filled in once the loop runs again
+                    "stack": "".join(traceback.format_stack(frame)) if frame is not None else "",
+                    "collapsed": collapse(frame) if frame is not None else "",
+                }
+                self.stalls.append(stall)
+                self.total += 1
+            elif stall is not None and late < self.threshold:
+                stall["blocked_s"] = round(time.time() - stall["started"] - late, 3)
+                print(f"Event loop blocked for {stall['blocked_s']:.3f}s in:\n{stall['stack']}")
+                stall = None
+
+    def report(self) -> Dict:
+        return {
+            "running": self.running,
+            "threshold_s": self.threshold,
+            "total_stalls": self.total,
+            "stalls": list(reversed(self.stalls)),
+        }
+
+
+def sample_profile(seconds: float, interval: float, thread_ids: Optional[List[int]] = None) -> str:
+    """
+    Blocking: sample thread stacks for `seconds` and return collapsed stacks.
+    Run it off the event loop (asyncio.to_thread) so the loop keeps working
+    while it is being profiled. thread_ids limits sampling to those threads.
+    """
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    interval = max(interval, PROFILE_MIN_INTERVAL)
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (thread_ids is not None and ident not in thread_ids):
+                continue
+            name = names.get(ident, f"thread-{ident}")
+            counts[name.replace(";", ":") + ";" + collapse(frame)] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+loop_watchdog = LoopWatchdog()
@@ -0,0 +1,100 @@
+"""
+Happy Eyeballs (RFC 8305) connection racing over a host's addresses.
+
+Addresses are interleaved by family, IPv6 first, and tried one after the
+other with HAPPY_EYEBALLS_DELAY between attempt starts; a failed attempt
+starts the next one immediately. The first connection wins, the attempts
+still running are cancelled and any that connected anyway are closed. A
+host with a broken IPv6 path thus costs one attempt delay instead of a
+full connect timeout.
+
+Used by the TCP port checks (scanner.connect_probe) and, through a network
+backend, by the shared HTTP client (see app/httpclient.py).
+"""
+import asyncio
+import ipaddress
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+HAPPY_EYEBALLS_DELAY = 0.25  # seconds, the RFC's recommended "Connection Attempt Delay"
+
+T = TypeVar("T")
+
+
+def _family(addr: str) -> int:
+    try:
+        return ipaddress.ip_address(addr).version
+    except ValueError:
+        return 0  # a host name, left for the connect call to resolve
+
+
+def family_label(addr: str) -> Optional[str]:
+    version = _family(addr)
+    return f"ipv{version}" if version else None
+
+
+def interleave(addrs: List[str]) -> List[str]:
+    """Alternate address families, starting with IPv6 (RFC 8305 section 4)."""
+    v6 = [a for a in addrs if _family(a) == 6]
+    rest = [a for a in addrs if _family(a) != 6]
+    out = []
+    for i in range(max(len(v6), len(rest))):
+        out.extend(fam[i] for fam in (v6, rest) if i < len(fam))
+    return out
+
+
+async def connect_first(addrs: List[str], connect: Callable[[str], Awaitable[T]],
+                        close: Callable[[T], Awaitable[None]], delay: float = HAPPY_EYEBALLS_DELAY,
+                        attempts: Optional[List[Dict]] = None) -> Tuple[T, str]:
+    """
+    Race connect(addr) over addrs and return (connection, addr) of the first to
+    succeed. Raises the last attempt's error if every attempt fails. Attempt
+    outcomes are appended to `attempts` (even when the caller times out).
+    """
+    order = interleave(addrs)
+    attempts = attempts if attempts is not None else []
+    pending: Dict[asyncio.Task, Dict] = {}
+    error: Optional[BaseException] = None
+    winner = None
+    next_start = time.perf_counter()
+    try:
+        while winner is None:
+            if order and time.perf_counter() >= next_start:
+                addr = order.pop(0)
+                attempt = {"addr": addr, "started": time.perf_counter()}
+                attempts.append(attempt)
+                pending[asyncio.ensure_future(connect(addr))] = attempt
+                next_start = time.perf_counter() + delay
+            if not pending:
+                if not order:
+                    break
+                continue
+            timeout = max(0.0, next_start - time.perf_counter()) if order else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempt = pending.pop(task)
+                attempt["elapsed_ms"] = round((time.perf_counter() - attempt["started"]) * 1000, 2)
+                if task.exception() is not None:
+                    error = task.exception()
+                    attempt["error"] = str(error) or type(error).__name__
+                    next_start = time.perf_counter()
+                elif winner is None:
+                    winner = (task.result(), attempt["addr"])
+                    attempt["connected"] = True
+                else:
+                    await close(task.result())  # finished in the same round as the winner
+    finally:
+        for task in pending:
+            task.cancel()
+        for task, attempt in pending.items():
+            attempt["cancelled"] = True
+            try:
+                conn = await task
+            except BaseException:
+                continue
+            await close(conn)
+        for attempt in attempts:
+            attempt.pop("started", None)
+    if winner is None:
+        raise error if error is not None else OSError("no addresses to connect to")
+    return winner
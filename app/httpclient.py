@@ -0,0 +1,274 @@
+"""
+Application-lifetime httpx client pool for outbound HTTP checks.
+
+One AsyncClient (one SSL context, one connection pool) is shared by every
+/api/http request so repeated checks of the same site reuse warm keep-alive
+(or HTTP/2) connections instead of paying a TCP+TLS handshake each time.
+
+New connections are opened by HappyEyeballsBackend: the host is resolved
+(and vetted) through the app's cached resolver and the connection races
+its addresses (see app/happyeyeballs.py). RequestTimings collects per-phase
+timings of one request from httpcore's trace hooks.
+
+Requests pinned to one address (consensus probes) go through their own
+unpooled transport instead: httpcore keys pooled connections by origin
+alone, so a pinned connection must never be handed to another request.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+import httpcore
+import httpx
+
+from .happyeyeballs import connect_first
+from .resolver import ResolutionError, resolver
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Pool settings
+HTTP_MAX_CONNECTIONS = 200
+HTTP_MAX_KEEPALIVE = 100
+HTTP_KEEPALIVE_EXPIRY = 30.0  # seconds an idle connection is kept
+HTTP_PER_TARGET_CONNECTIONS = 10  # concurrent requests to one host
+HTTP_TARGET_SLOTS = 4096  # hosts with a tracked per-target limit
+
+# Response body limits (bytes); reading stops and the connection is closed early
+HTTP_PREVIEW_BYTES = 8192  # enough for the 2000 character non-verbose preview
+HTTP_BODY_MAX_BYTES = 1024 * 1024  # verbose responses
+HTTP_STREAM_MAX_BYTES = 16 * 1024 * 1024  # verbose responses relayed as a stream
+
+
+class RequestTimings:
+    """
+    Phase timings of one request (ms): dns, connect, tls, ttfb (request sent
+    to response headers). dns/connect/tls stay None when a pooled connection
+    was reused; after redirects they describe the last hop.
+    """
+
+    def __init__(self):
+        self._marks: Dict[str, float] = {}
+        self.dns: Optional[float] = None
+        self.addr: Optional[str] = None
+
+    async def trace(self, event: str, info: Dict):
+        # httpcore "trace" extension callback, e.g. "connection.connect_tcp.started"
+        _, _, name = event.partition(".")
+        self._marks[name] = time.perf_counter()
+
+    def _span(self, phase: str) -> Optional[float]:
+        start, end = self._marks.get(f"{phase}.started"), self._marks.get(f"{phase}.complete")
+        if start is None or end is None:
+            return None
+        return (end - start) * 1000.0
+
+    def to_dict(self) -> Dict:
+        connect = self._span("connect_tcp")
+        if connect is not None and self.dns is not None:
+            connect -= self.dns
+        start = self._marks.get("send_request_headers.started")
+        end = self._marks.get("receive_response_headers.complete")
+        ttfb = (end - start) * 1000.0 if start is not None and end is not None else None
+        data = {"dns": self.dns, "connect": connect, "tls": self._span("start_tls"), "ttfb": ttfb}
+        return {k: round(v, 2) if v is not None else None for k, v in data.items()}
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+class HappyEyeballsBackend(httpcore.AsyncNetworkBackend):
+    """httpcore network backend resolving through the app resolver and racing the addresses."""
+
+    def __init__(self):
+        self._inner = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None, socket_options=None):
+        timings = _request_timings.get()
+        start = time.perf_counter()
+        try:
+            addrs = await asyncio.wait_for(resolver.vet(host), timeout)
+        except ResolutionError as e:
+            raise httpcore.ConnectError(str(e))
+        except asyncio.TimeoutError:
+            raise httpcore.ConnectTimeout(f"{host}: resolution timed out")
+        if timings is not None:
+            timings.dns = (time.perf_counter() - start) * 1000.0
+
+        async def connect(addr: str):
+            return await self._inner.connect_tcp(addr, port, timeout, local_address, socket_options)
+
+        stream, addr = await connect_first(addrs, connect, lambda s: s.aclose())
+        if timings is not None:
+            timings.addr = addr
+        return stream
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None, socket_options=None):
+        return await self._inner.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float):
+        await self._inner.sleep(seconds)
+
+
+class PinnedBackend(HappyEyeballsBackend):
+    """Connects `host` to one already vetted address; other hosts (redirects) resolve as usual."""
+
+    def __init__(self, host: str, addr: str):
+        super().__init__()
+        self.host = host.lower()
+        self.addr = addr
+
+    async def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                          local_address: Optional[str] = None, socket_options=None):
+        if host.lower() != self.host:
+            return await super().connect_tcp(host, port, timeout, local_address, socket_options)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.addr = self.addr
+        return await self._inner.connect_tcp(self.addr, port, timeout, local_address, socket_options)
+
+
+def _transport(ssl_context, backend: httpcore.AsyncNetworkBackend, limits: httpx.Limits) -> httpx.AsyncHTTPTransport:
+    transport = httpx.AsyncHTTPTransport(verify=ssl_context, http2=HTTP2_AVAILABLE, limits=limits)
+    # httpx doesn't take a network backend argument; the pool hands it to each new connection
+    transport._pool._network_backend = backend
+    return transport
+
+
+class ClientPool:
+    """Shared AsyncClient plus a per-target concurrency limit."""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._ssl_context = None
+        # host -> [semaphore, requests holding or waiting for it]
+        self._targets: "OrderedDict[str, List]" = OrderedDict()
+
+    async def start(self):
+        if self._client is not None:
+            return
+        self._ssl_context = httpx.create_ssl_context()
+        transport = _transport(
+            self._ssl_context,
+            HappyEyeballsBackend(),
+            httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self._client = httpx.AsyncClient(transport=transport)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    def _target_slot(self, host: str) -> List:
+        slot = self._targets.get(host)
+        if slot is None:
+            slot = self._targets[host] = [asyncio.Semaphore(HTTP_PER_TARGET_CONNECTIONS), 0]
+            # forget the least recently used hosts nobody holds or waits for; dropping a
+            # semaphore still in use would let a new one hand out a second set of slots
+            excess = len(self._targets) - HTTP_TARGET_SLOTS
+            if excess > 0:
+                idle = (h for h, (_, users) in self._targets.items() if users == 0 and h != host)
+                for oldest in list(islice(idle, excess)):
+                    del self._targets[oldest]
+        self._targets.move_to_end(host)
+        return slot
+
+    @asynccontextmanager
+    async def _hold(self, host: str, timeout: Optional[float]):
+        """Hold one of the per-target slots for host, waiting at most timeout seconds for it."""
+        slot = self._target_slot(host.lower())
+        sem = slot[0]
+        slot[1] += 1
+        try:
+            try:
+                await asyncio.wait_for(sem.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise httpx.PoolTimeout(f"{host}: all {HTTP_PER_TARGET_CONNECTIONS} connection slots busy")
+            try:
+                yield
+            finally:
+                sem.release()
+        finally:
+            slot[1] -= 1
+
+    @asynccontextmanager
+    async def target(self, host: str, timeout: Optional[float] = None):
+        """Hold one of the per-target slots for host while a request runs."""
+        async with self._hold(host, timeout):
+            yield await self.client()
+
+    @asynccontextmanager
+    async def pinned(self, host: str, addr: str, timeout: Optional[float] = None):
+        """A one-off client whose connections to host go to addr; closed (never pooled) on exit."""
+        await self.client()
+        transport = _transport(self._ssl_context, PinnedBackend(host, addr),
+                               httpx.Limits(max_keepalive_connections=0))
+        async with self._hold(host, timeout):
+            async with httpx.AsyncClient(transport=transport) as client:
+                yield client
+
+    @asynccontextmanager
+    async def stream(self, host: str, method: str, url: str, timings: Optional[RequestTimings] = None,
+                     addr: Optional[str] = None, **kwargs):
+        """
+        Send a request without reading its body; the body is read by the caller.
+        With addr, the request connects to that address of host over an unpooled connection.
+        A numeric timeout also bounds the wait for a per-target slot (httpx.PoolTimeout),
+        and the request gets what is left of it.
+        """
+        if timings is not None:
+            kwargs["extensions"] = dict(kwargs.get("extensions") or {}, trace=timings.trace)
+        timeout = kwargs.get("timeout")
+        budget = timeout if isinstance(timeout, (int, float)) else None
+        started = time.monotonic()
+        async with (self.target(host, budget) if addr is None else self.pinned(host, addr, budget)) as client:
+            if budget is not None:
+                left = budget - (time.monotonic() - started)
+                if left <= 0:
+                    raise httpx.PoolTimeout(f"{host}: timed out waiting for a connection slot")
+                kwargs["timeout"] = left
+            # read by HappyEyeballsBackend; connections are opened in this task before the headers arrive
+            _request_timings.set(timings)
+            async with client.stream(method, url, **kwargs) as resp:
+                yield resp
+
+
+async def read_capped(resp: httpx.Response, max_bytes: int) -> Tuple[bytes, bool]:
+    """Read at most max_bytes of the (decoded) body. Returns (body, truncated)."""
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in resp.aiter_bytes():
+        if size + len(chunk) > max_bytes:
+            chunks.append(chunk[: max_bytes - size])
+            return b"".join(chunks), True
+        chunks.append(chunk)
+        size += len(chunk)
+    return b"".join(chunks), False
+
+
+def content_length(resp: httpx.Response) -> Optional[int]:
+    try:
+        return int(resp.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+http_pool = ClientPool()
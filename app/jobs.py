@@ -0,0 +1,398 @@
+"""
+Scan job queue.
+
+Scans are submitted as jobs instead of holding an HTTP request (and a
+thread) open for their whole run. A bounded priority queue feeds a fixed
+pool of worker tasks, so at most JOB_WORKERS scans run per process and at
+most JOB_PER_IP jobs per client are queued or running at once. When the
+queue is full new jobs are rejected with a Retry-After estimate instead of
+piling up.
+
+Jobs keep their output lines (for scans, JSON events) so clients can poll,
+follow them as SSE from any point, or fetch the final result; finished
+jobs are kept for JOB_RESULT_TTL seconds. Transient lines such as progress
+updates go to live subscribers only.
+
+Shared jobs (submit_shared) act as a broadcast hub: identical concurrent
+requests attach to the one queued/running job with the same key instead of
+starting their own. Each subscriber gets the lines emitted so far and then
+new lines through its own bounded buffer; a subscriber that falls more than
+SUBSCRIBER_BUFFER lines behind is dropped rather than buffering without
+limit. A shared job is cancelled once its last subscriber leaves.
+
+With a shared state store (several uvicorn workers) each job also publishes
+its status, at most every JOB_PUBLISH_INTERVAL seconds while it runs, so a
+request landing on another worker can still report on it (JobQueue.snapshot).
+Output is published as deltas: each publish stores only the lines emitted
+since the last one, as a numbered chunk (JobQueue.snapshot_output). Writes
+run in the background, in order, so emitting a line never waits on the store.
+"""
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+JOB_WORKERS = 8
+JOB_QUEUE_SIZE = 200
+JOB_PER_IP = 2
+JOB_RESULT_TTL = 600  # seconds finished jobs stay fetchable
+JOB_STATS_WINDOW = 1000  # recent jobs used for wait/run time percentiles
+SUBSCRIBER_BUFFER = 1000  # lines a subscriber may lag behind before it is dropped
+JOB_PUBLISH_INTERVAL = 0.5  # seconds between snapshots of a running job in the state store
+JOB_SNAPSHOT_TTL = 86400  # seconds an unfinished job's snapshot outlives its last update
+
+
+class JobRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Subscription:
+    def __init__(self, job: "Job", since: int):
+        self.job = job
+        self.backlog = job.lines[since:]
+        self.buffer: Deque[str] = deque()
+        self.overflowed = False
+        self.closed = False
+        self._wake = asyncio.Event()
+
+    def push(self, line: str):
+        if len(self.buffer) >= SUBSCRIBER_BUFFER:
+            self.overflowed = True
+        else:
+            self.buffer.append(line)
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    async def lines(self) -> AsyncIterator[str]:
+        """Replayed lines first, then live ones until the job ends or we overflow."""
+        try:
+            for line in self.backlog:
+                yield line
+            self.backlog = []
+            while True:
+                while self.buffer:
+                    yield self.buffer.popleft()
+                if self.overflowed or self.job.finished is not None:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+        finally:
+            self.close()
+
+    def close(self):
+        """Leave the job (also when lines() was never iterated); safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            self.job.unsubscribe(self)
+
+
+class Job:
+    def __init__(self, kind: str, client: str, priority: int, params: Dict,
+                 runner: Callable[["Job"], Awaitable[Any]]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.client = client
+        self.priority = priority
+        self.params = params
+        self.runner = runner
+        self.status = "queued"  # queued -> running -> done | failed | cancelled
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.error_status = 500
+        self.lines: List[str] = []
+        self.key: Optional[Hashable] = None  # set for shared jobs
+        self.subscribers: Set[Subscription] = set()
+        self.on_idle: Optional[Callable[["Job"], None]] = None
+        self.publish: Optional[Callable[["Job"], None]] = None
+        self._published = 0.0
+        self._published_lines = 0  # lines already in published output chunks
+        self.chunks = 0  # output chunks published
+        self._task: Optional[asyncio.Task] = None
+        self._done = asyncio.Event()
+
+    def emit(self, line: str, keep: bool = True):
+        """Send a line to subscribers; keep=False lines (progress ticks) aren't stored or replayed."""
+        if keep:
+            self.lines.append(line)
+        for sub in self.subscribers:
+            sub.push(line)
+        if self.publish is not None and time.monotonic() - self._published >= JOB_PUBLISH_INTERVAL:
+            self.publish(self)
+
+    def _finish(self, status: str):
+        self.status = status
+        self.finished = time.time()
+        self._done.set()
+        for sub in self.subscribers:
+            sub.wake()
+        if self.publish is not None:
+            self.publish(self)
+
+    async def wait(self):
+        await self._done.wait()
+
+    def subscribe(self, since: int = 0) -> Subscription:
+        """Follow output lines from index `since` (see Subscription.lines)."""
+        sub = Subscription(self, since)
+        if self.finished is None:
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscribers.discard(sub)
+        if not self.subscribers and self.finished is None and self.on_idle is not None:
+            self.on_idle(self)
+
+    def to_dict(self, position: Optional[int] = None) -> Dict:
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "lines": len(self.lines),
+        }
+        if position is not None:
+            data["position"] = position
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.error is not None:
+            data["error"] = self.error
+        return data
+
+    def snapshot(self) -> Dict:
+        """Status as published to the state store; the output goes in separate chunks."""
+        data = self.to_dict()
+        data["error_status"] = self.error_status
+        data["chunks"] = self.chunks
+        return data
+
+
+def _percentile(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))], 3)
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE, per_ip: int = JOB_PER_IP,
+                 store=None):
+        self.workers = workers
+        self.store = store  # shared state store (app/state.py) for cross-worker lookups, or None
+        self.max_queued = max_queued
+        self.per_ip = per_ip
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._active: Dict[str, int] = {}  # client -> queued + running jobs
+        self._shared: Dict[Hashable, Job] = {}  # key -> unfinished shared job
+        self.running = 0
+        self._publishing: Optional[asyncio.Lock] = None
+        self._pending: Set[asyncio.Task] = set()  # store writes in flight
+        self._waits: Deque[float] = deque(maxlen=JOB_STATS_WINDOW)
+        self._runs: Deque[float] = deque(maxlen=JOB_STATS_WINDOW)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "shared": 0,
+                      "rejected_full": 0, "rejected_client": 0, "publish_errors": 0}
+
+    def start(self):
+        if not self._tasks:
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # let the final status of the cancelled jobs reach the store
+        await asyncio.gather(*self._pending, return_exceptions=True)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> float:
+        """Rough time until a queue slot frees up: queued work spread over the workers."""
+        avg_run = sum(self._runs) / len(self._runs) if self._runs else 10.0
+        return max(1.0, avg_run * (self.depth + 1) / self.workers)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RESULT_TTL
+        while self.jobs:
+            job = next(iter(self.jobs.values()))
+            if job.finished is None or job.finished > cutoff:
+                break
+            self.jobs.popitem(last=False)
+
+    def submit(self, kind: str, client: str, params: Dict, runner: Callable[[Job], Awaitable[Any]],
+               priority: int = 0) -> Job:
+        """Queue a job; lower priority values run first. Raises JobRejected on overload."""
+        self._prune()
+        if self._active.get(client, 0) >= self.per_ip:
+            self.stats["rejected_client"] += 1
+            raise JobRejected(429, f"at most {self.per_ip} scans per client may be queued or running",
+                              self.retry_after())
+        if self.depth >= self.max_queued:
+            self.stats["rejected_full"] += 1
+            raise JobRejected(503, "scan queue is full, try again later", self.retry_after())
+        job = Job(kind, client, priority, params, runner)
+        self.jobs[job.id] = job
+        self._active[client] = self._active.get(client, 0) + 1
+        self._queue.put_nowait((priority, next(self._seq), job))
+        self.stats["submitted"] += 1
+        if self.store is not None:
+            job.publish = self._publish
+            self._publish(job)
+        return job
+
+    def submit_shared(self, key: Hashable, kind: str, client: str, params: Dict,
+                      runner: Callable[[Job], Awaitable[Any]], priority: int = 0) -> Job:
+        """
+        Attach to the unfinished job with this key, or submit a new one. The
+        caller should subscribe straight away: the job is cancelled when its
+        last subscriber unsubscribes.
+        """
+        job = self._shared.get(key)
+        if job is not None:
+            self.stats["shared"] += 1
+            return job
+        job = self.submit(kind, client, params, runner, priority)
+        job.key = key
+        job.on_idle = self.cancel
+        self._shared[key] = job
+        return job
+
+    def cancel(self, job: Job):
+        """Cancel a queued or running job."""
+        if job.finished is not None:
+            return
+        job.error = "cancelled"
+        job._finish("cancelled")
+        self.stats["cancelled"] += 1
+        if job.key is not None:
+            self._shared.pop(job.key, None)
+        if job._task is not None:
+            job._task.cancel()  # a queued job is skipped when a worker picks it up
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _publish(self, job: Job):
+        # the state is captured now; the write happens in the background, after earlier ones
+        job._published = time.monotonic()
+        lines = job.lines[job._published_lines:]
+        chunk = None
+        if lines:
+            chunk = (f"{job.id}:{job.chunks}", lines)
+            job._published_lines += len(lines)
+            job.chunks += 1
+        ttl = JOB_RESULT_TTL if job.finished is not None else JOB_SNAPSHOT_TTL
+        task = asyncio.ensure_future(self._write(job.id, job.snapshot(), chunk, ttl))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _write(self, job_id: str, status: Dict, chunk: Optional[tuple], ttl: float):
+        if self._publishing is None:
+            self._publishing = asyncio.Lock()
+        async with self._publishing:
+            try:
+                if chunk is not None:
+                    # chunks outlive any status that points at them
+                    await self.store.set("job_output", chunk[0], chunk[1], ttl=JOB_SNAPSHOT_TTL)
+                await self.store.set("job", job_id, status, ttl=ttl)
+            except Exception as e:
+                self.stats["publish_errors"] += 1
+                print(f"Error publishing job {job_id}: {e}")
+
+    async def snapshot(self, job_id: str) -> Optional[Dict]:
+        """Last published status of a job run by any worker (None without a shared store)."""
+        if self.store is None:
+            return None
+        return await self.store.get("job", job_id)
+
+    async def snapshot_output(self, job_id: str, first: int, last: int) -> List[str]:
+        """Output lines of published chunks first..last-1 (see snapshot()["chunks"])."""
+        keys = [f"{job_id}:{i}" for i in range(first, last)]
+        chunks = await self.store.get_many("job_output", keys)
+        return [line for key in keys for line in chunks.get(key, ())]
+
+    def position(self, job: Job) -> Optional[int]:
+        """1-based place in the queue for queued jobs (O(depth), for status display)."""
+        if job.status != "queued":
+            return None
+        key = (job.priority, job.created)
+        return 1 + sum(1 for p, _, j in self._queue._queue if j.status == "queued" and (p, j.created) < key)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status == "cancelled":
+                self._release(job)
+                continue
+            job.status = "running"
+            job.started = time.time()
+            if job.publish is not None:
+                job.publish(job)
+            self.running += 1
+            self._waits.append(job.started - job.created)
+            job._task = asyncio.ensure_future(job.runner(job))
+            try:
+                job.result = await job._task
+                job._finish("done")
+                self.stats["completed"] += 1
+            except asyncio.CancelledError:
+                if job.status != "cancelled":
+                    # the worker itself is being stopped
+                    job._task.cancel()
+                    job.error = "server shutting down"
+                    job._finish("failed")
+                    raise
+            except Exception as e:
+                job.error = getattr(e, "detail", None) or str(e) or type(e).__name__
+                job.error_status = getattr(e, "status_code", 500)
+                job._finish("failed")
+                self.stats["failed"] += 1
+            finally:
+                self.running -= 1
+                self._runs.append(time.time() - job.started)
+                self._release(job)
+
+    def _release(self, job: Job):
+        if job.key is not None and self._shared.get(job.key) is job:
+            del self._shared[job.key]
+        left = self._active.get(job.client, 1) - 1
+        if left:
+            self._active[job.client] = left
+        else:
+            self._active.pop(job.client, None)
+
+    def metrics(self) -> Dict:
+        data = dict(self.stats)
+        data.update({
+            "queue_depth": self.depth,
+            "queue_capacity": self.max_queued,
+            "running": self.running,
+            "workers": self.workers,
+            "wait_s": {"p50": _percentile(self._waits, 50), "p95": _percentile(self._waits, 95),
+                       "max": _percentile(self._waits, 100)},
+            "run_s": {"p50": _percentile(self._runs, 50), "p95": _percentile(self._runs, 95)},
+        })
+        return data
+
+
+scan_jobs = JobQueue()
@@ -1,21 +1,52 @@
 from fastapi import FastAPI, HTTPException, Request, Depends, Form, status
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, FileResponse, RedirectResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse, FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from starlette.background import BackgroundTask
 import asyncio
+import base64
+import codecs
 import httpx
-import ipaddress
-import socket
 import shutil
-import subprocess
 import time
-import sqlite3
 import hashlib
+import os
 import secrets
+import threading
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Tuple
 from pydantic import BaseModel
+import json
 import uuid
+from xml.etree.ElementTree import ParseError
+from contextlib import AsyncExitStack
+from functools import partial
+
+from . import connectscan, metrics
+from .archive import VisitorArchiver
+from .bulk import BULK_CONCURRENCY, BulkTarget, parse_targets, run_bulk
+from .checkcache import check_cache
+from .consensus import CONSENSUS_PROBES, CONSENSUS_QUORUM, consensus_check
+from .debug import loop_watchdog, sample_profile
+from .httpclient import (
+    HTTP_BODY_MAX_BYTES,
+    HTTP_PREVIEW_BYTES,
+    HTTP_STREAM_MAX_BYTES,
+    RequestTimings,
+    content_length,
+    http_pool,
+    read_capped,
+)
+from .jobs import JOB_PUBLISH_INTERVAL, Job, JobRejected, Subscription, scan_jobs
+from .monitor import MONITOR_MIN_INTERVAL, Monitor, MonitorQuotaExceeded, Target
+from .nmapxml import NmapXmlParser
+from .pages import ROUTE_META, page_cache
+from .ratelimit import MONITOR_CREATE_COST, MemoryBackend, RateLimiter, SqliteBackend, batch_cost, request_cost
+from .resolver import ResolutionError, resolver
+from .scanner import connect_probe, parse_ports, probe_port, scan_ports, MAX_PROBE_TIMEOUT
+from .state import MemoryStore, SqliteStore, claim_worker_slot
+from .tsdb import TSDB_DIR, tsdb
+from .visitors import create_schema, rollup_stats, visitor_log, visitor_page, visitors_db
 
 app = FastAPI(title="Isitdown? API")  # Changed from "isitdown.space API"
 
@@ -27,75 +58,114 @@ ADMIN_USERNAME = "admin"
 # Default password: "admin123" - you should change this!
 ADMIN_PASSWORD_HASH = hashlib.sha256("admin123".encode()).hexdigest()
 
+# Where sessions, monitors, scan job status and cached checks live (app/state.py):
+# "memory" (one worker process) or "sqlite" (shared through STATE_DB; required
+# when running several workers, e.g. STATE_BACKEND=sqlite uvicorn app.main:app --workers 4)
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_DB = "state.db"
+
 # Session management for admin login
-admin_sessions: Dict[str, datetime] = {}  # session_id -> expiration time
 SESSION_TIMEOUT = timedelta(hours=1)
 
-# Simple in-memory rate limiter (per-IP, sliding window)
-RATE_LIMIT = 60  # requests
-RATE_PERIOD = 60  # seconds
-_clients = {}
+# Per-IP token-bucket rate limiter; endpoint costs are in app/ratelimit.py
+RATE_LIMIT = 60  # tokens (one page view costs 1)
+RATE_PERIOD = 60  # seconds to refill a full bucket
+# "memory" (per process) or "sqlite" (shared by all workers via RATE_LIMIT_DB)
+RATE_LIMIT_BACKEND = STATE_BACKEND
+RATE_LIMIT_DB = "ratelimit.db"
+
+# Port scan engine for /api/nmap: "builtin" (in-process connect scan) or "nmap" (system binary)
+SCAN_ENGINE = "builtin"
+
+# Connect to the address that passed the private-host check instead of re-resolving
+PIN_RESOLVED_IP = True
+
+# Start the event-loop stall watchdog at startup (see app/debug.py; also switchable at runtime)
+DEBUG_LOOP_WATCHDOG = False
+
+# Upper bound on a streamed scan's run time (seconds); POST /api/nmap takes "timeout"
+NMAP_STREAM_TIMEOUT = 300
+
+# How often the nmap binary reports scan progress (its --stats-every)
+NMAP_STATS_EVERY = "2s"
 
 # Database setup for visitor tracking
 def init_visitor_db():
-    conn = sqlite3.connect('visitors.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS visitors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip_address TEXT NOT NULL,
-            user_agent TEXT,
-            referrer TEXT,
-            path TEXT NOT NULL,
-            timestamp DATETIME NOT NULL,
-            country TEXT,
-            city TEXT,
-            isp TEXT,
-            session_id TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS visitor_stats (
-            ip_address TEXT PRIMARY KEY,
-            first_seen DATETIME NOT NULL,
-            last_seen DATETIME NOT NULL,
-            total_visits INTEGER DEFAULT 1,
-            user_agent TEXT,
-            country TEXT,
-            city TEXT
-        )
-    ''')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_visitors_time ON visitors (timestamp)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_visitors_ip ON visitors (ip_address)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_visitors_session ON visitors (session_id)')
-    conn.commit()
-    conn.close()
+    visitors_db.write_sync(create_schema)
 
 init_visitor_db()
 
-def client_allowed(ip: str) -> bool:
-    now = time.time()
-    q = _clients.setdefault(ip, [])
-    # drop old
-    while q and q[0] <= now - RATE_PERIOD:
-        q.pop(0)
-    if len(q) >= RATE_LIMIT:
-        return False
-    q.append(now)
-    return True
+@app.on_event("startup")
+async def start_http_pool():
+    await http_pool.start()
+
+@app.on_event("shutdown")
+async def close_http_pool():
+    await http_pool.close()
+
+@app.on_event("startup")
+async def start_visitor_log():
+    visitor_log.start()
+
+@app.on_event("shutdown")
+async def flush_visitor_log():
+    # flush queued visits before the process exits, then close the pooled connections
+    await visitor_archiver.stop()
+    await asyncio.to_thread(visitor_log.stop)
+    await asyncio.to_thread(visitors_db.close)
+
+# Months past the live window are exported to visitor-archive/ and dropped (app/archive.py)
+visitor_archiver = VisitorArchiver(visitors_db)
+
+@app.on_event("startup")
+async def start_visitor_archiver():
+    # with several workers only the one holding slot 0 of the archive directory archives
+    if not state_store.shared or claim_worker_slot(visitor_archiver.directory) == 0:
+        visitor_archiver.start()
+
+state_store = SqliteStore(STATE_DB) if STATE_BACKEND == "sqlite" else MemoryStore()
+if state_store.shared:
+    check_cache.shared = state_store
+    scan_jobs.store = state_store
+
+rate_limiter = RateLimiter(
+    SqliteBackend(RATE_LIMIT_DB) if RATE_LIMIT_BACKEND == "sqlite" else MemoryBackend(),
+    RATE_LIMIT,
+    RATE_PERIOD,
+)
 
-def is_private_host(host: str) -> bool:
+async def is_private_host(host: str) -> bool:
     try:
-        infos = socket.getaddrinfo(host, None)
-        for info in infos:
-            addr = info[4][0]
-            ip = ipaddress.ip_address(addr)
-            if ip.is_private or ip.is_loopback or ip.is_link_local:
-                return True
+        with metrics.stage("dns"):
+            await resolver.vet(host)
         return False
-    except Exception:
+    except ResolutionError:
         return True  # be conservative on resolution failure
 
+async def vet_host(host: str) -> str:
+    """
+    Resolve host through the shared cached resolver and reject private targets.
+    With PIN_RESOLVED_IP the vetted address is returned so the following connect
+    reuses it instead of resolving again (and can't be DNS-rebound in between).
+    """
+    addrs = await vet_addresses(host)
+    return addrs[0] if PIN_RESOLVED_IP else host
+
+async def vet_addresses(host: str) -> List[str]:
+    """All vetted addresses of host (IPv4 first), for probes that spread over them."""
+    try:
+        with metrics.stage("dns"):
+            return await resolver.vet(host)
+    except ResolutionError:
+        raise HTTPException(400, "target resolves to a private or local address")
+
+def _consensus_params(payload: dict) -> Tuple[int, int]:
+    probes = int(payload.get("probes", CONSENSUS_PROBES))
+    quorum = int(payload.get("quorum", min(CONSENSUS_QUORUM, probes)))
+    if not 1 <= quorum <= probes:
+        raise HTTPException(400, "quorum must be between 1 and the number of probes")
+    return probes, quorum
+
 # Visitor tracking middleware
 @app.middleware("http")
 async def track_visitors(request: Request, call_next):
@@ -103,55 +173,28 @@ async def track_visitors(request: Request, call_next):
     
     # Skip tracking for admin endpoints to avoid cluttering data
     if not request.url.path.startswith("/qhx-admin") and not request.url.path.startswith("/api/"):
-        try:
-            # Generate or get session ID from cookie
-            session_id = request.cookies.get("visitor_session")
-            if not session_id:
-                session_id = str(uuid.uuid4())
-            
-            # Store visitor information
-            conn = sqlite3.connect('visitors.db')
-            c = conn.cursor()
-            c.execute('''
-                INSERT INTO visitors 
-                (ip_address, user_agent, referrer, path, timestamp, session_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                client_ip,
-                request.headers.get("user-agent", ""),
-                request.headers.get("referer", ""),
-                request.url.path,
-                datetime.now().isoformat(),
-                session_id
-            ))
-            
-            # Update visitor stats
-            c.execute('''
-                INSERT OR REPLACE INTO visitor_stats 
-                (ip_address, first_seen, last_seen, total_visits, user_agent)
-                VALUES (
-                    ?,
-                    COALESCE((SELECT first_seen FROM visitor_stats WHERE ip_address = ?), ?),
-                    ?,
-                    COALESCE((SELECT total_visits FROM visitor_stats WHERE ip_address = ?), 0) + 1,
-                    COALESCE((SELECT user_agent FROM visitor_stats WHERE ip_address = ?), ?)
-                )
-            ''', (
-                client_ip,
-                client_ip, datetime.now().isoformat(),
-                datetime.now().isoformat(),
-                client_ip,
-                client_ip, request.headers.get("user-agent", "")
-            ))
-            
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"Error tracking visitor: {e}")
+        # Generate or get session ID from cookie
+        session_id = request.cookies.get("visitor_session")
+        if not session_id:
+            session_id = str(uuid.uuid4())
+
+        # Queue visitor information; written to sqlite in batches by a background thread
+        visitor_log.record(
+            client_ip,
+            request.headers.get("user-agent", ""),
+            request.headers.get("referer", ""),
+            request.url.path,
+            session_id,
+        )
     
     # Rate limiting
-    if not client_allowed(client_ip):
-        return JSONResponse({"error": "rate limit exceeded"}, status_code=429)
+    allowed, retry_after = await rate_limiter.allow(client_ip, request_cost(request.url.path))
+    if not allowed:
+        return JSONResponse(
+            {"error": "rate limit exceeded"},
+            status_code=429,
+            headers=_retry_after(retry_after),
+        )
     
     # Call the actual endpoint
     response = await call_next(request)
@@ -159,7 +202,6 @@ async def track_visitors(request: Request, call_next):
     # Set session cookie if not already set
     if not request.url.path.startswith("/qhx-admin") and not request.url.path.startswith("/api/"):
         if not request.cookies.get("visitor_session"):
-            session_id = str(uuid.uuid4())
             response.set_cookie(
                 key="visitor_session",
                 value=session_id,
@@ -170,6 +212,15 @@ async def track_visitors(request: Request, call_next):
     
     return response
 
+def _retry_after(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, int(seconds + 0.999)))}
+
+async def charge(request: Request, tokens: int):
+    """Spend tokens on top of the flat cost the middleware took (batch items, monitor registration)."""
+    allowed, retry_after = await rate_limiter.allow(request.client.host or "unknown", tokens)
+    if not allowed:
+        raise HTTPException(429, "rate limit exceeded", headers=_retry_after(retry_after))
+
 # Admin authentication functions
 def verify_admin(credentials: HTTPBasicCredentials) -> bool:
     """Verify admin credentials"""
@@ -178,24 +229,20 @@ def verify_admin(credentials: HTTPBasicCredentials) -> bool:
     password_correct = secrets.compare_digest(password_hash, ADMIN_PASSWORD_HASH)
     return username_correct and password_correct
 
-def create_admin_session() -> str:
+async def create_admin_session() -> str:
     """Create a new admin session"""
     session_id = str(uuid.uuid4())
-    admin_sessions[session_id] = datetime.now() + SESSION_TIMEOUT
+    await state_store.set("admin_session", session_id, True, ttl=SESSION_TIMEOUT.total_seconds())
     return session_id
 
-def verify_admin_session(session_id: str) -> bool:
+async def verify_admin_session(session_id: str) -> bool:
     """Verify if admin session is valid"""
-    if session_id not in admin_sessions:
-        return False
-    
-    # Check if session expired
-    if datetime.now() > admin_sessions[session_id]:
-        del admin_sessions[session_id]
+    # expired sessions are dropped by the store
+    if await state_store.get("admin_session", session_id) is None:
         return False
     
     # Renew session
-    admin_sessions[session_id] = datetime.now() + SESSION_TIMEOUT
+    await state_store.set("admin_session", session_id, True, ttl=SESSION_TIMEOUT.total_seconds())
     return True
 
 # Admin HTML templates
@@ -373,6 +420,8 @@ ADMIN_DASHBOARD_HTML = """
     <script>
         let currentFilter = 'today';
         let currentPage = 1;
+        // cursors[i] is the cursor that loads page i + 1 (page 1 needs none)
+        let cursors = [null];
         const pageSize = 20;
         
         function setFilter(filter) {
@@ -380,6 +429,7 @@ ADMIN_DASHBOARD_HTML = """
             document.querySelectorAll('.filter-btn').forEach(btn => btn.classList.remove('active'));
             event.target.classList.add('active');
             currentPage = 1;
+            cursors = [null];
             loadData();
         }
         
@@ -398,8 +448,11 @@ ADMIN_DASHBOARD_HTML = """
             
             // Load visitor list
             try {
-                const res = await fetch(`/qhx-admin/api/visitors?filter=${currentFilter}&page=${currentPage}&limit=${pageSize}`);
+                const cursor = cursors[currentPage - 1];
+                const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+                const res = await fetch(`/qhx-admin/api/visitors?filter=${currentFilter}&limit=${pageSize}${cursorParam}`);
                 const data = await res.json();
+                cursors[currentPage] = data.next_cursor;
                 
                 const tbody = document.getElementById('visitors-body');
                 tbody.innerHTML = '';
@@ -435,7 +488,7 @@ ADMIN_DASHBOARD_HTML = """
                 });
                 
                 // Update pagination
-                updatePagination(data.total_pages);
+                updatePagination(data.total_pages, data.next_cursor);
                 
             } catch (error) {
                 console.error('Error loading visitors:', error);
@@ -444,22 +497,36 @@ ADMIN_DASHBOARD_HTML = """
             }
         }
         
-        function updatePagination(totalPages) {
+        function updatePagination(totalPages, nextCursor) {
             const pagination = document.getElementById('pagination');
             pagination.innerHTML = '';
             
-            if (totalPages <= 1) return;
+            if (currentPage === 1 && !nextCursor) return;
             
-            for (let i = 1; i <= Math.min(totalPages, 10); i++) {
-                const btn = document.createElement('button');
-                btn.className = `page-btn ${i === currentPage ? 'active' : ''}`;
-                btn.textContent = i;
-                btn.onclick = () => {
-                    currentPage = i;
-                    loadData();
-                };
-                pagination.appendChild(btn);
-            }
+            const prev = document.createElement('button');
+            prev.className = 'page-btn';
+            prev.textContent = '← Newer';
+            prev.disabled = currentPage === 1;
+            prev.onclick = () => {
+                currentPage -= 1;
+                loadData();
+            };
+            pagination.appendChild(prev);
+            
+            const label = document.createElement('span');
+            label.className = 'page-btn active';
+            label.textContent = `Page ${currentPage} of ~${Math.max(totalPages, currentPage)}`;
+            pagination.appendChild(label);
+            
+            const next = document.createElement('button');
+            next.className = 'page-btn';
+            next.textContent = 'Older →';
+            next.disabled = !nextCursor;
+            next.onclick = () => {
+                currentPage += 1;
+                loadData();
+            };
+            pagination.appendChild(next);
         }
         
         function timeAgo(date) {
@@ -520,7 +587,7 @@ async def admin_login(
         )
     
     # Create session
-    session_id = create_admin_session()
+    session_id = await create_admin_session()
     
     # Create response with redirect
     response = RedirectResponse(url="/qhx-admin/dashboard", status_code=303)
@@ -538,14 +605,17 @@ async def admin_dashboard(request: Request):
     """Admin dashboard page"""
     # Check session cookie
     session_id = request.cookies.get("admin_session")
-    if not session_id or not verify_admin_session(session_id):
+    if not session_id or not await verify_admin_session(session_id):
         return RedirectResponse(url="/qhx-admin")
     
     return HTMLResponse(ADMIN_DASHBOARD_HTML)
 
 @app.post("/qhx-admin/logout")
-async def admin_logout():
+async def admin_logout(request: Request):
     """Handle admin logout"""
+    session_id = request.cookies.get("admin_session")
+    if session_id:
+        await state_store.delete("admin_session", session_id)
     response = RedirectResponse(url="/qhx-admin")
     response.delete_cookie("admin_session")
     return response
@@ -558,12 +628,9 @@ async def get_visitor_stats(
     """Get visitor statistics"""
     # Check session
     session_id = request.cookies.get("admin_session")
-    if not session_id or not verify_admin_session(session_id):
+    if not session_id or not await verify_admin_session(session_id):
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    conn = sqlite3.connect('visitors.db')
-    c = conn.cursor()
-    
     # Calculate time filter
     now = datetime.now()
     if filter == "today":
@@ -575,54 +642,40 @@ async def get_visitor_stats(
     else:
         cutoff = datetime.min
     
-    # Get stats
-    c.execute('''
-        SELECT COUNT(*) as total_visits, 
-               COUNT(DISTINCT ip_address) as unique_ips,
-               COUNT(CASE WHEN DATE(timestamp) = DATE(?) THEN 1 END) as today_visits
-        FROM visitors
-        WHERE timestamp >= ?
-    ''', (now.isoformat(), cutoff.isoformat()))
-    
-    stats = c.fetchone()
-    
-    # Get most active IP
-    c.execute('''
-        SELECT ip_address, COUNT(*) as visit_count
-        FROM visitors
-        WHERE timestamp >= ?
-        GROUP BY ip_address
-        ORDER BY visit_count DESC
-        LIMIT 1
-    ''', (cutoff.isoformat(),))
-    
-    most_active = c.fetchone()
-    
-    conn.close()
-    
-    return {
-        "total_visits": stats[0] if stats else 0,
-        "unique_ips": stats[1] if stats else 0,
-        "today_visits": stats[2] if stats else 0,
-        "most_active_ip": most_active[0] if most_active else None,
-        "most_active_count": most_active[1] if most_active else 0
-    }
+    # Answer from the rollup tables; only the partial hour/day at the cutoff hits the raw log.
+    # Only all-time stats reach back past the live months, into the archive summaries.
+    archived = await asyncio.to_thread(visitor_archiver.path_totals) if cutoff == datetime.min else None
+    with metrics.stage("sqlite_read"):
+        return await visitors_db.read(partial(rollup_stats, archived_paths=archived), cutoff, now,
+                                      name="rollup_stats")
+
+def encode_cursor(timestamp: str, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        timestamp, _, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rpartition("|")
+        return timestamp, int(row_id)
+    except ValueError:
+        raise HTTPException(400, "invalid cursor")
 
 @app.get("/qhx-admin/api/visitors")
 async def get_visitors(
     request: Request,
     filter: str = "today",
-    page: int = 1,
+    cursor: Optional[str] = None,
     limit: int = 20
 ):
-    """Get paginated visitor list"""
+    """
+    Get visitor list, newest first, one page at a time.
+    Pass the returned next_cursor to get the following page; every page is a
+    single index range scan on (timestamp, id), however deep it is.
+    """
     # Check session
     session_id = request.cookies.get("admin_session")
-    if not session_id or not verify_admin_session(session_id):
+    if not session_id or not await verify_admin_session(session_id):
         raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    conn = sqlite3.connect('visitors.db')
-    c = conn.cursor()
+    limit = max(1, min(limit, 200))
     
     # Calculate time filter
     now = datetime.now()
@@ -635,128 +688,434 @@ async def get_visitors(
     else:
         cutoff = datetime.min
     
-    # Get total count for pagination
-    c.execute('SELECT COUNT(*) FROM visitors WHERE timestamp >= ?', (cutoff.isoformat(),))
-    total_count = c.fetchone()[0]
+    after = decode_cursor(cursor) if cursor else None
+    with metrics.stage("sqlite_read"):
+        # Total count comes from the rollups (may lag the list by one write batch)
+        total_count, rows = await visitors_db.read(visitor_page, cutoff, after, limit + 1)
     total_pages = (total_count + limit - 1) // limit
     
-    # Get paginated visitors
-    offset = (page - 1) * limit
-    c.execute('''
-        SELECT ip_address, user_agent, path, timestamp, session_id
-        FROM visitors
-        WHERE timestamp >= ?
-        ORDER BY timestamp DESC
-        LIMIT ? OFFSET ?
-    ''', (cutoff.isoformat(), limit, offset))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][4], rows[-1][0])
     
     visitors = []
-    for row in c.fetchall():
+    for row in rows:
         visitors.append({
-            "ip_address": row[0],
-            "user_agent": row[1],
-            "path": row[2],
-            "timestamp": row[3],
-            "session_id": row[4]
+            "ip_address": row[1],
+            "user_agent": row[2],
+            "path": row[3],
+            "timestamp": row[4],
+            "session_id": row[5]
         })
     
-    conn.close()
-    
     return {
         "visitors": visitors,
+        "next_cursor": next_cursor,
         "total_count": total_count,
         "total_pages": total_pages,
-        "current_page": page,
         "page_size": limit
     }
 
-# Existing API endpoints (unchanged)
+@app.get("/qhx-admin/api/dns")
+async def get_dns_stats(request: Request):
+    """Get resolver cache hit/miss metrics"""
+    session_id = request.cookies.get("admin_session")
+    if not session_id or not await verify_admin_session(session_id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return resolver.metrics()
+
+# Check API: HTTP, port, batch and bulk probes and scans
+async def _open_http(host: str, method: str, url: str, headers: dict, timeout: float,
+                     addr: Optional[str] = None):
+    # returns the exit stack that owns the response, the response and its metadata
+    responses = AsyncExitStack()
+    timings = RequestTimings()
+    try:
+        with metrics.stage("http_headers"):
+            resp = await responses.enter_async_context(
+                http_pool.stream(host, method, url, timings=timings, addr=addr, headers=headers,
+                                 timeout=timeout, follow_redirects=True)
+            )
+    except httpx.PoolTimeout as e:
+        # every per-target slot stayed busy for the whole timeout
+        await responses.aclose()
+        raise HTTPException(503, f"target busy: {e}")
+    except httpx.RequestError as e:
+        await responses.aclose()
+        raise HTTPException(502, f"request failed: {e}")
+    data = {
+        "status_code": resp.status_code,
+        "http_version": resp.http_version,
+        "headers": dict(resp.headers),
+        "content_length": content_length(resp),
+        "timings_ms": timings.to_dict(),
+    }
+    if timings.addr is not None:
+        data["remote_addr"] = timings.addr
+    return responses, resp, data
+
+async def _fetch_http(host: str, method: str, url: str, headers: dict, timeout: float,
+                      max_bytes: int, verbose: bool, addr: Optional[str] = None) -> dict:
+    start = time.perf_counter()
+    responses, resp, data = await _open_http(host, method, url, headers, timeout, addr)
+    try:
+        with metrics.stage("http_body"):
+            raw, truncated = await read_capped(resp, max_bytes)
+    except httpx.HTTPError as e:
+        raise HTTPException(502, f"request failed: {e}")
+    finally:
+        # closing before the body is drained drops the connection instead of reading on
+        await responses.aclose()
+
+    body = raw.decode(resp.encoding or "utf-8", errors="replace")
+    data["bytes_read"] = resp.num_bytes_downloaded
+    data["truncated"] = truncated
+    data["timings_ms"]["total"] = round((time.perf_counter() - start) * 1000, 2)
+    if not verbose:
+        if len(body) > 2000 or truncated:
+            body = body[:2000] + "\n\n...truncated..."
+    elif truncated:
+        body += "\n\n...truncated..."
+    data["body"] = body
+    return data
+
+async def _fetch_http_consensus(host: str, method: str, url: str, headers: dict, timeout: float,
+                                max_bytes: int, verbose: bool, addrs: List[str], probes: int, quorum: int) -> dict:
+    # each probe connects to one vetted address over its own unpooled connection;
+    # the URL (and so Host, SNI and certificate checks) keeps the original name
+    responses = {}
+
+    async def probe(addr: str):
+        start = time.perf_counter()
+        try:
+            data = await _fetch_http(host, method, url, headers, timeout, max_bytes, verbose, addr)
+        except HTTPException as e:
+            return False, {"error": str(e.detail)}
+        latency = round((time.perf_counter() - start) * 1000, 2)
+        responses[addr] = data
+        return data["status_code"] < 500, {"status_code": data["status_code"], "latency_ms": latency}
+
+    verdict = await consensus_check(addrs, probe, probes, quorum)
+    answered = [p for p in verdict["probes"] if p.get("up") or p["addr"] in responses]
+    if not answered:
+        errors = "; ".join(f"{p['addr']}: {p.get('error', 'cancelled')}" for p in verdict["probes"])
+        raise HTTPException(502, f"request failed on every probe ({errors})")
+    # report the response that decided the verdict
+    chosen = next((p for p in answered if p.get("up")), answered[-1])
+    return dict(responses[chosen["addr"]], consensus=verdict)
+
+async def _relay_http(host: str, method: str, url: str, headers: dict, timeout: float, max_bytes: int):
+    responses, resp, data = await _open_http(host, method, url, headers, timeout)
+
+    async def event_stream():
+        sent = 0
+        truncated = False
+        decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+        try:
+            yield f"data: {json.dumps(dict(data, type='meta'))}\n\n"
+            async for chunk in resp.aiter_bytes():
+                if sent + len(chunk) > max_bytes:
+                    chunk = chunk[: max_bytes - sent]
+                    truncated = True
+                sent += len(chunk)
+                text = decoder.decode(chunk, final=truncated)
+                if text:
+                    yield f"data: {json.dumps({'type': 'chunk', 'data': text})}\n\n"
+                if truncated:
+                    break
+            done = {"type": "done", "bytes_read": resp.num_bytes_downloaded, "truncated": truncated}
+            yield f"data: {json.dumps(done)}\n\n"
+        except httpx.HTTPError as e:
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+        finally:
+            await responses.aclose()
+
+    # the background task also closes the response when the client leaves before the
+    # generator starts (its finally never runs then); a second aclose() is a no-op
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             background=BackgroundTask(responses.aclose))
+
+async def _recorded_http(url: str, request) -> dict:
+    # await an HTTP check and record its outcome in the history
+    start = time.perf_counter()
+    try:
+        data = await request
+    except HTTPException:
+        tsdb.record(_history_key(url), False, None)
+        raise
+    latency = round((time.perf_counter() - start) * 1000, 2)
+    tsdb.record(_history_key(url), data["status_code"] < 500, latency)
+    return data
+
+def _normalize_url(url: str) -> str:
+    try:
+        u = httpx.URL(url)
+    except Exception:
+        return url
+    return str(u.copy_with(fragment=None))
+
+def _history_key(url: str) -> str:
+    # history is kept per origin: paths and query strings would add a series per unique URL
+    try:
+        u = httpx.URL(url)
+    except Exception:
+        return f"http:{url}"
+    port = u.port or (443 if u.scheme == "https" else 80)
+    return f"http:{u.scheme}://{u.host.lower()}:{port}"
+
 @app.post("/api/http")
 async def do_http(target: dict):
     """
-    JSON body: { "url": "...", "method": "GET", "timeout": 10, "verbose": false }
+    JSON body: { "url": "...", "method": "GET", "timeout": 10, "verbose": false,
+                 "max_bytes": 1048576, "stream": false, "consensus": false }
+    The body is read incrementally and reading stops at the byte cap, so huge
+    responses are never buffered. With verbose + stream the body is relayed as
+    Server-Sent Events instead of being returned in the JSON response.
+    GET/HEAD checks without custom headers are served from a short-lived shared
+    cache; "cached" and "cache_age" in the response say whether that happened.
+    "timings_ms" has dns, connect, tls, ttfb and total times (the first three
+    are null when a pooled connection was reused).
+    With "consensus" the request is sent to several of the target's addresses
+    (optional "probes" and "quorum", see app/consensus.py) and "consensus" in
+    the response holds the verdict and each probe's outcome.
     """
     url = target.get("url")
     method = target.get("method", "GET").upper()
     timeout = float(target.get("timeout", 10))
     verbose = bool(target.get("verbose", False))
+    stream = verbose and bool(target.get("stream", False))
+    consensus = bool(target.get("consensus", False))
     if not url:
         raise HTTPException(400, "url is required")
+    if consensus and stream:
+        raise HTTPException(400, "consensus checks can't be streamed")
     # Block private hosts
     host = url.split("/")[2] if "://" in url else url
     host = host.split(":")[0]
-    if is_private_host(host):
+    if consensus:
+        probes, quorum = _consensus_params(target)
+        if not url.startswith(("http://", "https://")):
+            raise HTTPException(400, "url must start with http:// or https://")
+        addrs = await vet_addresses(host)
+    elif await is_private_host(host):
         raise HTTPException(400, "target resolves to a private or local address")
 
+    if not verbose:
+        max_bytes = HTTP_PREVIEW_BYTES
+    else:
+        limit = HTTP_STREAM_MAX_BYTES if stream else HTTP_BODY_MAX_BYTES
+        max_bytes = min(int(target.get("max_bytes", limit)), limit)
+
     headers = target.get("headers") or {}
-    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-        try:
-            resp = await client.request(method, url, headers=headers)
-        except httpx.RequestError as e:
-            raise HTTPException(502, f"request failed: {e}")
+    if stream:
+        return await _relay_http(host, method, url, headers, timeout, max_bytes)
 
-    data = {
-        "status_code": resp.status_code,
-        "headers": dict(resp.headers),
-    }
-    body = resp.text
-    if not verbose:
-        if len(body) > 2000:
-            body = body[:2000] + "\n\n...truncated..."
-    data["body"] = body
-    return JSONResponse(data)
+    async def fetch():
+        if consensus:
+            return await _recorded_http(url, _fetch_http_consensus(host, method, url, headers, timeout, max_bytes,
+                                                                   verbose, addrs, probes, quorum))
+        return await _recorded_http(url, _fetch_http(host, method, url, headers, timeout, max_bytes, verbose))
+
+    if headers or method not in ("GET", "HEAD"):
+        data, cached, age = await fetch(), False, 0.0
+    else:
+        key = ("http", method, _normalize_url(url), verbose, max_bytes, timeout)
+        if consensus:
+            key += ("consensus", probes, quorum)
+        data, cached, age = await check_cache.get(key, fetch)
+    return JSONResponse(dict(data, cached=cached, cache_age=round(age, 3)))
 
 @app.post("/api/port")
 async def check_port(payload: dict):
     """
-    JSON body: { "host": "...", "port": 80, "timeout": 5 }
+    JSON body: { "host": "...", "port": 80, "timeout": 5, "consensus": false }
+    Results are shared between identical checks (same timeout) for a few seconds (see "cached").
+    The connect races all of the host's addresses (Happy Eyeballs); "attempts"
+    and "timings_ms" (dns, connect) break the check down.
+    With "consensus" several addresses of the host are probed (optional "probes"
+    and "quorum", see app/consensus.py); "open" is the verdict.
     """
     host = payload.get("host")
     port = int(payload.get("port", 80))
     timeout = float(payload.get("timeout", 5))
     if not host:
         raise HTTPException(400, "host is required")
-    if is_private_host(host):
-        raise HTTPException(400, "target resolves to a private or local address")
 
+    if payload.get("consensus"):
+        probes, quorum = _consensus_params(payload)
+        addrs = await vet_addresses(host)
+
+        async def probe_addr(addr: str):
+            result = await probe_port(addr, port, timeout)
+            result.pop("port", None)
+            return result["open"], result
+
+        async def probe():
+            verdict = await consensus_check(addrs, probe_addr, probes, quorum)
+            latency = next((p["latency_ms"] for p in verdict["probes"] if p.get("up")), None)
+            tsdb.record(f"port:{host.lower()}:{port}", verdict["up"], latency)
+            result = {"open": verdict["up"], "consensus": verdict}
+            if latency is not None:
+                result["latency_ms"] = latency
+            return result
+
+        key = ("port", host.lower(), port, timeout, "consensus", probes, quorum)
+        result, cached, age = await check_cache.get(key, probe)
+    else:
+        start = time.perf_counter()
+        addrs = await vet_addresses(host)
+        dns_ms = (time.perf_counter() - start) * 1000.0
+        result, cached, age = await _cached_port_check(host, addrs, port, timeout, dns_ms)
+    return dict(result, cached=cached, cache_age=round(age, 3))
+
+async def _cached_port_check(host: str, addrs: List[str], port: int, timeout: float,
+                             dns_ms: Optional[float] = None):
+    # one Happy Eyeballs TCP probe, shared through the check cache and recorded in the history
+    async def probe():
+        result = await connect_probe(addrs if PIN_RESOLVED_IP else [host], port, timeout)
+        result.pop("port", None)
+        result["timings_ms"] = {
+            "dns": round(dns_ms, 2) if dns_ms is not None else None,
+            "connect": result.pop("connect_ms", None),
+        }
+        tsdb.record(f"port:{host.lower()}:{port}", result["open"], result.get("latency_ms"))
+        return result
+
+    # the timeout is part of the key: a short timeout can report "down" where a longer one wouldn't
+    return await check_cache.get(("port", host.lower(), port, float(timeout)), probe)
+
+def _batch_params(host, ports, port_range, timeout, concurrency):
+    if not host:
+        raise HTTPException(400, "host is required")
     try:
-        fut = asyncio.open_connection(host, port)
-        start = time.time()
-        reader, writer = await asyncio.wait_for(fut, timeout=timeout)
-        latency = (time.time() - start) * 1000.0
-        writer.close()
-        try:
-            await writer.wait_closed()
-        except Exception:
-            pass
-        return {"open": True, "latency_ms": latency}
-    except asyncio.TimeoutError:
-        return {"open": False, "error": "timeout"}
-    except Exception as e:
-        return {"open": False, "error": str(e)}
+        port_list = parse_ports(ports, port_range)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(400, str(e))
+    timeout = min(float(timeout), MAX_PROBE_TIMEOUT)
+    if timeout <= 0:
+        raise HTTPException(400, "timeout must be positive")
+    return port_list, timeout, int(concurrency)
 
-@app.post("/api/nmap")
-async def run_nmap(payload: dict):
+async def _batch_results(addr: str, port_list: List[int], timeout: float, concurrency: int):
+    # yields each port result as it completes, then a summary record
+    start = time.perf_counter()
+    open_ports = []
+    async for result in scan_ports(addr, port_list, timeout, concurrency):
+        if result["open"]:
+            open_ports.append(result["port"])
+        yield result
+    yield {
+        "done": True,
+        "scanned": len(port_list),
+        "open_ports": sorted(open_ports),
+        "elapsed_ms": (time.perf_counter() - start) * 1000.0,
+    }
+
+@app.post("/api/ports/batch")
+async def check_ports_batch(payload: dict, request: Request):
     """
-    Restricted nmap-style scan for service checking.
-    JSON body: { "host": "...", "top_ports": 100, "timeout": 30 }
-    Notes: This endpoint runs the system 'nmap' binary and therefore requires nmap installed.
-    It explicitly forbids OS detection flags and limits scan to TCP connect (--top-ports).
+    JSON body: { "host": "...", "ports": [22, 80], "range": "1-1024", "timeout": 3, "concurrency": 100 }
+    Streams one NDJSON line per port as each probe finishes, followed by a summary line.
     """
-    host = payload.get("host")
-    top_ports = int(payload.get("top_ports", 100))
-    timeout = int(payload.get("timeout", 30))
-    if not host:
-        raise HTTPException(400, "host is required")
-    if top_ports <= 0 or top_ports > 1000:
-        raise HTTPException(400, "top_ports must be between 1 and 1000")
-    if is_private_host(host):
-        raise HTTPException(400, "target resolves to a private or local address")
+    port_list, timeout, concurrency = _batch_params(
+        payload.get("host"),
+        payload.get("ports"),
+        payload.get("range"),
+        payload.get("timeout", 3),
+        payload.get("concurrency", 100),
+    )
+    await charge(request, batch_cost(len(port_list)))
+    addr = await vet_host(payload["host"])
 
-    nmap_path = shutil.which("nmap")
-    if not nmap_path:
-        raise HTTPException(400, "nmap binary not found on server")
+    async def ndjson_stream():
+        async for item in _batch_results(addr, port_list, timeout, concurrency):
+            yield json.dumps(item) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+@app.get("/api/ports/batch/stream")
+async def stream_ports_batch(
+    request: Request,
+    host: str,
+    ports: Optional[str] = None,
+    range: Optional[str] = None,
+    timeout: float = 3,
+    concurrency: int = 100,
+):
+    """
+    Server-Sent Events version of /api/ports/batch.
+    GET params: host, ports ("22,80,443") and/or range ("1-1024"), timeout, concurrency
+    """
+    port_list, timeout, concurrency = _batch_params(host, ports, range, timeout, concurrency)
+    await charge(request, batch_cost(len(port_list)))
+    addr = await vet_host(host)
 
+    async def event_stream():
+        async for item in _batch_results(addr, port_list, timeout, concurrency):
+            yield f"data: {json.dumps(item)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+async def _bulk_tcp(target: BulkTarget, addrs: List[str], timeout: float) -> dict:
+    result, cached, age = await _cached_port_check(target.host, addrs, target.port, timeout)
+    return dict(result, up=result["open"], cached=cached, cache_age=round(age, 3))
+
+async def _bulk_http(target: BulkTarget, addrs: List[str], timeout: float) -> dict:
+    # a plain GET, sharing cache entries with non-verbose /api/http checks with the same timeout;
+    # headers and body are left out
+    async def fetch():
+        return await _recorded_http(target.url, _fetch_http(target.host, "GET", target.url, {}, timeout,
+                                                            HTTP_PREVIEW_BYTES, False))
+
+    key = ("http", "GET", _normalize_url(target.url), False, HTTP_PREVIEW_BYTES, float(timeout))
+    data, cached, age = await check_cache.get(key, fetch)
+    return {
+        "up": data["status_code"] < 500,
+        "status_code": data["status_code"],
+        "http_version": data["http_version"],
+        "cached": cached,
+        "cache_age": round(age, 3),
+    }
+
+@app.post("/api/check/bulk")
+async def check_bulk(payload: dict, request: Request):
+    """
+    JSON body: { "targets": ["https://example.com/", "example.com:22",
+                             {"url": "..."}, {"host": "...", "port": 443}, ...],
+                 "timeout": 5, "concurrency": 100 }
+    Duplicate targets are checked once ("index" lists every position they had).
+    Streams one NDJSON line per target in completion order, then a summary line.
+    """
+    try:
+        targets = parse_targets(payload.get("targets"))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    timeout = min(float(payload.get("timeout", 5)), MAX_PROBE_TIMEOUT)
+    if timeout <= 0:
+        raise HTTPException(400, "timeout must be positive")
+    concurrency = int(payload.get("concurrency", BULK_CONCURRENCY))
+    await charge(request, batch_cost(len(targets)))
+    checks = {"tcp": partial(_bulk_tcp, timeout=timeout), "http": partial(_bulk_http, timeout=timeout)}
+
+    async def ndjson_stream():
+        start = time.perf_counter()
+        up = 0
+        async for item in run_bulk(targets, vet_addresses, checks, concurrency):
+            up += bool(item["up"])
+            yield json.dumps(item) + "\n"
+        yield json.dumps({
+            "done": True,
+            "targets": len(targets),
+            "duplicates": sum(len(t.indexes) - 1 for t in targets),
+            "up": up,
+            "down": len(targets) - up,
+            "elapsed_ms": (time.perf_counter() - start) * 1000.0,
+        }) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+def _nmap_cmd(nmap_path: str, host: str, top_ports: int, xml: bool = False) -> List[str]:
     # Whitelist of args we will pass (we construct command ourselves)
     cmd = [
         nmap_path,
@@ -764,167 +1123,552 @@ async def run_nmap(payload: dict):
         "--top-ports",
         str(top_ports),
         "--open",
-        host,
     ]
+    if xml:
+        # XML on stdout, parsed as it arrives, with periodic <taskprogress> elements
+        cmd += ["-oX", "-", "--stats-every", NMAP_STATS_EVERY]
+    return cmd + [host]
 
+def _scan_engine(engine: Optional[str]) -> str:
+    engine = (engine or SCAN_ENGINE).lower()
+    if engine not in ("builtin", "nmap"):
+        raise HTTPException(400, "engine must be 'builtin' or 'nmap'")
+    if engine == "nmap" and not shutil.which("nmap"):
+        raise HTTPException(400, "nmap binary not found on server")
+    return engine
+
+def _emit_event(job: Job, event: Dict):
+    # compact JSON, one event per SSE message; progress ticks aren't replayed to late joiners
+    job.emit(json.dumps(event, separators=(",", ":")), keep=event["type"] != "progress")
+
+async def _nmap_job(addr: str, job: Job) -> dict:
+    # runs on a scan worker; events are published on the job as they arrive
+    host, top_ports, timeout, engine = (
+        job.params["host"], job.params["top_ports"], job.params["timeout"], job.params["engine"]
+    )
+    report = connectscan.ScanReport(host, addr, connectscan.top_ports(top_ports))
+    if engine == "builtin":
+
+        async def scan():
+            async for event in connectscan.scan_events(report):
+                _emit_event(job, dict(event, engine=engine) if event["type"] == "start" else event)
+
+        try:
+            with metrics.stage("scan_builtin"):
+                await asyncio.wait_for(scan(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(504, "scan timed out")
+        return {
+            "cmd": _nmap_cmd("builtin", host, top_ports),
+            "stdout": report.text(),
+            "stderr": "",
+            "returncode": 0,
+            "engine": engine,
+            "scan": report.to_dict(),
+        }
+
+    cmd = _nmap_cmd(shutil.which("nmap"), host, top_ports, xml=True)
     try:
-        proc = await asyncio.to_thread(
-            subprocess.run,
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
         )
-    except subprocess.TimeoutExpired:
-        raise HTTPException(504, "nmap timed out")
     except Exception as e:
         raise HTTPException(500, f"failed to run nmap: {e}")
+    parser = NmapXmlParser(report)
 
-    out = proc.stdout or ""
-    err = proc.stderr or ""
-    return {"cmd": cmd, "stdout": out, "stderr": err, "returncode": proc.returncode}
+    async def collect():
+        stderr = asyncio.ensure_future(proc.stderr.read())
+        _emit_event(job, dict(report.start_event(), engine=engine))
+        bad_xml = None
+        while True:
+            chunk = await proc.stdout.read(65536)
+            try:
+                events = parser.feed(chunk) if chunk else parser.close()
+            except ParseError as e:
+                # keep draining so nmap doesn't block on a full pipe
+                bad_xml, events = bad_xml or e, []
+            for event in events:
+                _emit_event(job, event)
+            if not chunk:
+                break
+        await proc.wait()
+        err = (await stderr).decode(errors="replace")
+        if bad_xml is not None and proc.returncode == 0:
+            raise HTTPException(502, f"unreadable nmap output: {bad_xml}")
+        return err
 
-@app.get("/api/nmap/stream")
-async def stream_nmap(host: str, top_ports: int = 100):
-    """
-    Stream nmap stdout as Server-Sent Events.
-    GET params: host, top_ports
-    """
+    try:
+        with metrics.stage("scan_nmap"):
+            err = await asyncio.wait_for(collect(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(504, "nmap timed out")
+    finally:
+        # timed out, or cancelled because every client of a shared scan left
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    report.finish(parser.elapsed)
+    return {
+        "cmd": cmd,
+        "stdout": report.text(),
+        "stderr": err,
+        "returncode": proc.returncode,
+        "engine": engine,
+        "scan": report.to_dict(),
+    }
+
+async def _submit_nmap(payload: dict, client: str, shared: bool = False) -> Job:
+    host = payload.get("host")
+    top_ports = int(payload.get("top_ports", 100))
+    timeout = int(payload.get("timeout", 30))
     if not host:
         raise HTTPException(400, "host is required")
     if top_ports <= 0 or top_ports > 1000:
         raise HTTPException(400, "top_ports must be between 1 and 1000")
-    if is_private_host(host):
-        raise HTTPException(400, "target resolves to a private or local address")
+    engine = _scan_engine(payload.get("engine"))
+    addr = await vet_host(host)
+    params = {"host": host, "top_ports": top_ports, "timeout": timeout, "engine": engine}
+    try:
+        # smaller scans finish sooner, so they go first
+        if shared:
+            key = ("nmap", host.lower(), top_ports, engine, timeout)
+            return scan_jobs.submit_shared(key, "nmap", client, params, partial(_nmap_job, addr), priority=top_ports)
+        return scan_jobs.submit("nmap", client, params, partial(_nmap_job, addr), priority=top_ports)
+    except JobRejected as e:
+        raise HTTPException(e.status_code, e.detail, headers={"Retry-After": str(int(e.retry_after + 0.999))})
 
-    nmap_path = shutil.which("nmap")
-    if not nmap_path:
-        raise HTTPException(400, "nmap binary not found on server")
+@app.post("/api/nmap")
+async def run_nmap(payload: dict, request: Request):
+    """
+    Restricted nmap-style scan for service checking.
+    JSON body: { "host": "...", "top_ports": 100, "timeout": 30, "engine": "builtin" }
+    Notes: The default "builtin" engine runs an in-process TCP connect scan over nmap's
+    top-ports table. engine="nmap" runs the system 'nmap' binary instead (requires nmap installed).
+    Either way the scan is limited to TCP connect (--top-ports), with no OS detection.
+    The scan runs on the shared scan queue; this call waits for it to finish
+    (see POST /api/nmap/jobs to submit without waiting).
+    """
+    job = await _submit_nmap(payload, request.client.host or "unknown")
+    await job.wait()
+    if job.status == "failed":
+        raise HTTPException(job.error_status, job.error)
+    return job.result
 
-    cmd = [
-        nmap_path,
-        "-sT",
-        "--top-ports",
-        str(top_ports),
-        "--open",
-        host,
-    ]
+@app.post("/api/nmap/jobs", status_code=202)
+async def submit_nmap_job(payload: dict, request: Request):
+    """
+    Same body as /api/nmap. Returns a job id immediately; follow the job at
+    /api/jobs/{id} (poll), /api/jobs/{id}/events (SSE) or /api/jobs/{id}/result.
+    503/429 with Retry-After when the queue is full or the client has too many scans.
+    """
+    job = await _submit_nmap(payload, request.client.host or "unknown")
+    data = job.to_dict(scan_jobs.position(job))
+    data["links"] = {
+        "status": f"/api/jobs/{job.id}",
+        "events": f"/api/jobs/{job.id}/events",
+        "result": f"/api/jobs/{job.id}/result",
+    }
+    return data
 
-    async def event_stream():
-        # spawn subprocess and stream stdout lines as SSE data events
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        try:
-            # send a start event
-            yield f"data: __START__\n\n"
-            buf = b""
-            while True:
-                line = await proc.stdout.readline()
-                if not line:
-                    break
-                # forward line
-                text = line.decode(errors="replace").rstrip("\n")
-                yield f"data: {text}\n\n"
-                buf += line
-            await proc.wait()
-            # send done with returncode and any stderr
-            stderr = (await proc.stderr.read()).decode(errors="replace")
-            done_payload = {"returncode": proc.returncode, "stderr": stderr}
-            yield f"data: __DONE__ {done_payload}\n\n"
-        except Exception as e:
-            yield f"data: __ERROR__ {str(e)}\n\n"
+def _sse_event(event: Dict) -> str:
+    return f"data: {json.dumps(event, separators=(',', ':'))}\n\n"
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+def _done_event(result: Dict) -> Dict:
+    event = {"type": "done", "returncode": result.get("returncode", 0), "stderr": result.get("stderr", "")}
+    scan = result.get("scan") or {}
+    if scan:
+        event.update(host_up=scan["host_up"], open=len(scan["open_ports"]), closed=scan["closed"],
+                     filtered=scan["filtered"], elapsed_s=round(scan["elapsed_s"], 3))
+    return event
 
-# Load SPA template (dist build preferred, fallback to source index)
-TEMPLATE_PATHS = ["frontend/dist/index.html", "frontend/index.html"]
-_TEMPLATE_CONTENT = None
+async def _job_events(sub: Subscription):
+    # SSE framing shared by /api/nmap/stream and /api/jobs/{id}/events: one compact
+    # JSON event per message, "job" first and "done" or "error" last
+    job = sub.job
+    yield _sse_event({"type": "job", "job_id": job.id, "status": job.status})
+    async for line in sub.lines():
+        yield f"data: {line}\n\n"
+    if sub.overflowed:
+        yield _sse_event({"type": "error", "detail": "client fell too far behind the scan output"})
+    elif job.status == "done":
+        yield _sse_event(_done_event(job.result))
+    else:
+        yield _sse_event({"type": "error", "detail": job.error})
 
-def load_template():
-    global _TEMPLATE_CONTENT
-    if _TEMPLATE_CONTENT is not None:
-        return _TEMPLATE_CONTENT
-    for p in TEMPLATE_PATHS:
-        try:
-            with open(p, "r", encoding="utf-8") as f:
-                _TEMPLATE_CONTENT = f.read()
-                return _TEMPLATE_CONTENT
-        except FileNotFoundError:
-            continue
-    raise RuntimeError("index.html template not found in frontend/dist or frontend/")
-
-def render_index(route: str):
-    tpl = load_template()
-    # defaults
-    meta = {
-        "title": "Isitdown? - Free Online Service Checker, Port Scanner & HTTP Tester",
-        "description": "Free online website checker, port scanner, HTTP tester, and service monitor. Check if websites are down, scan ports with online nmap, test APIs with curl-like tool. No installation required.",
-        "og_title": "Isitdown? - Free Online Service Checker & Port Scanner",
-        "og_description": "Check if websites are down, scan ports with online nmap tool, test HTTP requests with curl-like interface. Free and easy to use.",
-        "canonical": "https://isitdown.space/",
-    }
-    if route == "curl":
-        meta.update({
-            "title": "Curl - Online HTTP tester | Isitdown?",
-            "description": "Online curl tool: send HTTP requests, set headers, and inspect responses. A lightweight curl-like interface in the browser.",
-            "og_title": "Curl - Online HTTP tester",
-            "og_description": "Use the online curl tester to send GET/POST requests, inspect headers and responses. No install required.",
-            "canonical": "https://isitdown.space/curl",
-        })
-    elif route == "port-scan":
-        meta.update({
-            "title": "Port Scan - Online Nmap & Port Scanner | Isitdown?",
-            "description": "Online port scanner using TCP-connect scans. Check open ports and services on hosts quickly and safely.",
-            "og_title": "Port Scan - Online Nmap",
-            "og_description": "Run restricted TCP connect port scans (no OS detection) to discover open services.",
-            "canonical": "https://isitdown.space/port-scan",
-        })
-    elif route == "status":
-        meta.update({
-            "title": "Status Checker - Is my site down? | Isitdown?",
-            "description": "Quick website status checker: test HTTP endpoints and ports to see if your site or server is up.",
-            "og_title": "Status Checker - Website status",
-            "og_description": "Instantly check whether a website or server is up or down with our quick status tool.",
-            "canonical": "https://isitdown.space/status",
-        })
+def _job_stream(sub: Subscription) -> StreamingResponse:
+    # the background task also unsubscribes when the client leaves before the
+    # generator starts, so a shared scan still sees its last subscriber go
+    async def unsubscribe():
+        sub.close()
 
-    # Simple replacements
-    out = tpl
-    out = out.replace(
-        "<title>Isitdown? - Free Online Service Checker, Port Scanner & HTTP Tester</title>",
-        f"<title>{meta['title']}</title>",
-    )
-    out = out.replace(
-        '<meta name="description" content="Free online website checker, port scanner, HTTP tester, and service monitor. Check if websites are down, scan ports with online nmap, test APIs with curl-like tool. No installation required.">',
-        f'<meta name="description" content="{meta["description"]}">',
-    )
-    out = out.replace(
-        '<meta property="og:title" content="Isitdown? - Free Online Service Checker & Port Scanner">',
-        f'<meta property="og:title" content="{meta["og_title"]}">',
-    )
-    out = out.replace(
-        '<meta property="og:description" content="Check if websites are down, scan ports with online nmap tool, test HTTP requests with curl-like interface. Free and easy to use.">',
-        f'<meta property="og:description" content="{meta["og_description"]}">',
-    )
-    out = out.replace(
-        '<link rel="canonical" href="https://isitdown.space/">',
-        f'<link rel="canonical" href="{meta["canonical"]}">',
+    return StreamingResponse(_job_events(sub), media_type="text/event-stream",
+                             background=BackgroundTask(unsubscribe))
+
+def _get_job(job_id: str) -> Job:
+    job = scan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "job not found or expired")
+    return job
+
+async def _job_snapshot(job_id: str) -> Optional[Dict]:
+    # a job run by another worker: its last published status (shared state store only)
+    if scan_jobs.get(job_id) is not None:
+        return None
+    snap = await scan_jobs.snapshot(job_id)
+    if snap is None:
+        raise HTTPException(404, "job not found or expired")
+    return snap
+
+def _snapshot_status(snap: Dict) -> Dict:
+    return {k: v for k, v in snap.items() if k not in ("chunks", "error_status")}
+
+async def _snapshot_events(job_id: str, since: int):
+    # SSE for a job on another worker, following its published status and output chunks
+    seen = 0  # output lines read so far
+    chunks = 0  # output chunks read so far
+    announced = False
+    while True:
+        snap = await scan_jobs.snapshot(job_id)
+        if snap is None:
+            yield _sse_event({"type": "error", "detail": "job expired"})
+            return
+        if not announced:
+            yield _sse_event({"type": "job", "job_id": job_id, "status": snap["status"]})
+            announced = True
+        if snap["chunks"] > chunks:
+            for line in await scan_jobs.snapshot_output(job_id, chunks, snap["chunks"]):
+                if seen >= since:
+                    yield f"data: {line}\n\n"
+                seen += 1
+            chunks = snap["chunks"]
+        if snap["status"] == "done":
+            yield _sse_event(_done_event(snap["result"]))
+            return
+        if snap["finished"] is not None:
+            yield _sse_event({"type": "error", "detail": snap.get("error")})
+            return
+        await asyncio.sleep(JOB_PUBLISH_INTERVAL)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    snap = await _job_snapshot(job_id)
+    if snap is not None:
+        return _snapshot_status(snap)
+    job = _get_job(job_id)
+    return job.to_dict(scan_jobs.position(job))
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """The scan result once done; 202 with the job status while it is still queued or running."""
+    snap = await _job_snapshot(job_id)
+    if snap is not None:
+        if snap["status"] == "failed":
+            raise HTTPException(snap["error_status"], snap["error"])
+        if snap["status"] != "done":
+            return JSONResponse(_snapshot_status(snap), status_code=202)
+        return snap["result"]
+    job = _get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(job.error_status, job.error)
+    if job.status != "done":
+        return JSONResponse(job.to_dict(scan_jobs.position(job)), status_code=202)
+    return job.result
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job(job_id: str, since: int = 0):
+    """
+    Job output as Server-Sent Events, in the same format as /api/nmap/stream.
+    `since` skips events already received (progress events aren't counted),
+    for reconnecting clients.
+    """
+    if await _job_snapshot(job_id) is not None:
+        return StreamingResponse(_snapshot_events(job_id, max(0, since)), media_type="text/event-stream")
+    job = _get_job(job_id)
+    return _job_stream(job.subscribe(max(0, since)))
+
+@app.on_event("startup")
+async def start_scan_workers():
+    scan_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_scan_workers():
+    await scan_jobs.stop()
+
+@app.get("/qhx-admin/api/jobs")
+async def get_job_stats(request: Request):
+    """Scan queue depth, wait times and rejections"""
+    session_id = request.cookies.get("admin_session")
+    if not session_id or not await verify_admin_session(session_id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return scan_jobs.metrics()
+
+@app.get("/api/nmap/stream")
+async def stream_nmap(request: Request, host: str, top_ports: int = 100, engine: Optional[str] = None):
+    """
+    Stream scan results as Server-Sent Events, one compact JSON object per message:
+    {"type": "job"}, {"type": "start"}, {"type": "port_open", "port", "proto", "service", "rtt_ms"}
+    as ports are found, {"type": "progress", "percent"} now and then, and finally
+    {"type": "done", "returncode", "stderr", "host_up", "open", "closed", ...} or
+    {"type": "error", "detail"}.
+    GET params: host, top_ports, engine ("builtin" or "nmap")
+    Identical concurrent streams (same host, top_ports and engine) share one
+    queued scan: late joiners get the events emitted so far, then live ones,
+    and the scan is cancelled once every client has disconnected.
+    """
+    payload = {"host": host, "top_ports": top_ports, "engine": engine, "timeout": NMAP_STREAM_TIMEOUT}
+    job = await _submit_nmap(payload, request.client.host or "unknown", shared=True)
+    # subscribe before returning so the shared scan can't be cancelled in between
+    return _job_stream(job.subscribe())
+
+# Continuous monitoring: scheduled checks reuse the one-off HTTP and TCP probes
+async def _monitor_http(target: Target):
+    host = target.url.split("/")[2].split(":")[0]
+    if await is_private_host(host):
+        return False, None, "target resolves to a private or local address"
+    start = time.perf_counter()
+    try:
+        data = await _fetch_http(host, "GET", target.url, {}, target.timeout, HTTP_PREVIEW_BYTES, False)
+    except HTTPException as e:
+        return False, None, str(e.detail)
+    latency = round((time.perf_counter() - start) * 1000, 2)
+    return data["status_code"] < 500, latency, f"HTTP {data['status_code']}"
+
+async def _monitor_tcp(target: Target):
+    try:
+        addrs = await vet_addresses(target.host)
+    except HTTPException as e:
+        return False, None, str(e.detail)
+    result = await connect_probe(addrs if PIN_RESOLVED_IP else [target.host], target.port, target.timeout)
+    return result["open"], result.get("latency_ms"), result.get("error", "open")
+
+monitor = Monitor({"http": _monitor_http, "tcp": _monitor_tcp}, store=tsdb,
+                  registry=state_store if state_store.shared else None)
+
+@app.on_event("startup")
+async def start_monitor():
+    if state_store.shared:
+        # one tsdb directory per worker; only the first worker schedules monitor checks
+        slot = claim_worker_slot(TSDB_DIR)
+        tsdb.use_slot(slot)
+        monitor.primary = slot == 0
+    tsdb.open()
+    monitor.start()
+
+@app.on_event("shutdown")
+async def stop_monitor():
+    await monitor.stop()
+    tsdb.close()
+
+@app.on_event("shutdown")
+async def close_state_store():
+    # after the scan workers and the monitor, whose last writes go through it
+    if state_store.shared:
+        await asyncio.to_thread(state_store.close)
+
+@app.post("/api/monitors")
+async def create_monitor(payload: dict, request: Request):
+    """
+    JSON body: { "url": "https://..." } or { "host": "...", "port": 443 },
+               plus optional "interval" (seconds) and "timeout".
+    Returns the monitor with its id; query it at /api/monitors/{id}.
+    Costs MONITOR_CREATE_COST rate-limit tokens, and each client IP may
+    register at most MONITOR_MAX_PER_CLIENT targets (app/monitor.py).
+    """
+    interval = float(payload.get("interval", 60))
+    timeout = float(payload.get("timeout", 10))
+    if interval < MONITOR_MIN_INTERVAL:
+        raise HTTPException(400, f"interval must be at least {MONITOR_MIN_INTERVAL:g} seconds")
+    if timeout <= 0 or timeout > min(interval, 30):
+        raise HTTPException(400, "timeout must be between 0 and 30 seconds and not exceed the interval")
+
+    client = request.client.host or "unknown"
+    url = payload.get("url")
+    if url:
+        if not url.startswith(("http://", "https://")):
+            raise HTTPException(400, "url must start with http:// or https://")
+        await vet_host(url.split("/")[2].split(":")[0])
+        target = Target("http", interval, timeout, url=url, client=client)
+    else:
+        host = payload.get("host")
+        if not host:
+            raise HTTPException(400, "url or host is required")
+        port = int(payload.get("port", 80))
+        if not 1 <= port <= 65535:
+            raise HTTPException(400, "port must be between 1 and 65535")
+        await vet_host(host)
+        target = Target("tcp", interval, timeout, host=host, port=port, client=client)
+
+    await charge(request, MONITOR_CREATE_COST)
+    try:
+        await monitor.add(target)
+    except MonitorQuotaExceeded as e:
+        raise HTTPException(429, str(e))
+    except ValueError as e:
+        raise HTTPException(503, str(e))
+    return target.to_dict()
+
+@app.get("/api/monitors/{monitor_id}")
+async def get_monitor(monitor_id: str, window: float = 86400):
+    """Uptime %, latency percentiles and incident windows over the last `window` seconds."""
+    report = await monitor.report(monitor_id, window)
+    if report is None:
+        raise HTTPException(404, "monitor not found")
+    return report
+
+@app.delete("/api/monitors/{monitor_id}")
+async def delete_monitor(monitor_id: str):
+    if not await monitor.remove(monitor_id):
+        raise HTTPException(404, "monitor not found")
+    return {"deleted": monitor_id}
+
+@app.get("/api/history")
+async def get_history(url: Optional[str] = None, host: Optional[str] = None, port: int = 80,
+                      window: float = 3600, resolution: Optional[str] = None):
+    """
+    Recorded results of past checks of a URL's origin (?url=) or host:port (?host=&port=).
+    resolution: "raw", "1m" or "1h" (default: picked from the window).
+    """
+    if resolution not in (None, "raw", "1m", "1h"):
+        raise HTTPException(400, "resolution must be raw, 1m or 1h")
+    if url:
+        key = _history_key(url)
+    elif host:
+        key = f"port:{host.lower()}:{port}"
+    else:
+        raise HTTPException(400, "url or host is required")
+    # reads only this target's records, but still off the event loop
+    return await asyncio.to_thread(tsdb.history, key, window, resolution)
+
+@app.get("/qhx-admin/api/monitors")
+async def get_monitor_stats(request: Request):
+    """Scheduler counters and the number of monitored targets"""
+    session_id = request.cookies.get("admin_session")
+    if not session_id or not await verify_admin_session(session_id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return monitor.metrics()
+
+# Instrumentation: Prometheus text format at /metrics (metrics.METRICS_ENABLED turns it off)
+async def instrument_requests(request: Request, call_next):
+    metrics.requests_in_flight.inc()
+    start = time.perf_counter()
+    try:
+        # for streaming responses this covers the time until headers are sent
+        return await call_next(request)
+    finally:
+        metrics.requests_in_flight.dec()
+        # the router has put the matched route into the scope by now
+        metrics.request_seconds.observe(time.perf_counter() - start,
+                                        metrics.endpoint_label(request.scope), request.method)
+
+if metrics.METRICS_ENABLED:
+    app.middleware("http")(instrument_requests)
+
+metrics.register(metrics.Collector(
+    "isitdown_rate_limit_rejected_total", "counter", "Requests rejected by the rate limiter",
+    lambda: rate_limiter.rejected))
+metrics.register(metrics.Collector(
+    "isitdown_threadpool", "gauge", "Default thread pool threads, max_workers and queued work items",
+    metrics.threadpool_stats, label="stat"))
+for _name, _help, _fn in (
+    ("isitdown_dns", "Resolver cache counters", resolver.metrics),
+    ("isitdown_check_cache", "Check result cache counters", check_cache.metrics),
+    ("isitdown_scan_jobs", "Scan queue counters and depth", scan_jobs.metrics),
+    ("isitdown_visitor_log", "Visitor write-behind queue counters", visitor_log.metrics),
+    ("isitdown_visitor_db", "Visitor database read/write pool counters", visitors_db.metrics),
+    ("isitdown_state_store", "Shared state store counters", state_store.metrics),
+    ("isitdown_visitor_archive", "Visitor log archiver counters", visitor_archiver.metrics),
+    ("isitdown_monitor", "Monitor scheduler counters", monitor.metrics),
+):
+    metrics.register(metrics.Collector(_name, "untyped", _help, _fn, label="stat"))
+
+@app.on_event("startup")
+async def start_metrics():
+    metrics.start()
+
+@app.on_event("shutdown")
+async def stop_metrics():
+    await metrics.stop()
+
+@app.get("/metrics")
+async def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(404, "metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Debug mode: event-loop stall watchdog and on-demand sampling profiler (admin only)
+profile_lock = asyncio.Lock()
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    if DEBUG_LOOP_WATCHDOG:
+        loop_watchdog.start()
+
+@app.on_event("shutdown")
+async def stop_loop_watchdog():
+    await loop_watchdog.stop()
+
+metrics.register(metrics.Collector(
+    "isitdown_event_loop_stalls_total", "counter", "Loop stalls seen by the debug watchdog",
+    lambda: loop_watchdog.total))
+
+@app.get("/qhx-admin/api/debug/stalls")
+async def get_loop_stalls(request: Request):
+    """Recent event-loop stalls with the stack that was running when each was detected"""
+    session_id = request.cookies.get("admin_session")
+    if not session_id or not await verify_admin_session(session_id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return loop_watchdog.report()
+
+@app.post("/qhx-admin/api/debug/watchdog")
+async def set_loop_watchdog(request: Request, enabled: bool = True, threshold_ms: Optional[float] = None):
+    """Turn the stall watchdog on or off at runtime"""
+    session_id = request.cookies.get("admin_session")
+    if not session_id or not await verify_admin_session(session_id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if threshold_ms is not None:
+        if threshold_ms <= 0:
+            raise HTTPException(400, "threshold_ms must be positive")
+        loop_watchdog.threshold = threshold_ms / 1000.0
+    if enabled:
+        loop_watchdog.start()
+    else:
+        await loop_watchdog.stop()
+    return {"running": loop_watchdog.running, "threshold_s": loop_watchdog.threshold}
+
+@app.get("/qhx-admin/api/debug/profile")
+async def get_profile(request: Request, seconds: float = 10, interval_ms: float = 5, threads: str = "loop"):
+    """
+    Sample stacks for `seconds` and download them as collapsed stacks
+    (feed to flamegraph.pl or speedscope). threads: "loop" or "all".
+    """
+    session_id = request.cookies.get("admin_session")
+    if not session_id or not await verify_admin_session(session_id):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if seconds <= 0 or interval_ms <= 0:
+        raise HTTPException(400, "seconds and interval_ms must be positive")
+    if threads not in ("loop", "all"):
+        raise HTTPException(400, "threads must be 'loop' or 'all'")
+    if profile_lock.locked():
+        raise HTTPException(409, "a profile is already running")
+    thread_ids = [threading.get_ident()] if threads == "loop" else None
+    async with profile_lock:
+        stacks = await asyncio.to_thread(sample_profile, seconds, interval_ms / 1000.0, thread_ids)
+    return PlainTextResponse(
+        stacks, headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'}
     )
-    return out
 
-# SEO-friendly routes with per-route meta injection
-@app.get("/curl", response_class=HTMLResponse)
-async def curl_page():
-    return HTMLResponse(render_index("curl"))
+# SEO-friendly routes with per-route meta, served pre-rendered from memory
+@app.on_event("startup")
+async def render_pages():
+    page_cache.refresh(force=True)
 
-@app.get("/port-scan", response_class=HTMLResponse)
-async def port_scan_page():
-    return HTMLResponse(render_index("port-scan"))
+def _page_handler(route: str):
+    async def page(request: Request):
+        return page_cache.response(route, request)
+    return page
 
-@app.get("/status", response_class=HTMLResponse)
-async def status_page():
-    return HTMLResponse(render_index("status"))
+for _route in ROUTE_META:
+    app.add_api_route(_route, _page_handler(_route), methods=["GET"], response_class=HTMLResponse)
 
 # Serve built React frontend (vite build output) - mount last so API routes take precedence
 app.mount("/", StaticFiles(directory="frontend/dist", html=True), name="static")
\ No newline at end of file
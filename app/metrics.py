@@ -0,0 +1,239 @@
+"""
+Lightweight instrumentation exported in Prometheus text format at /metrics.
+
+Hot paths wrap their stages in `stage("dns")` and the like; each stage is a
+fixed-bucket histogram (a bisect and two additions per observation).
+Counters that the subsystems already keep (resolver, caches, queues, rate
+limiter, ...) are not duplicated: they are read through collector callbacks
+only when /metrics is scraped.
+
+With METRICS_ENABLED = False, stage() hands back a shared no-op context
+manager, the request middleware isn't installed, the loop-lag sampler is
+skipped and /metrics returns 404.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = True
+LOOP_LAG_INTERVAL = 0.5  # seconds between event-loop lag samples
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()  # observations also come from worker threads
+
+    def observe(self, value: float, *label_values: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="' + _fmt_value(bound) + '"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, label_values)} {_fmt_value(series[-1])}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, label_values)} {cumulative}"
+
+
+class Gauge:
+    """A labelled value set in process (in-flight requests, last loop lag)."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str):
+        self.inc(*label_values, amount=-1)
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in list(self._values.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, label_values)} {_fmt_value(value)}"
+
+
+class Collector:
+    """Values read from elsewhere at scrape time: fn() -> {label value or (): number}."""
+
+    def __init__(self, name: str, kind: str, help: str, fn: Callable[[], Dict], label: Optional[str] = None):
+        self.name = name
+        self.kind = kind  # "counter", "gauge" or "untyped" for mixed stats dicts
+        self.help = help
+        self.fn = fn
+        self.label = label
+
+    def render(self) -> Iterable[str]:
+        try:
+            values = self.fn()
+        except Exception:
+            return  # a broken collector must not break the scrape
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if not isinstance(values, dict):
+            yield f"{self.name} {_fmt_value(values)}"
+            return
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f"{self.name}{_fmt_labels((self.label,), (key,))} {_fmt_value(value)}"
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist: Histogram, labels: Tuple[str, ...]):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+registry: List = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = register(Histogram(
+    "isitdown_stage_seconds", "Time spent in instrumented stages (dns, sqlite, http, scan)", ("stage",)))
+request_seconds = register(Histogram(
+    "isitdown_request_seconds", "HTTP request handling time by endpoint", ("endpoint", "method")))
+requests_in_flight = register(Gauge(
+    "isitdown_requests_in_flight", "Requests currently being handled"))
+loop_lag_seconds = register(Histogram(
+    "isitdown_event_loop_lag_seconds", "How late the event loop woke up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+loop_lag_last = register(Gauge("isitdown_event_loop_lag_last_seconds", "Most recent event loop lag sample"))
+
+
+def stage(name: str):
+    """Context manager timing one stage into isitdown_stage_seconds{stage=name}."""
+    if not METRICS_ENABLED:
+        return _NULL_TIMER
+    return _Timer(stage_seconds, (name,))
+
+
+def endpoint_label(scope) -> str:
+    """
+    Route template of a routed request ("/api/jobs/{job_id}"), bounded in
+    cardinality; read from the scope the router filled in, so only known
+    once the app has handled the request.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    return "static" if "endpoint" in scope else "unmatched"
+
+
+def threadpool_stats() -> Dict:
+    # the default executor serves asyncio.to_thread (sqlite rate limits, visitor stop, ...)
+    executor = getattr(asyncio.get_event_loop(), "_default_executor", None)
+    if executor is None:
+        return {"threads": 0, "max_workers": 0, "queued": 0}
+    return {
+        "threads": len(executor._threads),
+        "max_workers": executor._max_workers,
+        "queued": executor._work_queue.qsize(),
+    }
+
+
+async def _sample_loop_lag():
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL)
+        loop_lag_seconds.observe(lag)
+        loop_lag_last.set(lag)
+
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+def start():
+    global _lag_task
+    if METRICS_ENABLED and _lag_task is None:
+        _lag_task = asyncio.ensure_future(_sample_loop_lag())
+
+
+async def stop():
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
@@ -0,0 +1,282 @@
+"""
+Continuous monitoring of registered targets.
+
+Targets (an HTTP URL or a host:port) are kept in a heap ordered by their next
+due time, so the scheduler only ever looks at the head of the heap and
+(re)scheduling a target costs O(log n) however many targets are monitored.
+Due checks run as tasks under a concurrency cap, with random jitter added to
+each interval so targets registered together don't stay in lockstep.
+
+The probe functions are injected by the app so monitoring reuses the same
+HTTP and TCP check code as the one-off endpoints.
+
+With several uvicorn workers the targets live in the shared state store
+(registry) so any worker can add, remove or report on them, but only the
+primary worker runs the scheduler; it picks up changes made through the
+other workers every MONITOR_SYNC_INTERVAL seconds.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+MONITOR_MIN_INTERVAL = 30.0  # seconds
+MONITOR_MAX_TARGETS = 10000
+MONITOR_MAX_PER_CLIENT = 20  # targets one client IP may register
+MONITOR_CONCURRENCY = 500
+MONITOR_JITTER = 0.1  # fraction of the interval
+MONITOR_SYNC_INTERVAL = 5.0  # seconds between registry syncs on the primary worker
+
+# probe(target) -> (up, latency_ms or None, detail)
+Probe = Callable[["Target"], Awaitable[Tuple[bool, Optional[float], str]]]
+
+
+class MonitorQuotaExceeded(ValueError):
+    """The registering client already has MONITOR_MAX_PER_CLIENT targets."""
+
+
+class Target:
+    def __init__(self, kind: str, interval: float, timeout: float,
+                 url: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None,
+                 client: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind  # "http" or "tcp"
+        self.client = client  # IP that registered it, for MONITOR_MAX_PER_CLIENT; not reported
+        self.url = url
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.created = time.time()
+        self.last_check: Optional[float] = None
+        self.last_up: Optional[bool] = None
+        self.last_detail = ""
+
+    @property
+    def key(self) -> str:
+        # series key in the history store
+        return f"monitor:{self.id}"
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Target":
+        target = cls(data["kind"], data["interval"], data["timeout"],
+                     url=data.get("url"), host=data.get("host"), port=data.get("port"),
+                     client=data.get("client"))
+        target.id = data["id"]
+        target.created = data.get("created", target.created)
+        target.last_check = data.get("last_check")
+        target.last_up = data.get("last_up")
+        target.last_detail = data.get("last_detail", "")
+        return target
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "url": self.url,
+            "host": self.host,
+            "port": self.port,
+            "interval": self.interval,
+            "timeout": self.timeout,
+            "created": self.created,
+            "last_check": self.last_check,
+            "last_up": self.last_up,
+            "last_detail": self.last_detail,
+        }
+
+    def to_state(self) -> Dict:
+        # what the registry keeps: the public fields plus the registering client
+        return dict(self.to_dict(), client=self.client)
+
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[k], 2)
+
+
+def summarize(samples: List[Tuple[float, bool, Optional[float]]]) -> Dict:
+    """Uptime %, latency percentiles of successful checks and incident windows."""
+    if not samples:
+        return {"checks": 0, "uptime_pct": None, "latency_ms": {}, "incidents": []}
+    up_count = sum(1 for _, up, _ in samples if up)
+    latencies = sorted(lat for _, up, lat in samples if up and lat is not None)
+    incidents = []
+    start = None
+    for ts, up, _ in samples:
+        if not up and start is None:
+            start = ts
+        elif up and start is not None:
+            incidents.append({"start": start, "end": ts, "duration_s": ts - start})
+            start = None
+    if start is not None:
+        incidents.append({"start": start, "end": None, "duration_s": samples[-1][0] - start})
+    return {
+        "checks": len(samples),
+        "uptime_pct": 100.0 * up_count / len(samples),
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+        },
+        "incidents": incidents,
+    }
+
+
+class Monitor:
+    def __init__(self, probes: Dict[str, Probe], store, concurrency: int = MONITOR_CONCURRENCY,
+                 registry=None):
+        self.probes = probes
+        self.store = store  # sample history: the time-series store (app/tsdb.py)
+        self.registry = registry  # shared state store (app/state.py) or None
+        self.primary = True  # only the primary worker schedules checks
+        self.targets: Dict[str, Target] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self.stats = {"checks": 0, "failures": 0, "late": 0}
+
+    def metrics(self) -> Dict:
+        data = dict(self.stats)
+        data["targets"] = len(self.targets)
+        data["scheduled"] = len(self._heap)
+        data["running"] = len(self._running)
+        data["primary"] = self.primary
+        return data
+
+    async def add(self, target: Target) -> Target:
+        if self.registry is None:
+            clients = [t.client for t in self.targets.values()]
+        else:
+            clients = [data.get("client") for _, data in await self.registry.items("monitor")]
+        if len(clients) >= MONITOR_MAX_TARGETS:
+            raise ValueError("too many monitored targets")
+        if target.client is not None and clients.count(target.client) >= MONITOR_MAX_PER_CLIENT:
+            raise MonitorQuotaExceeded(f"at most {MONITOR_MAX_PER_CLIENT} monitored targets per client")
+        if self.registry is not None:
+            await self.registry.set("monitor", target.id, target.to_state())
+        if self.primary:
+            self._add_local(target)
+        return target
+
+    def _add_local(self, target: Target):
+        self.targets[target.id] = target
+        # spread first checks over one interval
+        self._schedule(target, time.monotonic() + random.uniform(0, min(target.interval, 5.0)))
+
+    async def remove(self, target_id: str) -> bool:
+        # heap entries for removed targets are skipped lazily when they come due
+        found = False
+        if self.registry is not None and await self.registry.get("monitor", target_id) is not None:
+            await self.registry.delete("monitor", target_id)
+            found = True
+        if self.targets.pop(target_id, None) is not None:
+            found = True
+        if found:
+            self.store.drop(f"monitor:{target_id}")
+        return found
+
+    def sync(self, registered: Dict[str, Dict]):
+        """Bring the scheduled targets in line with the registry contents."""
+        for target_id in [t for t in self.targets if t not in registered]:
+            del self.targets[target_id]
+        for target_id, data in registered.items():
+            if target_id not in self.targets:
+                self._add_local(Target.from_dict(data))
+
+    async def _sync_loop(self):
+        while True:
+            registered = await self.registry.items("monitor")
+            self.sync(dict(registered))
+            await asyncio.sleep(MONITOR_SYNC_INTERVAL)
+
+    def _schedule(self, target: Target, when: float):
+        heapq.heappush(self._heap, (when, next(self._seq), target.id))
+        if self._wake is not None and self._heap[0][2] == target.id:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None and self.primary:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+            if self.registry is not None:
+                self._sync_task = asyncio.ensure_future(self._sync_loop())
+
+    async def stop(self):
+        for task in (self._task, self._sync_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._sync_task = None
+        for t in list(self._running):
+            t.cancel()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, target_id = heapq.heappop(self._heap)
+                target = self.targets.get(target_id)
+                if target is None:
+                    continue
+                if now - due > target.interval:
+                    self.stats["late"] += 1
+                jitter = random.uniform(-MONITOR_JITTER, MONITOR_JITTER) * target.interval
+                self._schedule(target, max(now, due) + target.interval + jitter)
+                task = asyncio.ensure_future(self._check(target))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            self._wake.clear()
+            delay = self._heap[0][0] - time.monotonic() if self._heap else 60.0
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, delay))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, target: Target):
+        async with self._sem:
+            try:
+                up, latency, detail = await self.probes[target.kind](target)
+            except Exception as e:
+                up, latency, detail = False, None, str(e)
+        if target.id not in self.targets:
+            return
+        now = time.time()
+        self.stats["checks"] += 1
+        if not up:
+            self.stats["failures"] += 1
+        target.last_check, target.last_up, target.last_detail = now, up, detail
+        self.store.record(target.key, up, latency, now)
+        if self.registry is not None:
+            if await self.registry.get("monitor", target.id) is None:
+                # removed through another worker since the last sync
+                self.targets.pop(target.id, None)
+            else:
+                await self.registry.set("monitor", target.id, target.to_state())
+
+    async def report(self, target_id: str, window: float) -> Optional[Dict]:
+        if self.registry is not None:
+            data = await self.registry.get("monitor", target_id)
+        else:
+            target = self.targets.get(target_id)
+            data = target.to_dict() if target is not None else None
+        if data is None:
+            return None
+        data.pop("client", None)
+        data["window_s"] = window
+        data.update(await asyncio.to_thread(self._summary, f"monitor:{target_id}", time.time() - window))
+        return data
+
+    def _summary(self, key: str, since: float) -> Dict:
+        return summarize(self.store.samples(key, since))
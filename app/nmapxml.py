@@ -0,0 +1,93 @@
+"""
+Incremental parser for nmap's XML output (`nmap -oX -`).
+
+Stdout is fed in chunks as it arrives and each chunk returns the events it
+completed, in the same shape as the builtin engine's (connectscan.scan_events):
+"port_open" per open port and "progress" for every <taskprogress> nmap
+writes under --stats-every. Results are collected on a ScanReport.
+
+Elements are dropped from the tree once handled, so memory stays constant
+however much output nmap produces.
+"""
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+
+from .connectscan import ScanReport, port_event, service_name
+
+
+class NmapXmlParser:
+    def __init__(self, report: ScanReport):
+        self.report = report
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._stack: List[ET.Element] = []
+        self._fed = False
+        self.elapsed: Optional[float] = None  # from <finished elapsed=...>
+
+    def feed(self, data: bytes) -> List[Dict]:
+        """Parse a chunk of output. Raises xml.etree.ElementTree.ParseError on malformed XML."""
+        self._fed = self._fed or bool(data)
+        self._parser.feed(data)
+        return self._events()
+
+    def close(self) -> List[Dict]:
+        if not self._fed:
+            return []  # nmap wrote nothing (it failed before scanning); stderr says why
+        self._parser.close()
+        return self._events()
+
+    def _events(self) -> List[Dict]:
+        events = []
+        for kind, elem in self._parser.read_events():
+            if kind == "start":
+                if elem.tag == "nmaprun" and elem.get("version"):
+                    self.report.banner = f"Nmap {elem.get('version')}"
+                self._stack.append(elem)
+                continue
+            self._stack.pop()
+            event = self._handle(elem)
+            if event is not None:
+                events.append(event)
+            # a <port> is handled when it ends, so its children stay until then
+            if self._stack and self._stack[-1].tag != "port":
+                self._stack[-1].remove(elem)
+        return events
+
+    def _handle(self, elem: ET.Element) -> Optional[Dict]:
+        report = self.report
+        if elem.tag == "taskprogress":
+            return {"type": "progress", "task": elem.get("task"), "percent": _float(elem.get("percent")),
+                    "remaining_s": _float(elem.get("remaining"))}
+        elif elem.tag == "status" and self._parent_tag() == "host":
+            report.up = elem.get("state") == "up"
+        elif elem.tag == "extraports":
+            state = elem.get("state", "filtered").split("|")[0]
+            count = int(elem.get("count") or 0)
+            report.counts[state] = report.counts.get(state, 0) + count
+            report.scanned += count
+        elif elem.tag == "port":
+            state = elem.find("state")
+            service = elem.find("service")
+            port = int(elem.get("portid"))
+            result = {
+                "port": port,
+                "state": state.get("state") if state is not None else "unknown",
+                "service": service.get("name") if service is not None else service_name(port),
+            }
+            report.add(result)
+            if result["state"] == "open":
+                return port_event(result)
+        elif elem.tag == "times" and elem.get("srtt"):
+            report.rtt_ms = int(elem.get("srtt")) / 1000.0  # microseconds
+        elif elem.tag == "finished":
+            self.elapsed = _float(elem.get("elapsed"))
+        return None
+
+    def _parent_tag(self) -> Optional[str]:
+        return self._stack[-1].tag if self._stack else None
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,180 @@
+"""
+Pre-rendered SPA pages with per-route SEO meta.
+
+Every route in ROUTE_META is rendered once from the index.html template
+(again only when the template file changes) and kept as identity, gzip and
+brotli bytes (`brotli` is in requirements.txt; an install without it offers
+gzip only). Each encoding
+has its own strong ETag (the gzip and brotli ones end in -gz and -br), as
+they are different representations. The encoding is picked from the
+Accept-Encoding q-values. Requests are answered from memory, with 304s for
+matching If-None-Match headers.
+"""
+import gzip
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # not installed: gzip is always available
+    brotli = None
+
+# Load SPA template (dist build preferred, fallback to source index)
+TEMPLATE_PATHS = ["frontend/dist/index.html", "frontend/index.html"]
+TEMPLATE_CHECK_INTERVAL = 5.0  # seconds between template mtime checks
+PAGE_CACHE_CONTROL = "no-cache"  # always revalidate; unchanged pages cost a 304
+
+DEFAULT_META = {
+    "title": "Isitdown? - Free Online Service Checker, Port Scanner & HTTP Tester",
+    "description": "Free online website checker, port scanner, HTTP tester, and service monitor. Check if websites are down, scan ports with online nmap, test APIs with curl-like tool. No installation required.",
+    "og_title": "Isitdown? - Free Online Service Checker & Port Scanner",
+    "og_description": "Check if websites are down, scan ports with online nmap tool, test HTTP requests with curl-like interface. Free and easy to use.",
+    "canonical": "https://isitdown.space/",
+}
+
+# URL path -> meta overrides. Adding an SEO route only needs an entry here.
+ROUTE_META: Dict[str, Dict[str, str]] = {
+    "/": {},
+    "/curl": {
+        "title": "Curl - Online HTTP tester | Isitdown?",
+        "description": "Online curl tool: send HTTP requests, set headers, and inspect responses. A lightweight curl-like interface in the browser.",
+        "og_title": "Curl - Online HTTP tester",
+        "og_description": "Use the online curl tester to send GET/POST requests, inspect headers and responses. No install required.",
+        "canonical": "https://isitdown.space/curl",
+    },
+    "/port-scan": {
+        "title": "Port Scan - Online Nmap & Port Scanner | Isitdown?",
+        "description": "Online port scanner using TCP-connect scans. Check open ports and services on hosts quickly and safely.",
+        "og_title": "Port Scan - Online Nmap",
+        "og_description": "Run restricted TCP connect port scans (no OS detection) to discover open services.",
+        "canonical": "https://isitdown.space/port-scan",
+    },
+    "/status": {
+        "title": "Status Checker - Is my site down? | Isitdown?",
+        "description": "Quick website status checker: test HTTP endpoints and ports to see if your site or server is up.",
+        "og_title": "Status Checker - Website status",
+        "og_description": "Instantly check whether a website or server is up or down with our quick status tool.",
+        "canonical": "https://isitdown.space/status",
+    },
+}
+
+# How each meta field appears in the template: (tag with default value, tag format)
+META_TAGS = {
+    "title": "<title>{}</title>",
+    "description": '<meta name="description" content="{}">',
+    "og_title": '<meta property="og:title" content="{}">',
+    "og_description": '<meta property="og:description" content="{}">',
+    "canonical": '<link rel="canonical" href="{}">',
+}
+
+
+def render_page(template: str, overrides: Dict[str, str]) -> str:
+    meta = dict(DEFAULT_META, **overrides)
+    out = template
+    for field, tag in META_TAGS.items():
+        out = out.replace(tag.format(DEFAULT_META[field]), tag.format(meta[field]))
+    return out
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}, with "*" applied to br and gzip if they aren't listed."""
+    accepted: Dict[str, float] = {}
+    for item in header.lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    star = accepted.get("*")
+    for coding in ("br", "gzip"):
+        if coding not in accepted and star is not None:
+            accepted[coding] = star
+    return accepted
+
+
+class RenderedPage:
+    def __init__(self, html: str):
+        self.identity = html.encode("utf-8")
+        tag = hashlib.sha256(self.identity).hexdigest()[:32]
+        self.gzip = gzip.compress(self.identity, compresslevel=9)
+        self.br = brotli.compress(self.identity) if brotli is not None else None
+        self.etags = {"identity": f'"{tag}"', "gzip": f'"{tag}-gz"', "br": f'"{tag}-br"'}
+
+    def variant(self, accept_encoding: str) -> Tuple[Optional[str], bytes]:
+        """
+        (Content-Encoding or None, body): the accepted encoding with the highest
+        q, br over gzip on a tie. Identity is the fallback, and wins only if the
+        client lists it with a higher q.
+        """
+        accepted = accepted_encodings(accept_encoding)
+        best, body, best_q = None, self.identity, accepted.get("identity", 0.0)
+        for coding, data in (("gzip", self.gzip), ("br", self.br)):
+            q = accepted.get(coding, 0.0)
+            if data is not None and q > 0 and q >= best_q:
+                best, body, best_q = coding, data, q
+        return best, body
+
+
+class PageCache:
+    def __init__(self, paths=TEMPLATE_PATHS, routes=ROUTE_META):
+        self.paths = paths
+        self.routes = routes
+        self.pages: Dict[str, RenderedPage] = {}
+        self._source: Optional[str] = None
+        self._mtime = 0.0
+        self._checked = 0.0
+
+    def _find_template(self) -> str:
+        for p in self.paths:
+            if os.path.exists(p):
+                return p
+        raise RuntimeError("index.html template not found in frontend/dist or frontend/")
+
+    def refresh(self, force: bool = False):
+        """Re-render all routes if the template changed since the last build."""
+        now = time.monotonic()
+        if not force and self.pages and now - self._checked < TEMPLATE_CHECK_INTERVAL:
+            return
+        self._checked = now
+        path = self._find_template()
+        mtime = os.stat(path).st_mtime
+        if not force and self.pages and path == self._source and mtime == self._mtime:
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            template = f.read()
+        self.pages = {route: RenderedPage(render_page(template, meta)) for route, meta in self.routes.items()}
+        self._source, self._mtime = path, mtime
+
+    def response(self, route: str, request: Request) -> Response:
+        self.refresh()
+        page = self.pages[route]
+        encoding, body = page.variant(request.headers.get("accept-encoding", ""))
+        etag = page.etags[encoding or "identity"]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": PAGE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        # If-None-Match uses the weak comparison, so W/ prefixes added by proxies still match
+        inm = request.headers.get("if-none-match", "")
+        if inm.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in inm.split(",")):
+            return Response(status_code=304, headers=headers)
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+page_cache = PageCache()
@@ -0,0 +1,155 @@
+"""
+Token-bucket rate limiting with pluggable state backends.
+
+Each client gets a bucket of `capacity` tokens refilled at capacity/period
+tokens per second; a request spends its endpoint's cost, and batch requests
+spend more per port or target they ask for. A bucket is just
+(tokens, last_update), so checks are O(1) and idle clients (whose buckets
+would be full again anyway) are swept periodically.
+
+MemoryBackend keeps buckets in this process. SqliteBackend keeps them in a
+shared WAL-mode sqlite file so every uvicorn worker enforces the same limit.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from . import metrics
+
+EVICT_INTERVAL = 60.0  # seconds between idle-bucket sweeps
+
+# Token cost per endpoint (longest matching path prefix wins, default 1)
+ENDPOINT_COSTS = {
+    "/api/nmap": 10,
+    "/api/ports/batch": 5,
+    "/api/check/bulk": 5,
+    "/api/http": 2,
+    "/api/port": 1,
+}
+
+
+# Registering a monitor (POST /api/monitors) buys a probe every interval until
+# it is deleted, so it is charged on top of the path's flat cost
+MONITOR_CREATE_COST = 10
+
+# Batch endpoints (/api/ports/batch, /api/check/bulk) also spend one token per
+# BATCH_ITEMS_PER_TOKEN ports or targets once the request is parsed, so the
+# largest batch (1000 ports) still fits in a full bucket
+BATCH_ITEMS_PER_TOKEN = 20
+
+
+def batch_cost(items: int) -> int:
+    return -(-items // BATCH_ITEMS_PER_TOKEN)
+
+
+def request_cost(path: str) -> int:
+    best, cost = -1, 1
+    for prefix, c in ENDPOINT_COSTS.items():
+        if path.startswith(prefix) and len(prefix) > best:
+            best, cost = len(prefix), c
+    return cost
+
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """Per-process buckets: key -> [tokens, updated]."""
+
+    def __init__(self):
+        self._buckets: Dict[str, List[float]] = {}
+        self._last_sweep = time.monotonic()
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        if now - self._last_sweep >= EVICT_INTERVAL:
+            self.evict(now, capacity, rate)
+        bucket = self._buckets.get(key)
+        tokens = capacity if bucket is None else _refill(bucket[0], bucket[1], now, capacity, rate)
+        if tokens < cost:
+            if bucket is not None:
+                bucket[0], bucket[1] = tokens, now
+            return False, (cost - tokens) / rate
+        self._buckets[key] = [tokens - cost, now]
+        return True, 0.0
+
+    def evict(self, now: float, capacity: float, rate: float):
+        # a bucket idle for a full refill period is indistinguishable from a new one
+        idle = capacity / rate
+        self._buckets = {k: b for k, b in self._buckets.items() if now - b[1] < idle}
+        self._last_sweep = now
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SqliteBackend:
+    """Buckets in a shared sqlite file, safe across worker processes."""
+
+    def __init__(self, path: str = "ratelimit.db"):
+        self.path = path
+        self._local = threading.local()
+        self._last_sweep = time.time()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_updated ON buckets (updated)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> Tuple[bool, float]:
+        # wall clock, since monotonic clocks aren't comparable between processes
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            if now - self._last_sweep >= EVICT_INTERVAL:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - capacity / rate,))
+                self._last_sweep = now
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class RateLimiter:
+    def __init__(self, backend, limit: int, period: float):
+        self.backend = backend
+        self.capacity = float(limit)
+        self.rate = limit / float(period)
+        self.rejected = 0
+
+    async def allow(self, key: str, cost: float = 1) -> Tuple[bool, float]:
+        """Spend `cost` tokens for key. Returns (allowed, retry_after_seconds)."""
+        if isinstance(self.backend, MemoryBackend):
+            allowed, retry_after = self.backend.take(key, cost, self.capacity, self.rate)
+        else:
+            with metrics.stage("sqlite_ratelimit"):
+                allowed, retry_after = await asyncio.to_thread(
+                    self.backend.take, key, cost, self.capacity, self.rate
+                )
+        if not allowed:
+            self.rejected += 1
+        return allowed, retry_after
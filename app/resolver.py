@@ -0,0 +1,175 @@
+"""
+Non-blocking, cached DNS resolution used to vet scan/check targets.
+
+Lookups go through dnspython's async resolver, falling back to the event
+loop's threaded getaddrinfo when DNS has no answer (e.g. /etc/hosts names).
+Answers are cached for their record TTL, failures are cached briefly, and
+concurrent lookups of the same name share one query.
+"""
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import dns.asyncresolver
+except ImportError:  # dnspython is optional; getaddrinfo is used instead
+    dns = None
+
+# Cache settings (seconds / entries)
+DNS_CACHE_SIZE = 4096
+DNS_MIN_TTL = 5
+DNS_MAX_TTL = 300
+DNS_NEGATIVE_TTL = 30
+DNS_DEFAULT_TTL = 60  # for getaddrinfo answers, which carry no TTL
+DNS_TIMEOUT = 5.0
+
+
+class ResolutionError(Exception):
+    pass
+
+
+def is_private_address(addr: str) -> bool:
+    ip = ipaddress.ip_address(addr)
+    return ip.is_private or ip.is_loopback or ip.is_link_local
+
+
+class Resolver:
+    """Async resolver with a TTL-respecting LRU cache and in-flight coalescing."""
+
+    def __init__(self, max_entries: int = DNS_CACHE_SIZE):
+        self.max_entries = max_entries
+        # host -> (expires_at, addresses or None for a negative entry, error)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[List[str]], str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._dns = None
+        self._dns_checked = False
+        self.stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "lookups": 0,
+            "failures": 0,
+            "fallbacks": 0,
+        }
+
+    def metrics(self) -> Dict:
+        data = dict(self.stats)
+        data["entries"] = len(self._cache)
+        data["inflight"] = len(self._inflight)
+        return data
+
+    def clear(self):
+        self._cache.clear()
+
+    def _dns_resolver(self):
+        if not self._dns_checked:
+            self._dns_checked = True
+            if dns is not None:
+                try:
+                    self._dns = dns.asyncresolver.Resolver()
+                    self._dns.lifetime = DNS_TIMEOUT
+                except Exception:
+                    self._dns = None
+        return self._dns
+
+    def _store(self, host: str, ttl: float, addrs: Optional[List[str]], error: str = ""):
+        self._cache[host] = (time.monotonic() + ttl, addrs, error)
+        self._cache.move_to_end(host)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def resolve(self, host: str) -> List[str]:
+        """Return all addresses for host (IPv4 first). Raises ResolutionError."""
+        host = host.strip().lower().rstrip(".")
+        if not host:
+            raise ResolutionError("empty host")
+        try:
+            return [str(ipaddress.ip_address(host.strip("[]")))]
+        except ValueError:
+            pass
+
+        entry = self._cache.get(host)
+        if entry is not None:
+            expires, addrs, error = entry
+            if expires > time.monotonic():
+                self._cache.move_to_end(host)
+                if addrs is None:
+                    self.stats["negative_hits"] += 1
+                    raise ResolutionError(error)
+                self.stats["hits"] += 1
+                return addrs
+            del self._cache[host]
+
+        task = self._inflight.get(host)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._lookup(host))
+            self._inflight[host] = task
+            task.add_done_callback(lambda _: self._inflight.pop(host, None))
+        # shield so one cancelled caller doesn't cancel the shared lookup
+        return await asyncio.shield(task)
+
+    async def _lookup(self, host: str) -> List[str]:
+        self.stats["lookups"] += 1
+        try:
+            addrs, ttl = await self._query(host)
+        except ResolutionError as e:
+            self.stats["failures"] += 1
+            self._store(host, DNS_NEGATIVE_TTL, None, str(e))
+            raise
+        self._store(host, min(DNS_MAX_TTL, max(DNS_MIN_TTL, ttl)), addrs)
+        return addrs
+
+    async def _query(self, host: str) -> Tuple[List[str], float]:
+        resolver = self._dns_resolver()
+        if resolver is not None:
+            results = await asyncio.gather(
+                resolver.resolve(host, "A"),
+                resolver.resolve(host, "AAAA"),
+                return_exceptions=True,
+            )
+            addrs, ttls = [], []
+            for res in results:
+                if not isinstance(res, BaseException) and res.rrset is not None:
+                    addrs.extend(r.address for r in res.rrset)
+                    ttls.append(res.rrset.ttl)
+            if addrs:
+                return addrs, min(ttls)
+        # no DNS answer: let the system resolver (hosts file, nsswitch) decide
+        self.stats["fallbacks"] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(
+                loop.getaddrinfo(host, None, type=socket.SOCK_STREAM), timeout=DNS_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ResolutionError(f"{host}: {str(e) or 'resolution timed out'}")
+        addrs = []
+        for info in sorted(infos, key=lambda i: i[0] != socket.AF_INET):
+            if info[4][0] not in addrs:
+                addrs.append(info[4][0])
+        if not addrs:
+            raise ResolutionError(f"{host}: no addresses")
+        return addrs, DNS_DEFAULT_TTL
+
+    async def vet(self, host: str) -> List[str]:
+        """
+        Resolve host and make sure none of its addresses are private, loopback
+        or link-local. Returns the vetted addresses.
+        """
+        addrs = await self.resolve(host)
+        for addr in addrs:
+            if is_private_address(addr):
+                raise ResolutionError(f"{host}: resolves to a private or local address")
+        return addrs
+
+
+resolver = Resolver()
@@ -0,0 +1,150 @@
+"""
+Concurrent TCP connect probes used by the port check endpoints.
+
+All probes in the process share one global semaphore so a handful of large
+batch scans cannot open an unbounded number of sockets; each batch request
+additionally gets its own (smaller) cap.
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from .happyeyeballs import connect_first, family_label
+
+# Limits for batch scans
+MAX_BATCH_PORTS = 1000
+GLOBAL_PROBE_LIMIT = 2000  # concurrent connects across the whole process
+PER_REQUEST_PROBE_LIMIT = 250  # concurrent connects for a single batch
+MAX_PROBE_TIMEOUT = 10.0
+
+_global_sem: Optional[asyncio.Semaphore] = None
+
+
+def global_semaphore() -> asyncio.Semaphore:
+    # created lazily so it binds to the running event loop
+    global _global_sem
+    if _global_sem is None:
+        _global_sem = asyncio.Semaphore(GLOBAL_PROBE_LIMIT)
+    return _global_sem
+
+
+def parse_ports(ports=None, port_range=None) -> List[int]:
+    """
+    Build a sorted, de-duplicated port list from a list of ports and/or a range.
+    `ports` may be a list of ints or a "22,80,443" string; `port_range` may be
+    "1-1024" or {"start": 1, "end": 1024}. Raises ValueError on bad input.
+    """
+    result = set()
+    if ports:
+        if isinstance(ports, str):
+            ports = [p for p in ports.split(",") if p.strip()]
+        for p in ports:
+            result.add(int(p))
+    if port_range:
+        if isinstance(port_range, dict):
+            start, end = int(port_range.get("start")), int(port_range.get("end"))
+        else:
+            start_s, _, end_s = str(port_range).partition("-")
+            start, end = int(start_s), int(end_s or start_s)
+        if start > end:
+            raise ValueError("port range start must not exceed end")
+        if end - start + 1 > MAX_BATCH_PORTS:
+            raise ValueError(f"at most {MAX_BATCH_PORTS} ports per batch")
+        result.update(range(start, end + 1))
+    if not result:
+        raise ValueError("ports or range is required")
+    if any(p < 1 or p > 65535 for p in result):
+        raise ValueError("ports must be between 1 and 65535")
+    if len(result) > MAX_BATCH_PORTS:
+        raise ValueError(f"at most {MAX_BATCH_PORTS} ports per batch")
+    return sorted(result)
+
+
+async def probe_port(host: str, port: int, timeout: float) -> Dict:
+    """Single TCP connect probe; never raises."""
+    async with global_semaphore():
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            return {"port": port, "open": False, "error": "timeout"}
+        except Exception as e:
+            return {"port": port, "open": False, "error": str(e)}
+        latency = (time.perf_counter() - start) * 1000.0
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+        return {"port": port, "open": True, "latency_ms": latency}
+
+
+async def _close_connection(conn):
+    writer = conn[1]
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+
+async def connect_probe(addrs: List[str], port: int, timeout: float) -> Dict:
+    """
+    TCP connect probe racing all of a host's addresses (Happy Eyeballs, see
+    app/happyeyeballs.py); never raises. latency_ms is the winning attempt's
+    connect time, connect_ms the time until any attempt connected, and
+    "attempts" lists every address tried.
+    """
+    attempts: List[Dict] = []
+    async with global_semaphore():
+        start = time.perf_counter()
+        try:
+            conn, addr = await asyncio.wait_for(
+                connect_first(addrs, lambda a: asyncio.open_connection(a, port), _close_connection, attempts=attempts),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            return {"port": port, "open": False, "error": "timeout", "attempts": attempts}
+        except Exception as e:
+            return {"port": port, "open": False, "error": str(e), "attempts": attempts}
+        elapsed = (time.perf_counter() - start) * 1000.0
+        await _close_connection(conn)
+    winning = next(a for a in attempts if a.get("connected"))
+    return {
+        "port": port,
+        "open": True,
+        "addr": addr,
+        "family": family_label(addr),
+        "latency_ms": winning.get("elapsed_ms", elapsed),
+        "connect_ms": round(elapsed, 2),
+        "attempts": attempts,
+    }
+
+
+async def scan_ports(
+    host: str,
+    ports: Iterable[int],
+    timeout: float,
+    concurrency: int = PER_REQUEST_PROBE_LIMIT,
+) -> AsyncIterator[Dict]:
+    """
+    Probe all ports concurrently and yield each result as soon as it finishes.
+    `host` should already be resolved and vetted by the caller. Outstanding
+    probes are cancelled if the consumer stops iterating early.
+    """
+    sem = asyncio.Semaphore(max(1, min(concurrency, PER_REQUEST_PROBE_LIMIT)))
+
+    async def bounded(port: int) -> Dict:
+        async with sem:
+            return await probe_port(host, port, timeout)
+
+    tasks = [asyncio.ensure_future(bounded(p)) for p in ports]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
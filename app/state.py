@@ -0,0 +1,199 @@
+"""
+Process-shared state for running several uvicorn workers.
+
+A state store is a namespaced key/value store with optional per-key TTLs:
+
+    MemoryStore  plain dicts; fine for a single worker process
+    SqliteStore  one WAL-mode sqlite file shared by every worker on the host
+
+Admin sessions, monitor registrations, scan job status and output and
+(with the sqlite store) check results live here, so any worker can answer
+for state created on another. Values must be JSON-serializable for
+SqliteStore. Both stores have the same async API (get, get_many, set,
+set_many, delete, items, count); SqliteStore does its I/O on database
+threads (app/db.py).
+
+Some services must run in exactly one process (the monitor scheduler) or
+need a private directory (the mmap time-series segments). Workers claim a
+numbered slot with an exclusive file lock (claim_worker_slot); slot 0 is the
+primary.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .db import Database
+
+STATE_SWEEP_INTERVAL = 60.0  # seconds between expired-key sweeps
+STATE_READERS = 2  # read connections per worker for SqliteStore
+MAX_WORKER_SLOTS = 64
+
+
+class MemoryStore:
+    shared = False
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Tuple[Any, Optional[float]]]] = {}
+        self._last_sweep = time.time()
+
+    def _get(self, ns: str, key: str, now: float) -> Any:
+        entry = self._data.get(ns, {}).get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= now:
+            del self._data[ns][key]
+            return None
+        return value
+
+    async def get(self, ns: str, key: str) -> Any:
+        return self._get(ns, key, time.time())
+
+    async def get_many(self, ns: str, keys: List[str]) -> Dict[str, Any]:
+        now = time.time()
+        found = {key: self._get(ns, key, now) for key in keys}
+        return {k: v for k, v in found.items() if v is not None}
+
+    async def set(self, ns: str, key: str, value: Any, ttl: Optional[float] = None):
+        await self.set_many(ns, {key: value}, ttl)
+
+    async def set_many(self, ns: str, values: Dict[str, Any], ttl: Optional[float] = None):
+        now = time.time()
+        entries = self._data.setdefault(ns, {})
+        for key, value in values.items():
+            entries[key] = (value, now + ttl if ttl is not None else None)
+        if now - self._last_sweep >= STATE_SWEEP_INTERVAL:
+            self.sweep(now)
+
+    async def delete(self, ns: str, key: str):
+        self._data.get(ns, {}).pop(key, None)
+
+    async def items(self, ns: str) -> List[Tuple[str, Any]]:
+        now = time.time()
+        return [(k, v) for k, (v, exp) in self._data.get(ns, {}).items() if exp is None or exp > now]
+
+    async def count(self, ns: str) -> int:
+        return len(await self.items(ns))
+
+    def sweep(self, now: float):
+        for entries in self._data.values():
+            for key in [k for k, (_, exp) in entries.items() if exp is not None and exp <= now]:
+                del entries[key]
+        self._last_sweep = now
+
+    def metrics(self) -> Dict:
+        return {"keys": sum(len(entries) for entries in self._data.values())}
+
+
+def _get_many(conn: sqlite3.Connection, ns: str, keys: List[str], now: float) -> Dict[str, Any]:
+    rows = conn.execute(
+        f"SELECT key, value FROM kv WHERE ns = ? AND key IN ({', '.join('?' * len(keys))}) "
+        "AND (expires IS NULL OR expires > ?)",
+        (ns, *keys, now),
+    ).fetchall()
+    return {k: json.loads(v) for k, v in rows}
+
+
+def _set_many(conn: sqlite3.Connection, rows: List[tuple], sweep_before: Optional[float]):
+    with conn:
+        conn.executemany(
+            "INSERT INTO kv (ns, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(ns, key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            rows,
+        )
+        if sweep_before is not None:
+            conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (sweep_before,))
+
+
+def _delete(conn: sqlite3.Connection, ns: str, key: str):
+    with conn:
+        conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+
+class SqliteStore:
+    """
+    Key/value rows in a shared WAL-mode sqlite file, safe across worker
+    processes. Queries run on the app/db.py connection threads, never on the
+    event loop; values are JSON-encoded before they get there.
+    """
+
+    shared = True
+
+    def __init__(self, path: str = "state.db"):
+        self.path = path
+        self.db = Database(path, readers=STATE_READERS, name="state")
+        self._last_sweep = time.time()
+        self.db.write_sync(lambda conn: conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires REAL, PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        ), name="state_schema")
+
+    async def get(self, ns: str, key: str) -> Any:
+        return (await self.get_many(ns, [key])).get(key)
+
+    async def get_many(self, ns: str, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        return await self.db.read(_get_many, ns, keys, time.time(), name=f"state_get_{ns}")
+
+    async def set(self, ns: str, key: str, value: Any, ttl: Optional[float] = None):
+        await self.set_many(ns, {key: value}, ttl)
+
+    async def set_many(self, ns: str, values: Dict[str, Any], ttl: Optional[float] = None):
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        rows = [(ns, key, json.dumps(value, default=str), expires) for key, value in values.items()]
+        sweep = None
+        if now - self._last_sweep >= STATE_SWEEP_INTERVAL:
+            sweep = self._last_sweep = now
+        await self.db.write(_set_many, rows, sweep, name=f"state_set_{ns}")
+
+    async def delete(self, ns: str, key: str):
+        await self.db.write(_delete, ns, key, name=f"state_delete_{ns}")
+
+    async def items(self, ns: str) -> List[Tuple[str, Any]]:
+        rows = await self.db.fetchall(
+            "SELECT key, value FROM kv WHERE ns = ? AND (expires IS NULL OR expires > ?)", (ns, time.time()),
+            name=f"state_items_{ns}",
+        )
+        return [(k, json.loads(v)) for k, v in rows]
+
+    async def count(self, ns: str) -> int:
+        row = await self.db.fetchone(
+            "SELECT COUNT(*) FROM kv WHERE ns = ? AND (expires IS NULL OR expires > ?)", (ns, time.time()),
+            name=f"state_count_{ns}",
+        )
+        return row[0]
+
+    def close(self):
+        self.db.close()
+
+    def metrics(self) -> Dict:
+        return self.db.metrics()
+
+
+_slot_locks: Dict[str, int] = {}
+
+
+def claim_worker_slot(lock_dir: str, max_slots: int = MAX_WORKER_SLOTS) -> int:
+    """
+    Take the lowest free worker slot under lock_dir and hold it for the life
+    of the process. The lock is released by the OS if the worker dies, so a
+    restarted worker takes the slot over.
+    """
+    if lock_dir in _slot_locks:
+        return _slot_locks[lock_dir]
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(max_slots):
+        fd = os.open(os.path.join(lock_dir, f"worker-{slot}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        _slot_locks[lock_dir] = slot
+        return slot
+    raise RuntimeError(f"no free worker slot in {lock_dir} (more than {max_slots} workers?)")
@@ -0,0 +1,594 @@
+"""
+Append-only time-series store for probe results.
+
+Samples are fixed-width records in memory-mapped segment files:
+
+    raw  (timestamp f64, target u32, up u8, latency_ms f32)              17 bytes
+    1m/1h rollups (bucket f64, target u32, checks u32, up u32,
+                   avg/min/max latency_ms f32)                           32 bytes
+
+Each series is a list of segments ordered by start time; a segment is
+rolled over once it is full or spans SEGMENT_SPANS[series], and segments
+older than RETENTION[series] are deleted whole. Timestamps never go
+backwards within a series, so range queries binary-search the segment list
+and then the records inside each segment. Rollups are accumulated in memory
+and appended when their bucket closes.
+
+All targets share one record stream, so each segment also keeps an
+in-memory index of record positions per target (4 bytes per record),
+built lazily on the first query and extended as records are appended. A
+query then only reads its target's records: its cost follows the size of
+that target's history, not the traffic to every other target.
+
+Target keys ("port:example.com:443", "http:https://example.com:443",
+"monitor:<id>") are mapped to u32 ids through a catalog file of "<id> <key>"
+lines, appended by a background thread so the event loop never waits on it.
+Ids are never reused. An id unused for ID_EXPIRY (the longest retention, so
+no segment still holds its records) or dropped with its monitor gets a
+"-<id> <key>" line and is forgotten; once such lines pile up the catalog is
+rewritten with the live ids only.
+
+A directory has a single writer. With several uvicorn workers each one
+writes its own slot directory (use_slot: the root for slot 0, worker-<n>
+below it otherwise) and queries merge in read-only views of the others;
+rollup buckets still open in another process are not visible until they
+close. The views stay open between queries and pick up new records, new
+segments and new targets as they appear (refresh).
+
+Queries may run on a worker thread (the app runs them through
+asyncio.to_thread) while the event loop keeps appending.
+"""
+import bisect
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+TSDB_DIR = "tsdb"
+RAW = struct.Struct("<dIBf")
+ROLLUP = struct.Struct("<dIIIfff")
+HEADER = struct.Struct("<Q")  # number of records in the segment
+
+RESOLUTIONS = {"1m": 60, "1h": 3600}
+SEGMENT_SPANS = {"raw": 3600, "1m": 86400, "1h": 30 * 86400}
+SEGMENT_RECORDS = {"raw": 1 << 20, "1m": 1 << 20, "1h": 1 << 18}
+RETENTION = {"raw": 2 * 86400, "1m": 30 * 86400, "1h": 400 * 86400}
+ID_EXPIRY = max(RETENTION.values())  # an id unused this long has no records left
+EXPIRE_INTERVAL = 3600  # seconds between expiry sweeps
+CATALOG_SLACK = 1024  # dropped-id lines tolerated before the catalog is rewritten
+
+
+class Segment:
+    def __init__(self, path: str, record: struct.Struct, capacity: int, start: float, readonly: bool = False):
+        self.path = path
+        self.record = record
+        self.start = start
+        self.readonly = readonly
+        size = HEADER.size + capacity * record.size
+        fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if readonly:
+                size = os.fstat(fd).st_size
+                if size < HEADER.size:
+                    raise ValueError(f"{path}: segment not initialized yet")
+                capacity = (size - HEADER.size) // record.size
+                self.mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+            else:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)  # sparse; pages are only allocated as records land
+                self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        (self.count,) = HEADER.unpack_from(self.mm, 0)
+        self.count = min(self.count, capacity)
+        self._index: Dict[int, array] = {}  # target id -> record positions, ascending
+        self._indexed = 0  # records covered by _index
+        self._lock = threading.Lock()  # count and index, shared with append()
+        self._indexing = threading.Lock()  # one _catch_up at a time
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def append(self, values: tuple):
+        with self._lock:
+            self.record.pack_into(self.mm, HEADER.size + self.count * self.record.size, *values)
+            if self._indexed == self.count:  # keep a built index current
+                self._positions(values[1]).append(self.count)
+                self._indexed += 1
+            self.count += 1
+            HEADER.pack_into(self.mm, 0, self.count)
+
+    def _positions(self, target: int) -> array:
+        positions = self._index.get(target)
+        if positions is None:
+            positions = self._index[target] = array("I")
+        return positions
+
+    def _catch_up(self):
+        """Index the records appended since the last query (by another process, for read-only views)."""
+        with self._indexing:
+            while True:
+                with self._lock:
+                    if self.readonly:
+                        (count,) = HEADER.unpack_from(self.mm, 0)
+                        self.count = min(count, self.capacity)
+                    start, end = self._indexed, self.count
+                if start == end:
+                    return
+                # records below `end` are complete, so read them without holding up append()
+                size = self.record.size
+                new: Dict[int, List[int]] = {}
+                for i in range(start, end):
+                    (target,) = struct.unpack_from("<I", self.mm, HEADER.size + i * size + 8)
+                    new.setdefault(target, []).append(i)
+                with self._lock:
+                    for target, positions in new.items():
+                        self._positions(target).extend(positions)
+                    self._indexed = end
+
+    def ts(self, i: int) -> float:
+        return struct.unpack_from("<d", self.mm, HEADER.size + i * self.record.size)[0]
+
+    def last_ts(self) -> float:
+        return self.ts(self.count - 1) if self.count else self.start
+
+    def _lower_bound(self, ts: float) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def scan(self, target: int, since: float, until: float):
+        self._catch_up()
+        positions = self._index.get(target)
+        if not positions:
+            return
+        size = self.record.size
+        start = bisect.bisect_left(positions, self._lower_bound(since))
+        for k in range(start, len(positions)):
+            values = self.record.unpack_from(self.mm, HEADER.size + positions[k] * size)
+            if values[0] >= until:
+                break
+            yield values
+
+    def close(self):
+        if not self.readonly:
+            self.mm.flush()
+        self.mm.close()
+
+
+class Series:
+    def __init__(self, directory: str, name: str, record: struct.Struct, readonly: bool = False):
+        self.directory = directory
+        self.name = name
+        self.record = record
+        self.readonly = readonly
+        self.segments: List[Segment] = []
+        self.starts: List[float] = []
+        self.refresh()
+
+    def refresh(self):
+        """Attach segment files not open yet and (read-only) let go of ones the writer deleted."""
+        known = {seg.path for seg in self.segments}
+        present = set()
+        for fname in sorted(os.listdir(self.directory)):
+            prefix, _, rest = fname.partition("-")
+            if prefix == self.name and rest.endswith(".seg"):
+                path = os.path.join(self.directory, fname)
+                present.add(path)
+                if path in known:
+                    continue
+                try:
+                    self._attach(Segment(path, self.record, SEGMENT_RECORDS[self.name], int(rest[:-4]) / 1000.0,
+                                         self.readonly))
+                except (OSError, ValueError):
+                    if not self.readonly:
+                        raise
+                    # the writer is creating or compacting this segment right now
+        if self.readonly:
+            for seg in [seg for seg in self.segments if seg.path not in present]:
+                self.segments.remove(seg)
+                seg.close()
+            self.starts = [seg.start for seg in self.segments]
+
+    def _attach(self, segment: Segment):
+        i = bisect.bisect_right(self.starts, segment.start)
+        self.segments.insert(i, segment)
+        self.starts.insert(i, segment.start)
+
+    def last_ts(self) -> float:
+        return self.segments[-1].last_ts() if self.segments else 0.0
+
+    def append(self, values: tuple):
+        ts = values[0]
+        seg = self.segments[-1] if self.segments else None
+        if seg is None or seg.full or ts - seg.start >= SEGMENT_SPANS[self.name]:
+            path = os.path.join(self.directory, f"{self.name}-{int(ts * 1000):015d}.seg")
+            seg = Segment(path, self.record, SEGMENT_RECORDS[self.name], ts)
+            self._attach(seg)
+            self.compact(ts)
+        seg.append(values)
+
+    def compact(self, now: float):
+        """Delete whole segments whose records are all past retention."""
+        cutoff = now - RETENTION[self.name]
+        while len(self.segments) > 1 and self.starts[1] <= cutoff:
+            seg = self.segments.pop(0)
+            self.starts.pop(0)
+            seg.close()
+            os.unlink(seg.path)
+
+    def query(self, target: int, since: float, until: float) -> List[tuple]:
+        # the segment holding `since` is the last one starting at or before it
+        segments = list(self.segments)  # the writer may roll over or compact meanwhile
+        i = max(0, bisect.bisect_right([seg.start for seg in segments], since) - 1)
+        out = []
+        for seg in segments[i:]:
+            if seg.start >= until:
+                break
+            try:
+                out.extend(seg.scan(target, since, until))
+            except ValueError:
+                continue  # compacted away while we read it: past retention anyway
+        return out
+
+    def close(self):
+        for seg in self.segments:
+            seg.close()
+
+
+class _Bucket:
+    __slots__ = ("checks", "up", "lat_sum", "lat_n", "lat_min", "lat_max")
+
+    def __init__(self):
+        self.checks = self.up = self.lat_n = 0
+        self.lat_sum = 0.0
+        self.lat_min = float("inf")
+        self.lat_max = 0.0
+
+    def add(self, up: bool, latency: Optional[float]):
+        self.checks += 1
+        if up:
+            self.up += 1
+        if latency is not None:
+            self.lat_n += 1
+            self.lat_sum += latency
+            self.lat_min = min(self.lat_min, latency)
+            self.lat_max = max(self.lat_max, latency)
+
+    def values(self, bucket: float, target: int) -> tuple:
+        if not self.lat_n:
+            return bucket, target, self.checks, self.up, -1.0, -1.0, -1.0
+        return bucket, target, self.checks, self.up, self.lat_sum / self.lat_n, self.lat_min, self.lat_max
+
+
+class _CatalogWriter:
+    """Appends catalog lines, and rewrites the catalog, on a background thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="tsdb-catalog", daemon=True)
+        self._thread.start()
+
+    def append(self, line: str):
+        self._queue.put(("append", line))
+
+    def rewrite(self, lines: List[str]):
+        self._queue.put(("rewrite", lines))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                try:
+                    for item in batch:
+                        if item is None:
+                            return
+                        op, data = item
+                        if op == "append":
+                            f.write(data)
+                        else:
+                            tmp = self.path + ".tmp"
+                            with open(tmp, "w", encoding="utf-8") as out:
+                                out.writelines(data)
+                            f.close()
+                            os.replace(tmp, self.path)
+                            f = open(self.path, "a", encoding="utf-8")
+                finally:
+                    f.flush()
+        except OSError as e:
+            print(f"Error writing tsdb catalog {self.path}: {e}")
+        finally:
+            f.close()
+
+
+class TimeSeriesDB:
+    def __init__(self, directory: str = TSDB_DIR, readonly: bool = False):
+        self.root = directory
+        self.directory = directory
+        self.readonly = readonly
+        self._merge_peers = False
+        self._series: Dict[str, Series] = {}
+        self._ids: Dict[str, int] = {}
+        self._next_id = 0
+        self._seen: Dict[int, float] = {}  # id -> last record time (writer only)
+        self._last_expire = 0.0
+        self._catalog: Optional[_CatalogWriter] = None
+        self._catalog_ino = None  # a rewritten catalog is a new file
+        self._catalog_pos = 0  # bytes of the catalog file read so far
+        self._catalog_lines = 0
+        self._views: Dict[str, "TimeSeriesDB"] = {}  # other workers' slot directories, read-only
+        self._views_lock = threading.Lock()
+        # resolution -> (open bucket start, target id -> accumulator)
+        self._open: Dict[str, Tuple[float, Dict[int, _Bucket]]] = {}
+        self._last_ts = 0.0
+
+    def use_slot(self, slot: int):
+        """Write under this worker's slot directory (see module docstring); call before open()."""
+        self.directory = self.root if slot == 0 else os.path.join(self.root, f"worker-{slot}")
+        self._merge_peers = True
+
+    def open(self):
+        if self._series:
+            return
+        if not self.readonly:
+            os.makedirs(self.directory, exist_ok=True)
+        self._read_catalog()
+        self._series = {"raw": Series(self.directory, "raw", RAW, self.readonly)}
+        for res in RESOLUTIONS:
+            self._series[res] = Series(self.directory, res, ROLLUP, self.readonly)
+        self._last_ts = self._series["raw"].last_ts()
+        if not self.readonly:
+            raw = self._series["raw"].segments
+            if raw:
+                # ids whose catalog line was lost in a crash can only be in the newest segment
+                raw[-1]._catch_up()
+                self._next_id = max([self._next_id] + [tid + 1 for tid in raw[-1]._index])
+            self._seen = dict.fromkeys(self._ids.values(), time.time())
+            self._last_expire = time.time()
+            self._catalog = _CatalogWriter(os.path.join(self.directory, "targets.txt"))
+
+    def _read_catalog(self):
+        try:
+            f = open(os.path.join(self.directory, "targets.txt"), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            if ino != self._catalog_ino:
+                # first read, or the writer rewrote the catalog: start over
+                self._catalog_ino, self._catalog_pos, self._catalog_lines = ino, 0, 0
+                self._ids = {}
+            f.seek(self._catalog_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a line still being written by another process; read it next time
+                self._catalog_pos += len(line)
+                self._catalog_lines += 1
+                self._apply(line[:-1].decode("utf-8"))
+
+    def _apply(self, line: str):
+        tid, _, key = line.partition(" ")
+        if tid.startswith("-"):
+            if self._ids.get(key) == int(tid[1:]):
+                del self._ids[key]
+            return
+        if not tid.isdigit():
+            # catalogs from before ids were written out: the line number is the id
+            tid, key = str(self._catalog_lines - 1), line
+        self._ids[key] = int(tid)
+        self._next_id = max(self._next_id, int(tid) + 1)
+
+    def refresh(self):
+        """Read-only views: pick up targets and segments the writer added since the last query."""
+        self._read_catalog()
+        for series in self._series.values():
+            series.refresh()
+
+    def close(self):
+        with self._views_lock:
+            views, self._views = list(self._views.values()), {}
+        for view in views:
+            view.close()
+        if not self._series:
+            return
+        if not self.readonly:
+            for res in RESOLUTIONS:
+                self._flush_bucket(res)
+        for series in self._series.values():
+            series.close()
+        self._series = {}
+        if self._catalog is not None:
+            self._catalog.close()
+            self._catalog = None
+
+    def _peers(self) -> List["TimeSeriesDB"]:
+        """Up-to-date read-only views of the other workers' slot directories."""
+        if not self._merge_peers:
+            return []
+        with self._views_lock:
+            return self._refresh_peers()
+
+    def _refresh_peers(self) -> List["TimeSeriesDB"]:
+        dirs = [self.root] if self.directory != self.root else []
+        try:
+            names = sorted(os.listdir(self.root))
+        except OSError:
+            names = []
+        dirs += [os.path.join(self.root, n) for n in names
+                 if n.startswith("worker-") and os.path.join(self.root, n) != self.directory
+                 and os.path.isdir(os.path.join(self.root, n))]
+        views = []
+        for d in dirs:
+            view = self._views.get(d)
+            if view is not None:
+                view.refresh()
+            elif os.path.exists(os.path.join(d, "targets.txt")):
+                view = self._views[d] = TimeSeriesDB(d, readonly=True)
+                view.open()
+            else:
+                continue
+            views.append(view)
+        return views
+
+    def _target_id(self, key: str, create: bool) -> Optional[int]:
+        tid = self._ids.get(key)
+        if tid is None and create:
+            key = key.replace("\n", " ")
+            tid = self._ids[key] = self._next_id
+            self._next_id += 1
+            self._write_catalog(f"{tid} {key}\n")
+        return tid
+
+    def _write_catalog(self, line: str):
+        self._catalog.append(line)
+        self._catalog_lines += 1
+        if self._catalog_lines > 2 * len(self._ids) + CATALOG_SLACK:
+            self._catalog.rewrite([f"{tid} {key}\n" for key, tid in self._ids.items()])
+            self._catalog_lines = len(self._ids)
+
+    def _forget(self, key: str):
+        tid = self._ids.pop(key)
+        self._seen.pop(tid, None)
+        self._write_catalog(f"-{tid} {key}\n")
+
+    def _expire(self, now: float):
+        cutoff = now - ID_EXPIRY
+        for key, tid in list(self._ids.items()):
+            if self._seen.get(tid, now) < cutoff:
+                self._forget(key)
+        self._last_expire = now
+
+    def _flush_bucket(self, res: str):
+        bucket, accs = self._open.pop(res, (None, None))
+        for tid, acc in (accs or {}).items():
+            self._series[res].append(acc.values(bucket, tid))
+
+    def record(self, key: str, up: bool, latency_ms: Optional[float], ts: Optional[float] = None):
+        self.open()
+        # keep each series append-only in time even if the wall clock steps back
+        ts = max(ts if ts is not None else time.time(), self._last_ts)
+        self._last_ts = ts
+        tid = self._target_id(key, create=True)
+        self._seen[tid] = ts
+        if ts - self._last_expire >= EXPIRE_INTERVAL:
+            self._expire(ts)
+        self._series["raw"].append((ts, tid, 1 if up else 0, latency_ms if latency_ms is not None else -1.0))
+        for res, width in RESOLUTIONS.items():
+            bucket = ts - ts % width
+            if res in self._open and self._open[res][0] != bucket:
+                self._flush_bucket(res)
+            accs = self._open.setdefault(res, (bucket, {}))[1]
+            accs.setdefault(tid, _Bucket()).add(up, latency_ms)
+
+    def _raw(self, key: str, since: float, until: float) -> List[tuple]:
+        self.open()
+        tid = self._target_id(key, create=False)
+        if tid is None:
+            return []
+        return self._series["raw"].query(tid, since, until)
+
+    def _rollups(self, key: str, resolution: str, since: float, until: float) -> List[tuple]:
+        self.open()
+        tid = self._target_id(key, create=False)
+        if tid is None:
+            return []
+        rows = self._series[resolution].query(tid, since, until)
+        bucket, accs = self._open.get(resolution, (None, {}))
+        if tid in accs and since <= bucket + RESOLUTIONS[resolution] and bucket < until:
+            rows.append(accs[tid].values(bucket, tid))
+        return rows
+
+    def samples(self, key: str, since: float, until: Optional[float] = None) -> List[Tuple[float, bool, Optional[float]]]:
+        """Raw samples for key in [since, until) as (timestamp, up, latency_ms)."""
+        until = until if until is not None else float("inf")
+        rows = self._raw(key, since, until)
+        peers = self._peers()
+        for view in peers:
+            rows.extend(view._raw(key, since, until))
+        if peers:
+            rows.sort(key=lambda v: v[0])
+        return [(ts, bool(up), lat if lat >= 0 else None) for ts, _, up, lat in rows]
+
+    def rollups(self, key: str, resolution: str, since: float, until: Optional[float] = None) -> List[Dict]:
+        """Downsampled buckets for key, including the still-open bucket."""
+        until = until if until is not None else float("inf")
+        rows = self._rollups(key, resolution, since, until)
+        peers = self._peers()
+        for view in peers:
+            rows.extend(view._rollups(key, resolution, since, until))
+        if peers:
+            rows = _merge_rollups(rows)
+        return [_rollup_row(v) for v in rows]
+
+    def history(self, key: str, window: float, resolution: Optional[str] = None) -> Dict:
+        """
+        Points for the last `window` seconds. Without an explicit resolution the
+        finest one whose retention covers the window is used.
+        """
+        if resolution is None:
+            resolution = "raw" if window <= 6 * 3600 else "1m" if window <= 7 * 86400 else "1h"
+        since = time.time() - window
+        if resolution == "raw":
+            points = [{"ts": ts, "up": up, "latency_ms": None if lat is None else round(lat, 2)}
+                      for ts, up, lat in self.samples(key, since)]
+        else:
+            points = self.rollups(key, resolution, since)
+        return {"key": key, "resolution": resolution, "window_s": window, "points": points}
+
+    # Monitor history store interface (see app/monitor.py)
+    def drop(self, key: str):
+        """Forget key's id; its samples are no longer reachable and age out with retention."""
+        if not self.readonly and self._series and key in self._ids:
+            self._forget(key)
+
+
+def _merge_rollups(rows: List[tuple]) -> List[tuple]:
+    """Combine rollup records of the same bucket written by different workers."""
+    merged: Dict[float, list] = {}
+    for bucket, tid, checks, up, avg, lo, hi in rows:
+        m = merged.get(bucket)
+        if m is None:
+            merged[bucket] = [bucket, tid, checks, up, avg, lo, hi]
+            continue
+        if avg >= 0:
+            if m[4] < 0:
+                m[4:7] = [avg, lo, hi]
+            else:
+                # weighted by checks; latency counts per bucket aren't stored
+                m[4] = (m[4] * m[2] + avg * checks) / (m[2] + checks)
+                m[5], m[6] = min(m[5], lo), max(m[6], hi)
+        m[2] += checks
+        m[3] += up
+    return [tuple(merged[b]) for b in sorted(merged)]
+
+
+def _rollup_row(values: tuple) -> Dict:
+    bucket, _, checks, up, avg, lo, hi = values
+    return {
+        "ts": bucket,
+        "checks": checks,
+        "uptime_pct": 100.0 * up / checks if checks else None,
+        "latency_ms": None if avg < 0 else {"avg": round(avg, 2), "min": round(lo, 2), "max": round(hi, 2)},
+    }
+
+
+tsdb = TimeSeriesDB()
@@ -0,0 +1,557 @@
+"""
+Write-behind visitor logging and pre-aggregated visitor statistics.
+
+The request path only appends an event to a bounded in-memory queue; a
+background thread collects queued events into batches and hands each to
+the database's single writer connection (app/db.py). When the queue is
+full new events are dropped (and counted) rather than slowing requests
+down. A batch that fails to write (database locked, disk full) is retried
+with the next one; at most VISITOR_RETRY_MAX events are held for retry,
+and the oldest beyond that are dropped, counted and logged.
+
+Each batch also updates hourly/daily rollups (visit counts and HyperLogLog
+sketches of visitor IPs) and per-day IP and path counters, so the admin
+stats can be answered without scanning the visitors table.
+
+The raw log is partitioned by month: visits go to visitors_YYYY_MM tables
+and `visitors` is a UNION ALL view over them (plus visitors_legacy, the
+pre-partitioning table), so readers query it as one table while old months
+can be archived and dropped whole (see app/archive.py). The visitor list
+pages through the partitions directly (visitor_page).
+"""
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import metrics
+from .db import Database
+from .sketch import HyperLogLog
+
+VISITOR_DB = "visitors.db"
+VISITOR_QUEUE_SIZE = 10000
+VISITOR_BATCH_SIZE = 500
+VISITOR_FLUSH_INTERVAL = 1.0  # seconds between batches when traffic is light
+VISITOR_RETRY_MAX = 10000  # events kept for retry after failed writes
+
+LEGACY_PARTITION = "visitors_legacy"
+VISITOR_COLUMNS = ("id", "ip_address", "user_agent", "referrer", "path", "timestamp",
+                   "country", "city", "isp", "session_id")
+
+_STOP = object()
+
+# (ip_address, user_agent, referrer, path, timestamp, session_id)
+VisitEvent = Tuple[str, str, str, str, str, str]
+
+
+visitors_db = Database(VISITOR_DB, name="visitors")
+
+
+class VisitorLog:
+    def __init__(
+        self,
+        db: Database = visitors_db,
+        maxsize: int = VISITOR_QUEUE_SIZE,
+        batch_size: int = VISITOR_BATCH_SIZE,
+        flush_interval: float = VISITOR_FLUSH_INTERVAL,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"queued": 0, "dropped": 0, "written": 0, "batches": 0, "errors": 0,
+                      "retried": 0, "lost": 0}
+        self._retry: List[VisitEvent] = []  # events of failed batches, oldest first
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="visitor-log", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flush everything still queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)  # blocks only if the queue is full
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(self, ip: str, user_agent: str, referrer: str, path: str, session_id: str) -> bool:
+        """Queue one page visit. Never blocks; returns False if the event was dropped."""
+        event = (ip, user_agent, referrer, path, datetime.now().isoformat(), session_id)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    def metrics(self) -> Dict:
+        data = dict(self.stats)
+        data["pending"] = self._queue.qsize()
+        data["retry_pending"] = len(self._retry)
+        return data
+
+    def _run(self):
+        self.db.write_sync(ensure_rollups)
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if not self._retry:
+                    continue
+                item = None  # nothing new, but a failed batch is due for another try
+            batch: List[VisitEvent] = []
+            while item is not None:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if stopping:
+                # drain whatever arrived before the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if self._retry:
+                self.stats["retried"] += len(self._retry)
+                batch, self._retry = self._retry + batch, []
+            if batch:
+                with metrics.stage("sqlite_write"):
+                    ok = self.db.write_sync(self._write, batch, name="visitor_batch")
+                if not ok:
+                    self._hold(batch)
+                    if not stopping:
+                        time.sleep(self.flush_interval)  # back off if the db is locked/broken
+        if self._retry:
+            self.stats["lost"] += len(self._retry)
+            print(f"Visitor log stopped with {len(self._retry)} unwritten events; they are lost")
+            self._retry = []
+
+    def _hold(self, batch: List[VisitEvent]):
+        """Keep a failed batch for the next write, dropping the oldest events past VISITOR_RETRY_MAX."""
+        overflow = len(batch) - VISITOR_RETRY_MAX
+        if overflow > 0:
+            self.stats["lost"] += overflow
+            print(f"Visitor log retry buffer full: dropped {overflow} oldest unwritten events")
+            batch = batch[overflow:]
+        self._retry = batch
+
+    def _write(self, conn: sqlite3.Connection, batch: List[VisitEvent]) -> bool:
+        try:
+            ensure_partitions(conn, {ts[:7] for _, _, _, _, ts, _ in batch})
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            print(f"Error creating visitor partitions: {e}")
+            return False
+        # one upsert per IP per batch instead of one per visit
+        per_ip: Dict[str, list] = {}
+        for ip, user_agent, _, _, ts, _ in batch:
+            agg = per_ip.get(ip)
+            if agg is None:
+                per_ip[ip] = [ts, ts, 1, user_agent]
+            else:
+                agg[1] = ts
+                agg[2] += 1
+        try:
+            with conn:
+                insert_visits(conn, batch)
+                conn.executemany(
+                    """
+                    INSERT INTO visitor_stats
+                    (ip_address, first_seen, last_seen, total_visits, user_agent)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(ip_address) DO UPDATE SET
+                        last_seen = excluded.last_seen,
+                        total_visits = total_visits + excluded.total_visits
+                    """,
+                    [(ip, *agg) for ip, agg in per_ip.items()],
+                )
+                update_rollups(conn, batch)
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            print(f"Error writing visitor batch ({len(batch)} events): {e}")
+            return False
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        return True
+
+
+def create_schema(conn: sqlite3.Connection):
+    """Create the visitor tables if missing, and the partition for the current month."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_stats (
+            ip_address TEXT PRIMARY KEY,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            total_visits INTEGER DEFAULT 1,
+            user_agent TEXT,
+            country TEXT,
+            city TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_visitor_stats_visits ON visitor_stats (total_visits)")
+    # rollups maintained by the visitor log writer
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_rollup_hourly (
+            hour TEXT PRIMARY KEY,
+            visits INTEGER NOT NULL,
+            ip_sketch BLOB
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_rollup_daily (
+            day TEXT PRIMARY KEY,
+            visits INTEGER NOT NULL,
+            ip_sketch BLOB
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_ip_daily (
+            day TEXT NOT NULL,
+            ip_address TEXT NOT NULL,
+            visits INTEGER NOT NULL,
+            PRIMARY KEY (day, ip_address)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_path_daily (
+            day TEXT NOT NULL,
+            path TEXT NOT NULL,
+            visits INTEGER NOT NULL,
+            PRIMARY KEY (day, path)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_visitor_ip_daily_visits ON visitor_ip_daily (day, visits)")
+    conn.commit()
+    # the raw log itself is a view over monthly partitions
+    ensure_partitions(conn, [datetime.now().strftime("%Y-%m")])
+
+
+def partition_name(month: str) -> str:
+    """Partition table holding one month of visits ("2026-10" -> "visitors_2026_10")."""
+    return "visitors_" + month.replace("-", "_")
+
+
+def list_partitions(conn: sqlite3.Connection) -> List[str]:
+    """Partition tables, oldest first (the legacy table, if any, leads)."""
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND "
+        "(name = ? OR name GLOB 'visitors_[0-9][0-9][0-9][0-9]_[0-9][0-9]') ORDER BY name != ?, name",
+        (LEGACY_PARTITION, LEGACY_PARTITION),
+    ).fetchall()
+    return [name for (name,) in rows]
+
+
+def rebuild_view(conn: sqlite3.Connection):
+    """Point the visitors view at the current partitions (caller owns the transaction)."""
+    columns = ", ".join(VISITOR_COLUMNS)
+    selects = [f"SELECT {columns} FROM {name}" for name in list_partitions(conn)]
+    if not selects:  # everything archived and no visits since
+        selects = ["SELECT " + ", ".join(f"NULL AS {c}" for c in VISITOR_COLUMNS) + " WHERE 0"]
+    conn.execute("DROP VIEW IF EXISTS visitors")
+    conn.execute("CREATE VIEW visitors AS " + " UNION ALL ".join(selects))
+
+
+def _create_partition(conn: sqlite3.Connection, name: str):
+    conn.execute(f"""
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL,
+            user_agent TEXT,
+            referrer TEXT,
+            path TEXT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            country TEXT,
+            city TEXT,
+            isp TEXT,
+            session_id TEXT
+        )
+    """)
+    conn.execute(f"CREATE INDEX idx_{name}_time ON {name} (timestamp)")
+    conn.execute(f"CREATE INDEX idx_{name}_ip ON {name} (ip_address)")
+    conn.execute(f"CREATE INDEX idx_{name}_session ON {name} (session_id)")
+    # ids carry on from the previous partitions, so (timestamp, id) cursors stay unique
+    last = conn.execute(
+        "SELECT MAX(seq) FROM sqlite_sequence WHERE name = ? OR name GLOB 'visitors_[0-9]*'",
+        (LEGACY_PARTITION,),
+    ).fetchone()[0]
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, last or 0))
+
+
+def ensure_partitions(conn: sqlite3.Connection, months: Iterable[str]):
+    """
+    Create the partitions for these months ("YYYY-MM") if missing and add them
+    to the visitors view. Must not be called inside a transaction.
+
+    A pre-partitioning visitors table is renamed to visitors_legacy first;
+    the archiver empties it month by month.
+    """
+    names = {partition_name(m) for m in months}
+    have = conn.execute(
+        f"SELECT name, type FROM sqlite_master WHERE name IN ({', '.join('?' * (len(names) + 1))})",
+        (*names, "visitors"),
+    ).fetchall()
+    if len([n for n, _ in have if n in names]) == len(names) and ("visitors", "view") in have:
+        return
+    conn.execute("BEGIN IMMEDIATE")  # another worker may be doing the same
+    try:
+        kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'visitors'").fetchone()
+        if kind and kind[0] == "table":
+            conn.execute(f"ALTER TABLE visitors RENAME TO {LEGACY_PARTITION}")
+        existing = set(list_partitions(conn))
+        for name in sorted(names - existing):
+            _create_partition(conn, name)
+        rebuild_view(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def insert_visits(conn: sqlite3.Connection, batch: List[VisitEvent]):
+    """Insert visits into their monthly partitions (see ensure_partitions; caller owns the transaction)."""
+    months: Dict[str, List[VisitEvent]] = {}
+    for event in batch:
+        months.setdefault(event[4][:7], []).append(event)
+    for month, events in months.items():
+        conn.executemany(
+            f"""
+            INSERT INTO {partition_name(month)}
+            (ip_address, user_agent, referrer, path, timestamp, session_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            events,
+        )
+
+
+def _upsert_sketches(conn: sqlite3.Connection, table: str, column: str, groups: Dict[str, list]):
+    for key, (visits, ips) in groups.items():
+        row = conn.execute(f"SELECT ip_sketch FROM {table} WHERE {column} = ?", (key,)).fetchone()
+        hll = HyperLogLog(row[0] if row else None)
+        hll.update(ips)
+        conn.execute(
+            f"""
+            INSERT INTO {table} ({column}, visits, ip_sketch) VALUES (?, ?, ?)
+            ON CONFLICT({column}) DO UPDATE SET
+                visits = visits + excluded.visits,
+                ip_sketch = excluded.ip_sketch
+            """,
+            (key, visits, hll.to_bytes()),
+        )
+
+
+def update_rollups(conn: sqlite3.Connection, batch: List[VisitEvent]):
+    """Fold a batch of visits into the rollup tables (caller owns the transaction)."""
+    hours: Dict[str, list] = {}
+    days: Dict[str, list] = {}
+    ip_days: Counter = Counter()
+    path_days: Counter = Counter()
+    for ip, _, _, path, ts, _ in batch:
+        hour, day = ts[:13], ts[:10]
+        for groups, key in ((hours, hour), (days, day)):
+            group = groups.setdefault(key, [0, set()])
+            group[0] += 1
+            group[1].add(ip)
+        ip_days[(day, ip)] += 1
+        path_days[(day, path)] += 1
+    _upsert_sketches(conn, "visitor_rollup_hourly", "hour", hours)
+    _upsert_sketches(conn, "visitor_rollup_daily", "day", days)
+    conn.executemany(
+        """
+        INSERT INTO visitor_ip_daily (day, ip_address, visits) VALUES (?, ?, ?)
+        ON CONFLICT(day, ip_address) DO UPDATE SET visits = visits + excluded.visits
+        """,
+        [(day, ip, n) for (day, ip), n in ip_days.items()],
+    )
+    conn.executemany(
+        """
+        INSERT INTO visitor_path_daily (day, path, visits) VALUES (?, ?, ?)
+        ON CONFLICT(day, path) DO UPDATE SET visits = visits + excluded.visits
+        """,
+        [(day, path, n) for (day, path), n in path_days.items()],
+    )
+
+
+def ensure_rollups(conn: sqlite3.Connection, chunk: int = 50000):
+    """Build the rollups from the raw log once, for databases that predate them."""
+    if conn.execute("SELECT 1 FROM visitor_rollup_daily LIMIT 1").fetchone():
+        return
+    if not conn.execute("SELECT 1 FROM visitors LIMIT 1").fetchone():
+        return
+    with conn:
+        cur = conn.execute("SELECT ip_address, path, timestamp FROM visitors ORDER BY id")
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            update_rollups(conn, [(ip, "", "", path, ts, "") for ip, path, ts in rows])
+
+
+def _top(conn: sqlite3.Connection, table: str, column: str, raw_column: str,
+         from_day: Optional[str], raw_start: str, raw_end: str, limit: int) -> List[tuple]:
+    # per-day counters for whole days, plus raw rows for the partial first day
+    day_filter = "WHERE day >= ?" if from_day else ""
+    day_args = (from_day,) if from_day else ()
+    return conn.execute(
+        f"""
+        SELECT key, SUM(visits) AS total FROM (
+            SELECT {column} AS key, visits FROM {table} {day_filter}
+            UNION ALL
+            SELECT {raw_column} AS key, COUNT(*) AS visits FROM visitors
+            WHERE timestamp >= ? AND timestamp < ? GROUP BY {raw_column}
+        )
+        GROUP BY key ORDER BY total DESC LIMIT ?
+        """,
+        (*day_args, raw_start, raw_end, limit),
+    ).fetchall()
+
+
+def _boundaries(cutoff: datetime) -> Tuple[datetime, datetime]:
+    # first whole hour and first whole day at or after cutoff
+    hour_start = cutoff.replace(minute=0, second=0, microsecond=0)
+    if hour_start < cutoff:
+        hour_start += timedelta(hours=1)
+    day_start = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+    if day_start < cutoff:
+        day_start += timedelta(days=1)
+    return hour_start, day_start
+
+
+def visit_count(conn: sqlite3.Connection, cutoff: datetime) -> int:
+    """Number of visits since cutoff, from the rollups plus the partial first hour."""
+    if cutoff == datetime.min:
+        return conn.execute("SELECT COALESCE(SUM(visits), 0) FROM visitor_rollup_daily").fetchone()[0]
+    hour_start, day_start = _boundaries(cutoff)
+    c_iso, h_iso, d_iso = cutoff.isoformat(), hour_start.isoformat(), day_start.isoformat()
+    return conn.execute(
+        """
+        SELECT
+            (SELECT COUNT(*) FROM visitors WHERE timestamp >= ? AND timestamp < ?)
+          + (SELECT COALESCE(SUM(visits), 0) FROM visitor_rollup_hourly WHERE hour >= ? AND hour < ?)
+          + (SELECT COALESCE(SUM(visits), 0) FROM visitor_rollup_daily WHERE day >= ?)
+        """,
+        (c_iso, h_iso, h_iso[:13], d_iso[:13], d_iso[:10]),
+    ).fetchone()[0]
+
+
+def visitor_page(conn: sqlite3.Connection, cutoff: datetime, after: Optional[Tuple[str, int]],
+                 limit: int) -> Tuple[int, List[tuple]]:
+    """
+    (visits since cutoff, up to `limit` visits newest first after the (timestamp, id)
+    cursor `after`). Reads the partitions directly, newest first, with one index
+    range scan each, and stops once the page is full: through the visitors view
+    sqlite would scan and sort every live row for each page.
+    """
+    c_iso = cutoff.isoformat()
+    where, args = "timestamp >= ?", (c_iso,)
+    if after:
+        where, args = where + " AND (timestamp, id) < (?, ?)", (c_iso, *after)
+    tables = []
+    for name in list_partitions(conn):
+        newest = conn.execute(f"SELECT MAX(timestamp) FROM {name}").fetchone()[0]
+        if newest is not None and newest >= c_iso:
+            tables.append((newest, name))
+    rows: List[tuple] = []
+    for newest, name in sorted(tables, reverse=True):
+        if len(rows) >= limit and newest < rows[-1][4]:
+            break  # everything left is older than the page
+        rows.extend(conn.execute(
+            f"""
+            SELECT id, ip_address, user_agent, path, timestamp, session_id
+            FROM {name}
+            WHERE {where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+            """,
+            (*args, limit),
+        ).fetchall())
+        # only the legacy table can overlap a monthly partition, so this rarely reorders
+        rows.sort(key=lambda r: (r[4], r[0]), reverse=True)
+        del rows[limit:]
+    return visit_count(conn, cutoff), rows
+
+
+def rollup_stats(conn: sqlite3.Connection, cutoff: datetime, now: datetime, top_paths: int = 5,
+                 archived_paths: Optional[Counter] = None) -> Dict:
+    """
+    Visitor statistics for visits since `cutoff`, from the rollup tables.
+    Only visits between cutoff and the next hour/day boundary are read from
+    the raw log. unique_ips is a HyperLogLog estimate except for all-time stats,
+    whose top paths also count `archived_paths` (per-path totals of archived months).
+    """
+    today = now.strftime("%Y-%m-%d")
+    row = conn.execute("SELECT visits FROM visitor_rollup_daily WHERE day = ?", (today,)).fetchone()
+    today_visits = row[0] if row else 0
+
+    if cutoff == datetime.min:
+        total = conn.execute("SELECT COALESCE(SUM(visits), 0) FROM visitor_rollup_daily").fetchone()[0]
+        unique = conn.execute("SELECT COUNT(*) FROM visitor_stats").fetchone()[0]
+        most_active = conn.execute(
+            "SELECT ip_address, total_visits FROM visitor_stats ORDER BY total_visits DESC LIMIT 1"
+        ).fetchone()
+        if archived_paths:
+            totals = Counter(archived_paths)
+            totals.update(dict(conn.execute("SELECT path, SUM(visits) FROM visitor_path_daily GROUP BY path")))
+            paths = totals.most_common(top_paths)
+        else:
+            paths = conn.execute(
+                "SELECT path, SUM(visits) AS total FROM visitor_path_daily GROUP BY path ORDER BY total DESC LIMIT ?",
+                (top_paths,),
+            ).fetchall()
+    else:
+        hour_start, day_start = _boundaries(cutoff)
+        c_iso, h_iso, d_iso = cutoff.isoformat(), hour_start.isoformat(), day_start.isoformat()
+
+        hll = HyperLogLog()
+        total = 0
+        for (ip,) in conn.execute(
+            "SELECT ip_address FROM visitors WHERE timestamp >= ? AND timestamp < ?", (c_iso, h_iso)
+        ):
+            total += 1
+            hll.add(ip)
+        for visits, sketch in conn.execute(
+            "SELECT visits, ip_sketch FROM visitor_rollup_hourly WHERE hour >= ? AND hour < ?",
+            (h_iso[:13], d_iso[:13]),
+        ):
+            total += visits
+            hll.merge(sketch)
+        for visits, sketch in conn.execute(
+            "SELECT visits, ip_sketch FROM visitor_rollup_daily WHERE day >= ?", (d_iso[:10],)
+        ):
+            total += visits
+            hll.merge(sketch)
+        unique = hll.count() if total else 0
+
+        top_ips = _top(conn, "visitor_ip_daily", "ip_address", "ip_address",
+                       d_iso[:10], c_iso, d_iso, 1)
+        most_active = top_ips[0] if top_ips else None
+        paths = _top(conn, "visitor_path_daily", "path", "path", d_iso[:10], c_iso, d_iso, top_paths)
+
+    return {
+        "total_visits": total,
+        "unique_ips": unique,
+        "today_visits": today_visits,
+        "most_active_ip": most_active[0] if most_active else None,
+        "most_active_count": most_active[1] if most_active else 0,
+        "top_paths": [{"path": p, "visits": n} for p, n in paths],
+    }
+
+
+visitor_log = VisitorLog()
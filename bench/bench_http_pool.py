@@ -0,0 +1,110 @@
+"""
+Compare per-request httpx clients (the old /api/http behaviour) against the
+shared client pool in app/httpclient.py.
+
+Runs a local keep-alive HTTP server that delays every new connection by
+--connect-delay ms to stand in for the TCP+TLS handshake of a remote site,
+then reports p50/p99 request latency for both modes.
+
+    python bench/bench_http_pool.py --requests 500 --concurrency 20 --connect-delay 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import app.resolver  # noqa: E402
+from app.httpclient import ClientPool  # noqa: E402
+
+# the pool vets addresses like the app does; the stand-in server lives on 127.0.0.1
+app.resolver.is_private_address = lambda addr: False
+
+BODY = b"ok\n"
+
+
+async def serve(reader, writer, connect_delay):
+    await asyncio.sleep(connect_delay)  # pretend handshake
+    try:
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+            if not request:
+                break
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+                b"Content-Length: %d\r\nConnection: keep-alive\r\n\r\n%s" % (len(BODY), BODY)
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    k = max(0, min(len(samples) - 1, int(round(pct / 100.0 * len(samples) + 0.5)) - 1))
+    return samples[k]
+
+
+async def run(mode, url, total, concurrency):
+    pool = ClientPool()
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            if mode == "fresh":
+                async with httpx.AsyncClient(timeout=10, follow_redirects=True) as client:
+                    resp = await client.get(url)
+            else:
+                async with pool.target("127.0.0.1") as client:
+                    resp = await client.get(url, timeout=10, follow_redirects=True)
+            resp.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    await pool.close()
+    return {
+        "mode": mode,
+        "requests": total,
+        "req_per_s": total / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--connect-delay", type=float, default=30.0, help="ms per new connection")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    delay = args.connect_delay / 1000.0
+    server = await asyncio.start_server(lambda r, w: serve(r, w, delay), "127.0.0.1", 0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+    results = []
+    async with server:
+        for mode in ("fresh", "pooled"):
+            results.append(await run(mode, url, args.requests, args.concurrency))
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"{'mode':<8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['req_per_s']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
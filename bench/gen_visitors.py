@@ -0,0 +1,101 @@
+"""
+Generate a synthetic visitors.db for benchmarking the visitor middleware and
+the admin stats/list queries.
+
+Rows are spread over --days days ending now, with a skewed IP distribution
+(a few heavy hitters, a long tail) and a handful of paths. The schema comes
+from app.visitors.create_schema (the FastAPI app isn't imported, so no
+frontend build is needed) and the rollups are built at the end, so the app
+starts on the database as if it had been running all along.
+
+    python bench/gen_visitors.py --rows 2000000 --out bench/work/visitors.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+PATHS = ["/", "/curl", "/port-scan", "/status", "/about", "/faq"]
+USER_AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 Version/17.2 Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0",
+    "curl/8.5.0",
+]
+CHUNK = 100000
+
+
+def rows(n: int, days: int, ips: int, seed: int):
+    rnd = random.Random(seed)
+    now = datetime.now()
+    start = now - timedelta(days=days)
+    step = (now - start).total_seconds() / max(1, n)
+    for i in range(n):
+        ts = start + timedelta(seconds=i * step)
+        # Pareto-ish: low ids are much more frequent
+        ip_id = min(ips - 1, int(rnd.paretovariate(1.2)) - 1)
+        ip = f"10.{(ip_id >> 16) & 255}.{(ip_id >> 8) & 255}.{ip_id & 255}"
+        yield (
+            ip,
+            rnd.choice(USER_AGENTS),
+            "",
+            rnd.choice(PATHS),
+            ts.isoformat(),
+            f"s{ip_id}-{i // 50}",
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic visitors.db")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--ips", type=int, default=200000, help="distinct visitor IPs (upper bound)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench/work/visitors.db")
+    args = parser.parse_args()
+
+    if os.path.basename(args.out) != "visitors.db":
+        parser.error("--out must end in visitors.db (the app opens it by that name)")
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.out + suffix):
+            os.remove(args.out + suffix)
+
+    from app.visitors import create_schema, ensure_partitions, ensure_rollups, insert_visits
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.out)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    create_schema(conn)
+    now = datetime.now()
+    ensure_partitions(conn, {(now - timedelta(days=d)).strftime("%Y-%m") for d in range(args.days + 1)})
+    batch = []
+    with conn:
+        for row in rows(args.rows, args.days, args.ips, args.seed):
+            batch.append(row)
+            if len(batch) >= CHUNK:
+                insert_visits(conn, batch)
+                batch = []
+        if batch:
+            insert_visits(conn, batch)
+        conn.execute(
+            """
+            INSERT INTO visitor_stats (ip_address, first_seen, last_seen, total_visits, user_agent)
+            SELECT ip_address, MIN(timestamp), MAX(timestamp), COUNT(*), MAX(user_agent)
+            FROM visitors GROUP BY ip_address
+            """
+        )
+    inserted = time.perf_counter() - started
+    ensure_rollups(conn)
+    conn.close()
+    print(f"{args.rows} rows in {inserted:.1f}s, rollups in {time.perf_counter() - started - inserted:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Load scenarios for the API, run against a real uvicorn process and local
+stand-in targets (bench/standins.py, the fake nmap in bench/bin).
+
+For each scenario a fixed number of concurrent clients loop for --duration
+seconds; the report gives req/s, p50/p95/p99 latency, errors and the server's
+RSS (current and peak) afterwards. --json writes the results with the commit
+they were measured on, and --compare prints the change against an earlier
+--json file, so runs can be compared across commits.
+
+    python bench/load.py --duration 10 --concurrency 20 --json bench/results/$(git rev-parse --short HEAD).json
+    python bench/load.py --scenarios http,admin_stats --compare bench/results/abc1234.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# name -> (description, request builder(i, ctx) -> (method, path, httpx kwargs))
+Request = Tuple[str, str, Dict]
+SCENARIOS: Dict[str, Tuple[str, Callable[[int, Dict], Request]]] = {
+    "page": ("GET / through the visitor middleware and page cache",
+             lambda i, ctx: ("GET", "/", {})),
+    "port": ("POST /api/port against the stand-in TCP server (mostly cached)",
+             lambda i, ctx: ("POST", "/api/port", {"json": {"host": "127.0.0.1", "port": ctx["tcp_port"], "timeout": 2}})),
+    "ports_batch": ("POST /api/ports/batch, 100 ports per request",
+                    lambda i, ctx: ("POST", "/api/ports/batch", {"json": {
+                        "host": "127.0.0.1", "ports": [ctx["tcp_port"]], "range": "40000-40098", "timeout": 1}})),
+    "http": ("POST /api/http to the stand-in HTTP server, unique URLs (uncached)",
+             lambda i, ctx: ("POST", "/api/http", {"json": {"url": f"{ctx['http_url']}?i={i}"}})),
+    "http_slow_body": ("POST /api/http verbose on a slow 1 MiB body",
+                       lambda i, ctx: ("POST", "/api/http", {"json": {"url": f"{ctx['http_url']}slow?i={i}", "verbose": True}})),
+    "nmap_builtin": ("POST /api/nmap, builtin connect scan of 100 ports",
+                     lambda i, ctx: ("POST", "/api/nmap", {"json": {"host": "127.0.0.1", "top_ports": 100}})),
+    "nmap_binary": ("POST /api/nmap engine=nmap with the fake nmap binary",
+                    lambda i, ctx: ("POST", "/api/nmap", {"json": {"host": "127.0.0.1", "top_ports": 100, "engine": "nmap"}})),
+    "admin_stats": ("GET /qhx-admin/api/stats?filter=all",
+                    lambda i, ctx: ("GET", "/qhx-admin/api/stats", {"params": {"filter": "all"}})),
+    "admin_stats_week": ("GET /qhx-admin/api/stats?filter=week",
+                         lambda i, ctx: ("GET", "/qhx-admin/api/stats", {"params": {"filter": "week"}})),
+    "admin_visitors": ("GET /qhx-admin/api/visitors, first page",
+                       lambda i, ctx: ("GET", "/qhx-admin/api/visitors", {"params": {"filter": "all", "limit": 50}})),
+}
+
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    samples = sorted(samples)
+    k = max(0, min(len(samples) - 1, int(round(pct / 100.0 * len(samples) + 0.5)) - 1))
+    return samples[k]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_kib(pid: int) -> Dict[str, Optional[int]]:
+    # Linux only; other platforms report null
+    out = {"rss_kib": None, "peak_rss_kib": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    out["rss_kib"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    out["peak_rss_kib"] = int(line.split()[1])
+    except OSError:
+        pass
+    return out
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_workdir(workdir: str, rows: int):
+    dist = os.path.join(workdir, "frontend", "dist")
+    os.makedirs(dist, exist_ok=True)
+    if not os.path.exists(os.path.join(dist, "index.html")):
+        for src in ("frontend/dist/index.html", "frontend/index.html"):
+            if os.path.exists(os.path.join(REPO_DIR, src)):
+                shutil.copy(os.path.join(REPO_DIR, src), os.path.join(dist, "index.html"))
+                break
+    if not os.path.exists(os.path.join(workdir, "visitors.db")):
+        subprocess.check_call([sys.executable, os.path.join(BENCH_DIR, "gen_visitors.py"),
+                               "--rows", str(rows), "--out", os.path.join(workdir, "visitors.db")])
+
+
+async def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{proc.args} exited with {proc.returncode}")
+            try:
+                await client.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, ctx: Dict, duration: float, concurrency: int,
+                       server_pid: int) -> Dict:
+    build = SCENARIOS[name][1]
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(1 << 62))
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            method, path, kwargs = build(next(counter), ctx)
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, path, **kwargs)
+                await resp.aread()
+                ok = resp.status_code < 400
+                key = str(resp.status_code)
+            except httpx.HTTPError as e:
+                ok, key = False, type(e).__name__
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000.0)
+            else:
+                errors[key] = errors.get(key, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+    result.update(rss_kib(server_pid))
+    return result
+
+
+def print_table(results: List[Dict], baseline: Optional[Dict] = None):
+    base = {r["scenario"]: r for r in (baseline or {}).get("results", [])}
+    print(f"{'scenario':<18} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'rss MiB':>8}")
+    for r in results:
+        fmt = lambda v: f"{v:>9.2f}" if v is not None else f"{'-':>9}"  # noqa: E731
+        rss = f"{r['rss_kib'] / 1024:>8.1f}" if r.get("rss_kib") else f"{'-':>8}"
+        line = (f"{r['scenario']:<18} {r['req_per_s']:>9.1f} {fmt(r['p50_ms'])} {fmt(r['p95_ms'])} "
+                f"{fmt(r['p99_ms'])} {sum(r['errors'].values()):>7} {rss}")
+        old = base.get(r["scenario"])
+        if old and old["req_per_s"] and old.get("p95_ms") and r.get("p95_ms"):
+            line += (f"   req/s {100.0 * (r['req_per_s'] / old['req_per_s'] - 1):+.1f}%"
+                     f"  p95 {100.0 * (r['p95_ms'] / old['p95_ms'] - 1):+.1f}%")
+        print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load scenarios against a local app process")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=200000, help="visitors.db rows if it has to be generated")
+    parser.add_argument("--workdir", default=os.path.join(BENCH_DIR, "work"))
+    parser.add_argument("--latency", type=float, default=5.0, help="stand-in HTTP latency, ms")
+    parser.add_argument("--chunk-delay", type=float, default=1.0, help="stand-in slow body chunk delay, ms")
+    parser.add_argument("--nmap-delay", type=float, default=0.5, help="fake nmap run time, seconds")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier --json file to compare against")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    workdir = os.path.abspath(args.workdir)
+    prepare_workdir(workdir, args.rows)
+    tcp_port, http_port, app_port = free_port(), free_port(), free_port()
+    env = dict(os.environ, PATH=os.path.join(BENCH_DIR, "bin") + os.pathsep + os.environ.get("PATH", ""),
+               FAKE_NMAP_DELAY=str(args.nmap_delay))
+    standins = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "standins.py"),
+                                 "--tcp-port", str(tcp_port), "--http-port", str(http_port),
+                                 "--latency", str(args.latency), "--chunk-delay", str(args.chunk_delay)],
+                                stdout=subprocess.DEVNULL)
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "serve_app.py"), "--port", str(app_port)],
+                              cwd=workdir, env=env)
+    base_url = f"http://127.0.0.1:{app_port}"
+    ctx = {"tcp_port": tcp_port, "http_url": f"http://127.0.0.1:{http_port}/"}
+    results = []
+    try:
+        await wait_ready(ctx["http_url"], standins)
+        await wait_ready(base_url + "/", server)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            login = await client.post("/qhx-admin/login", data={"username": "admin", "password": "admin123"})
+            client.cookies.set("admin_session", login.cookies.get("admin_session", ""))
+            for name in names:
+                print(f"running {name}: {SCENARIOS[name][0]}", file=sys.stderr)
+                results.append(await run_scenario(client, name, ctx, args.duration, args.concurrency, server.pid))
+    finally:
+        for proc in (server, standins):
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "latency_ms": args.latency,
+            "nmap_delay_s": args.nmap_delay,
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('time')})")
+    print_table(results, baseline)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
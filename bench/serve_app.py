@@ -0,0 +1,35 @@
+"""
+Run the app for load tests: same app.main:app, but with the private-address
+block lifted (the stand-in targets live on 127.0.0.1) and a rate limit high
+enough not to throttle the load generator. Never use this to serve traffic.
+
+Run from the work directory holding visitors.db and frontend/dist:
+
+    python bench/serve_app.py --port 8100
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app.resolver  # noqa: E402
+from app import main as app_main  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app for benchmarks")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    app.resolver.is_private_address = lambda addr: False
+    app_main.rate_limiter.capacity = 1e12
+    app_main.rate_limiter.rate = 1e12
+    app_main.scan_jobs.per_ip = 1 << 30  # the load generator is a single client
+    uvicorn.run(app_main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
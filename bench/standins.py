@@ -0,0 +1,91 @@
+"""
+Local stand-in targets for the benchmarks.
+
+    TCP  accepts connections (optionally after --accept-delay ms) and closes them
+    HTTP keep-alive server; every response waits --latency ms before the
+         headers. /slow streams --body-bytes in 4 KiB chunks with --chunk-delay
+         ms between chunks; any other path returns a small body.
+
+    python bench/standins.py --latency 20 --body-bytes 1048576 --chunk-delay 5
+"""
+import argparse
+import asyncio
+
+SMALL_BODY = b"ok\n"
+CHUNK = 4096
+
+
+async def _tcp_client(reader, writer, accept_delay: float):
+    await asyncio.sleep(accept_delay)
+    writer.close()
+
+
+async def _http_client(reader, writer, latency: float, body_bytes: int, chunk_delay: float):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            path = head.split(b" ", 2)[1] if head.count(b" ") >= 2 else b"/"
+            await asyncio.sleep(latency)
+            if path.startswith(b"/slow"):
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                    b"Content-Length: %d\r\nConnection: keep-alive\r\n\r\n" % body_bytes
+                )
+                sent = 0
+                while sent < body_bytes:
+                    n = min(CHUNK, body_bytes - sent)
+                    writer.write(b"x" * n)
+                    await writer.drain()
+                    sent += n
+                    if chunk_delay:
+                        await asyncio.sleep(chunk_delay)
+            else:
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+                    b"Content-Length: %d\r\nConnection: keep-alive\r\n\r\n%s" % (len(SMALL_BODY), SMALL_BODY)
+                )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_tcp(accept_delay: float = 0.0, port: int = 0) -> asyncio.AbstractServer:
+    return await asyncio.start_server(lambda r, w: _tcp_client(r, w, accept_delay), "127.0.0.1", port)
+
+
+async def start_http(latency: float = 0.0, body_bytes: int = 1 << 20, chunk_delay: float = 0.0,
+                     port: int = 0) -> asyncio.AbstractServer:
+    return await asyncio.start_server(
+        lambda r, w: _http_client(r, w, latency, body_bytes, chunk_delay), "127.0.0.1", port
+    )
+
+
+def server_port(server: asyncio.AbstractServer) -> int:
+    return server.sockets[0].getsockname()[1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Local stand-in TCP and HTTP targets")
+    parser.add_argument("--tcp-port", type=int, default=9001)
+    parser.add_argument("--http-port", type=int, default=9002)
+    parser.add_argument("--accept-delay", type=float, default=0.0, help="ms before a TCP connection is closed")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms before each HTTP response")
+    parser.add_argument("--body-bytes", type=int, default=1 << 20, help="size of the /slow body")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="ms between /slow body chunks")
+    args = parser.parse_args()
+
+    tcp = await start_tcp(args.accept_delay / 1000.0, args.tcp_port)
+    http = await start_http(args.latency / 1000.0, args.body_bytes, args.chunk_delay / 1000.0, args.http_port)
+    print(f"tcp  127.0.0.1:{server_port(tcp)}")
+    print(f"http http://127.0.0.1:{server_port(http)}/ (slow body at /slow)")
+    async with tcp, http:
+        await asyncio.gather(tcp.serve_forever(), http.serve_forever())
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -20,7 +20,6 @@ export default function App() {
   const [liveStream, setLiveStream] = useState(false);
   const [streaming, setStreaming] = useState(false);
   const [streamPorts, setStreamPorts] = useState([]);
-  const [streamBuffer, setStreamBuffer] = useState("");
   const [loading, setLoading] = useState(false);
   const [status, setStatus] = useState(null); // 'up', 'down', or null
   const [checkType, setCheckType] = useState(null); // 'website' or 'port'
@@ -31,7 +30,6 @@ export default function App() {
   useEffect(() => {
     setOutput("Enter a URL or host to check status");
     setStreamPorts([]);
-    setStreamBuffer("");
     setLoading(false);
     setStatus(null);
     setCheckType(null);
@@ -162,7 +160,8 @@ export default function App() {
         continue;
       }
       const l = line.trim();
-      if (!l) continue;
+      // skip blank lines and trailing summary lines ("Nmap done: ...")
+      if (!/^\d+\/\w+\s/.test(l)) continue;
       // Expected format: "21/tcp   open  ftp"
       const parts = l.split(/\s+/);
       if (parts.length >= 3) {
@@ -207,51 +206,41 @@ export default function App() {
     }
     setStreaming(true);
     setStreamPorts([]);
-    setStreamBuffer("");
     const url = `/api/nmap/stream?host=${encodeURIComponent(host)}&top_ports=${ports}`;
     const es = new EventSource(url);
     esRef.current = es;
     
     es.onmessage = (e) => {
-      const d = e.data;
-      if (!d) return;
-      
-      if (d.startsWith("__DONE__")) {
-        setStreaming(false);
-        try {
-          const payload = JSON.parse(d.slice(9));
-          if (payload.returncode !== 0) {
-            setOutput(`Scan completed with errors:\n${payload.stderr}`);
-          }
-        } catch (err) {
-          // Ignore parse errors
-        }
-        if (esRef.current) {
-          esRef.current.close();
-          esRef.current = null;
-        }
+      if (!e.data) return;
+      let ev;
+      try {
+        ev = JSON.parse(e.data);
+      } catch (err) {
         return;
       }
-      
-      if (d.startsWith("__ERROR__")) {
-        setOutput(`Stream error: ${d.slice(10)}`);
+
+      if (ev.type === "port_open") {
+        // one event per open port, in the order they're found
+        setStreamPorts((prev) =>
+          [...prev, { port: ev.port, proto: ev.proto, state: "open", service: ev.service }].sort(
+            (a, b) => a.port - b.port
+          )
+        );
+        return;
+      }
+
+      if (ev.type === "done" || ev.type === "error") {
         setStreaming(false);
+        if (ev.type === "error") {
+          setOutput(`Stream error: ${ev.detail}`);
+        } else if (ev.returncode !== 0) {
+          setOutput(`Scan completed with errors:\n${ev.stderr}`);
+        }
         if (esRef.current) {
           esRef.current.close();
           esRef.current = null;
         }
-        return;
       }
-      
-      // Append to buffer and parse
-      setStreamBuffer((prev) => {
-        const next = prev + (prev ? "\n" : "") + d;
-        const portsParsed = parseNmap(next);
-        if (portsParsed.length > 0) {
-          setStreamPorts(portsParsed);
-        }
-        return next;
-      });
     };
     
     es.onerror = (err) => {
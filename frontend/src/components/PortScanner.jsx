@@ -128,36 +128,52 @@ const PortScanner = () => {
 
     setScanning(true);
     setError('');
-    const results = [];
+    setScanHistory([]);
 
-    // Scan common ports
-    for (const portInfo of commonPorts.slice(0, 5)) {
-      try {
-        const response = await fetch('/api/port', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({
-            host: clientIP,
-            port: portInfo.port,
-            timeout: 3
-          }),
-        });
-        
-        const data = await response.json();
-        results.push({
-          name: portInfo.name,
-          port: portInfo.port,
-          ...data,
-          timestamp: new Date().toLocaleTimeString()
-        });
-      } catch (err) {
-        console.error(`Error scanning port ${portInfo.port}:`, err);
+    // Scan common ports in a single batch request; results stream back as NDJSON
+    const selected = commonPorts.slice(0, 5);
+    const names = Object.fromEntries(selected.map(p => [p.port, p.name]));
+    try {
+      const response = await fetch('/api/ports/batch', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          host: clientIP,
+          ports: selected.map(p => p.port),
+          timeout: 3
+        }),
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
       }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let pending = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        pending += decoder.decode(value, { stream: true });
+        const lines = pending.split('\n');
+        pending = lines.pop();
+        for (const line of lines) {
+          if (!line) continue;
+          const data = JSON.parse(line);
+          if (data.done) continue;
+          setScanHistory(prev => [...prev, {
+            name: names[data.port],
+            ...data,
+            timestamp: new Date().toLocaleTimeString()
+          }]);
+        }
+      }
+    } catch (err) {
+      setError('Failed to scan ports. Please try again.');
+      console.error('Error scanning ports:', err);
     }
 
-    setScanHistory(results);
     setScanning(false);
   };
 